@@ -0,0 +1,166 @@
+# admission.py —— 上传限流：每进程并发上传数 / Pillow 解码数 + 所有 worker 共享的字节预算
+"""
+Admission control for uploads.
+
+Uploads are admitted or refused *before* the request body is read:
+
+- `UploadGate` limits concurrent upload requests per process and reserves
+  the request's Content-Length against a byte budget shared by every worker
+  (one small file per pid in `directory`, summed under an flock, entries of
+  dead workers ignored). A request that does not fit is refused at once with
+  `Overloaded`; nothing queues inside the worker.
+- `DecodeGate` bounds concurrent Pillow decodes per process. Waiting is
+  bounded by `timeout`, after which the upload is refused as well.
+
+Read endpoints never go through either gate, so they keep their threads and
+memory while uploads are being throttled.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only; without it the byte budget is per process
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class ByteBudget:
+    """Bytes in flight across all workers, capped at `max_bytes` (0 = unlimited)."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self._local = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def pid(self):
+        return os.getpid()  # 按调用时取：gunicorn --preload 时 fork 前后 pid 不同
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(os.path.join(self.directory, ".lock"), "a") as fh:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _others(self):
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.isdigit() or int(name) == self.pid:
+                continue
+            path = os.path.join(self.directory, name)
+            if not _alive(int(name)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as fh:
+                    total += int(fh.read() or 0)
+            except (OSError, ValueError):
+                pass
+        return total
+
+    def _write_local(self):
+        path = os.path.join(self.directory, str(self.pid))
+        with open(path, "w") as fh:
+            fh.write(str(self._local))
+
+    def in_flight(self):
+        with self._locked():
+            return self._others() + self._local
+
+    def reserve(self, nbytes):
+        """True if nbytes fit. An empty budget always admits one request, however big."""
+        if self.max_bytes <= 0:
+            return True
+        with self._locked():
+            used = self._others() + self._local
+            if used and used + nbytes > self.max_bytes:
+                return False
+            self._local += nbytes
+            self._write_local()
+            return True
+
+    def release(self, nbytes):
+        if self.max_bytes <= 0:
+            return
+        with self._locked():
+            self._local = max(0, self._local - nbytes)
+            self._write_local()
+
+
+class UploadGate:
+    def __init__(self, max_concurrent, budget, retry_after=5):
+        self.max_concurrent = max_concurrent
+        self.budget = budget
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        """Reserve a slot + nbytes or raise Overloaded. Returns a release token."""
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded("upload_slots", self.retry_after)
+        if not self.budget.reserve(nbytes):
+            self._slots.release()
+            raise Overloaded("byte_budget", self.retry_after)
+        with self._lock:
+            self._active += 1
+        return nbytes
+
+    def release(self, nbytes):
+        self.budget.release(nbytes)
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "bytes_in_flight": self.budget.in_flight(),
+            "max_bytes": self.budget.max_bytes,
+        }
+
+
+class DecodeGate:
+    def __init__(self, max_concurrent, timeout=10.0, retry_after=5):
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._sem = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def slot(self):
+        if not self._sem.acquire(timeout=self.timeout):
+            raise Overloaded("decode_slots", self.retry_after)
+        try:
+            yield
+        finally:
+            self._sem.release()
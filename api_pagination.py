@@ -0,0 +1,86 @@
+# api_pagination.py —— /api/* 用的 keyset 游标、fields 投影、紧凑 JSON
+"""
+Helpers for the read-only JSON API.
+
+Pagination is keyset based: the cursor is the sort key of the last row on the
+previous page (opaque, url-safe base64 of JSON), so each page is an indexed
+`WHERE key < :cursor ORDER BY key DESC LIMIT n` no matter how deep the client
+scrolls, instead of OFFSET scanning every earlier row.
+"""
+import json
+import base64
+from datetime import date, datetime
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(value):
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(token, kind=None):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        value = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidQuery("invalid cursor")
+    if kind is not None and not isinstance(value, kind):
+        raise InvalidQuery("invalid cursor")
+    return value
+
+
+def parse_limit(raw, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if raw in (None, ""):
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise InvalidQuery("limit must be an integer")
+    return max(1, min(maximum, limit))
+
+
+def parse_fields(raw, allowed, key):
+    """
+    `fields=a,b` → ordered list of allowed columns. The sort key is always
+    selected (the next cursor is built from it); no fields → all allowed.
+    """
+    if not raw:
+        return list(allowed)
+    fields = []
+    for name in raw.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in allowed:
+            raise InvalidQuery(f"unknown field: {name}")
+        if name not in fields:
+            fields.append(name)
+    if key not in fields:
+        fields.insert(0, key)
+    return fields
+
+
+def paginate(rows, limit, key):
+    """rows were fetched with LIMIT limit+1; returns (items, next_cursor)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][key])
+    return rows, None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+
+def dumps_compact(payload):
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=_default)
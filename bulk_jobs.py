@@ -0,0 +1,86 @@
+# bulk_jobs.py —— 后台长任务（大相册删除等）的 JSON 状态文件 + 进度
+"""
+Tiny job registry for long-running maintenance work.
+
+Each job is one JSON file in `directory`, so every gunicorn worker can report
+progress for a job another worker is running. A job records its current
+`phase`; the work function is expected to be idempotent per phase, so a job
+that failed, or whose process died (no heartbeat for `stale_after` seconds),
+is resumed simply by running it again from the recorded phase.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+
+ACTIVE = ("pending", "running")
+
+
+class JobStore:
+    def __init__(self, directory, stale_after=300):
+        self.directory = directory
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job):
+        tmp = f"{self._path(job['id'])}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "w") as fh:
+            json.dump(job, fh, separators=(",", ":"), ensure_ascii=False)
+        os.replace(tmp, self._path(job["id"]))
+
+    def create(self, kind, **fields):
+        now = time.time()
+        job = dict(fields, id=uuid.uuid4().hex, kind=kind, status="pending", phase=None,
+                   error=None, created_at=now, updated_at=now)
+        with self._lock:
+            self._write(job)
+        return job
+
+    def get(self, job_id):
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        """Merge fields into the job and refresh its heartbeat."""
+        with self._lock:
+            job = self.get(job_id) or {"id": job_id}
+            job.update(fields, updated_at=time.time())
+            self._write(job)
+            return job
+
+    def is_stale(self, job):
+        return job["status"] in ACTIVE and time.time() - job.get("updated_at", 0) > self.stale_after
+
+    def can_resume(self, job):
+        return job["status"] == "failed" or self.is_stale(job)
+
+    def find_unfinished(self, kind, **match):
+        """Most recent job of `kind` matching fields that is not done yet."""
+        found = None
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            job = self.get(name[:-len(".json")])
+            if not job or job.get("kind") != kind or job.get("status") == "done":
+                continue
+            if any(job.get(k) != v for k, v in match.items()):
+                continue
+            if found is None or job["created_at"] > found["created_at"]:
+                found = job
+        return found
+
+
+def start_background(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True, name=f"job-{getattr(target, '__name__', 'task')}")
+    thread.start()
+    return thread
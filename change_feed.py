@@ -0,0 +1,86 @@
+# change_feed.py —— 增量变更流：change_log 表由触发器写入，客户端按游标拉取
+"""
+Change feed for polling clients.
+
+Every insert / update / delete on `photo` and `story` (and on story images,
+logged as an update of their story) appends a row to `change_log` from a
+database trigger, so bulk statements (delete_album's single DELETE,
+relocate's single UPDATE) and every code path that writes rows are covered
+without touching them. Deletes leave a tombstone (op = "delete").
+
+The cursor is [txid, id] of the last delivered row. `id` is assigned when
+the row is inserted, not when its transaction commits, so on Postgres the
+feed is ordered by (writing transaction, id) and only returns rows whose
+transaction is older than the snapshot xmin (finished): a transaction still
+in flight can only add rows after every cursor handed out so far. SQLite
+serializes writers, so its txid is always 0 and id order is commit order.
+
+`flask prune-changes` deletes every row before the last one older than the
+retention window, in feed order, and keeps that row as a marker with
+op = "pruned"; a cursor behind the newest marker has missed deleted rows.
+
+Triggers are plain SQL so the same feed works for the local SQLite database
+(created via the migration or the `after_create` hook in main.py) and for
+Supabase Postgres (SQL in migrations/versions/8d3f0a6c2b71_*).
+"""
+
+
+PRUNED = "pruned"  # op of the marker row prune-changes keeps
+
+
+def sqlite_trigger_statements(image_table="story_image"):
+    photo = """
+CREATE TRIGGER IF NOT EXISTS change_log_photo_{event} AFTER {event} ON photo
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('photo', {row}.id, '{op}', {row}.album, COALESCE({row}.is_private, 0), CURRENT_TIMESTAMP);
+END"""
+    story = """
+CREATE TRIGGER IF NOT EXISTS change_log_story_{event} AFTER {event} ON story
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('story', {row}.id, '{op}', NULL, 0, CURRENT_TIMESTAMP);
+END"""
+    # 图片变动 = story 更新；story 本身已经删了（级联删除图片）时不再记
+    image = """
+CREATE TRIGGER IF NOT EXISTS change_log_{table}_{event} AFTER {event} ON {table}
+WHEN EXISTS (SELECT 1 FROM story WHERE id = {row}.story_id)
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('story', {row}.story_id, 'upsert', NULL, 0, CURRENT_TIMESTAMP);
+END"""
+    statements = []
+    for event, row, op in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+        statements.append(photo.format(event=event, row=row, op=op))
+        statements.append(story.format(event=event, row=row, op=op))
+        statements.append(image.format(event=event, row=row, table=image_table))
+    return statements
+
+
+def feed_cursor(row):
+    return [row.get("txid") or 0, row["id"]]
+
+
+def valid_cursor(cursor):
+    return (isinstance(cursor, list) and len(cursor) == 2
+            and all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in cursor))
+
+
+def cursor_expired(pruned, cursor):
+    """
+    True when rows after the cursor may already have been pruned. `pruned`
+    is the [txid, id] of the newest prune marker (None if the log was never
+    pruned); everything before it in feed order is gone.
+    """
+    return pruned is not None and list(cursor) < list(pruned)
+
+
+def collapse(rows):
+    """
+    Keep only the latest change per (entity, id), in feed order: a photo
+    inserted, updated and deleted within one page is a single tombstone.
+    """
+    latest = {}
+    for row in rows:
+        latest[(row["entity"], row["entity_id"])] = row
+    return sorted(latest.values(), key=feed_cursor)
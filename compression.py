@@ -0,0 +1,250 @@
+# compression.py —— gzip / brotli 响应压缩（WSGI 中间件，支持流式响应）+ 静态文件预压缩
+"""
+Response compression.
+
+`CompressionMiddleware` wraps the WSGI app, so it sees the final response
+after every Flask hook (profiler, query budget, ...) and works the same for
+buffered and streamed bodies:
+
+- the encoding is negotiated from Accept-Encoding (q-values honoured,
+  brotli preferred when the optional `brotli` package is installed);
+- only compressible content types, 2xx responses without an existing
+  Content-Encoding or Cache-Control: no-transform are touched;
+- bodies below `min_size` are sent as is (for streamed bodies the first
+  chunks are buffered until the threshold is reached);
+- streamed bodies are flushed per chunk (Z_SYNC_FLUSH / brotli flush), so
+  progressive rendering is preserved.
+
+Static text assets are compressed once, not per request: `precompress()`
+writes `<file>.br` / `<file>.gz` next to the original (build step or first
+request), and the static view serves those directly.
+"""
+import os
+import zlib
+
+try:
+    import brotli  # 可选依赖；没有就只用 gzip
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/html", "text/css", "text/plain", "text/xml", "text/javascript",
+    "application/json", "application/javascript", "application/xml", "image/svg+xml",
+)
+STATIC_EXTENSIONS = (".css", ".js", ".svg", ".json", ".txt", ".html", ".map")
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli else ("gzip",)
+
+
+def negotiate(accept_encoding, available=None):
+    """Best encoding from an Accept-Encoding header, or None (identity)."""
+    available = available or available_encodings()
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    best, best_q = None, 0.0
+    for enc in available:  # available 的顺序就是服务端偏好
+        q = accepted.get(enc, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding, gzip_level, br_quality):
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=br_quality, lgwin=22)
+            self._process, self._flush, self._finish = self._c.process, self._c.flush, self._c.finish
+        else:
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # 31 = gzip 头
+            self._process = self._c.compress
+            self._flush = lambda: self._c.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._c.flush
+
+    def compress(self, data):
+        return self._process(data)
+
+    def chunk(self, data):
+        """Compress and flush, so the client can render what it has so far."""
+        return self._process(data) + self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+def compress_bytes(data, encoding, gzip_level=6, br_quality=5):
+    c = _Compressor(encoding, gzip_level, br_quality)
+    return c.compress(data) + c.finish()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for k, v in headers:
+        if k.lower() == name:
+            return v
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_size=1024, gzip_level=5, br_quality=4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.br_quality = br_quality
+
+    def _compressible(self, status, headers):
+        if not status.startswith("2") or status.startswith("204") or status.startswith("206"):
+            return False
+        if _header(headers, "Content-Encoding"):
+            return False
+        if "no-transform" in (_header(headers, "Cache-Control") or ""):
+            return False
+        ctype = (_header(headers, "Content-Type") or "").split(";")[0].strip().lower()
+        if ctype not in COMPRESSIBLE_TYPES:
+            return False
+        length = _header(headers, "Content-Length")
+        return not (length is not None and length.isdigit() and int(length) < self.min_size)
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+
+        captured = {}
+
+        def _start(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return lambda data: captured.setdefault("written", []).append(data)
+
+        app_iter = self.app(environ, _start)
+        if "status" not in captured:
+            # 生成器形式的 app 第一次迭代时才调用 start_response（PEP 3333 允许）
+            chunks = iter(app_iter)
+            first = next(chunks, None)
+            captured.setdefault("written", []).extend([first] if first is not None else [])
+            app_iter = _Chain([], chunks, close_from=app_iter)
+        if not self._compressible(captured["status"], captured["headers"]):
+            start_response(captured["status"], captured["headers"], captured["exc_info"])
+            return _prepend(captured.get("written"), app_iter)
+        return self._compress(encoding, captured, app_iter, start_response)
+
+    def _compress(self, encoding, captured, app_iter, start_response):
+        status, headers = captured["status"], list(captured["headers"])
+        chunks = iter(_prepend(captured.get("written"), app_iter))
+        try:
+            # 有 Content-Length（普通响应）就整个读进来；流式响应攒到阈值再决定，
+            # 整个 body 都不到 min_size 就原样发
+            buffered = _header(headers, "Content-Length") is not None
+            head, size, exhausted = [], 0, False
+            while buffered or size < self.min_size:
+                try:
+                    data = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                head.append(data)
+                size += len(data)
+            if exhausted and size < self.min_size:
+                start_response(status, headers, captured["exc_info"])
+                yield from head
+                return
+
+            headers = [(k, v) for k, v in headers if k.lower() != "content-length"]
+            headers.append(("Content-Encoding", encoding))
+            vary = _header(headers, "Vary")
+            if vary is None:
+                headers.append(("Vary", "Accept-Encoding"))
+            elif "accept-encoding" not in vary.lower():
+                headers = [(k, f"{v}, Accept-Encoding" if k.lower() == "vary" else v) for k, v in headers]
+            etag = _header(headers, "ETag")
+            if etag and not etag.startswith("W/"):
+                headers = [(k, f"W/{v}" if k.lower() == "etag" else v) for k, v in headers]
+
+            compressor = _Compressor(encoding, self.gzip_level, self.br_quality)
+            if exhausted:
+                body = compressor.compress(b"".join(head)) + compressor.finish()
+                headers.append(("Content-Length", str(len(body))))
+                start_response(status, headers, captured["exc_info"])
+                yield body
+                return
+
+            start_response(status, headers, captured["exc_info"])
+            yield compressor.chunk(b"".join(head))
+            for data in chunks:
+                if data:
+                    yield compressor.chunk(data)
+            yield compressor.finish()
+        finally:
+            close = getattr(app_iter, "close", None)
+            if close:
+                close()
+
+
+def _prepend(written, app_iter):
+    if not written:
+        return app_iter
+    return _Chain(written, app_iter)
+
+
+class _Chain:
+    """written + app_iter, keeping app_iter.close() reachable for the server."""
+
+    def __init__(self, first, app_iter, close_from=None):
+        self.first = first
+        self.app_iter = app_iter
+        self.close_from = close_from if close_from is not None else app_iter
+
+    def __iter__(self):
+        yield from self.first
+        yield from self.app_iter
+
+    def close(self):
+        close = getattr(self.close_from, "close", None)
+        if close:
+            close()
+
+
+# --------------------------
+# Static precompression
+# --------------------------
+def precompress(path, encodings=None, gzip_level=9, br_quality=11):
+    """Write <path>.br / <path>.gz if missing or older than path. Returns the files written."""
+    written = []
+    mtime = os.path.getmtime(path)
+    data = None
+    for enc in encodings or available_encodings():
+        target = path + EXTENSIONS[enc]
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        if data is None:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        tmp = f"{target}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as fh:
+            fh.write(compress_bytes(data, enc, gzip_level, br_quality))
+        os.replace(tmp, target)
+        written.append(target)
+    return written
+
+
+def iter_static_assets(root, skip_dirs=("uploads",)):
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.relpath(dirpath, root) == ".":
+            dirnames[:] = [d for d in dirnames if d not in skip_dirs]
+        for name in filenames:
+            if name.endswith(STATIC_EXTENSIONS):
+                yield os.path.join(dirpath, name)
@@ -0,0 +1,181 @@
+# contact_sheet.py —— /album 封面拼图（每页相册一张 sprite + 坐标表）
+"""
+Contact sheets for the album index.
+
+Albums are split into pages of about `per_page`; each page gets one JPEG
+sprite whose tiles are the covers center-cropped to TILE_W x TILE_H, plus a
+JSON map of tile positions. The sheet key is a hash of the page's
+(album, cover) list, so a changed cover only changes the key of its own
+page: that page is rebuilt (tiles of unchanged covers come from the tile
+cache), every other page keeps its file and URL, and the files can be served
+as immutable.
+
+Page boundaries are content-defined, not positional: a page ends after an
+album whose name hashes to 0 mod per_page (capped at 2 * per_page). Adding
+or removing an album therefore only changes the page it lands in, instead of
+shifting every later page and invalidating their sheets.
+
+Sheets are built on a background thread; until a page's sheet exists the
+caller falls back to plain cover <img> tags for that page. Workers building
+the same page serialize on a SingleFlight lock and re-check for the finished
+sheet, so each sheet is built once across gunicorn workers.
+"""
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from image_proxy import DiskLRUCache, SingleFlight
+
+logger = logging.getLogger("xialens.sprites")
+
+TILE_W, TILE_H = 360, 270
+SHEET_VERSION = 1  # 改了布局 / 编码参数时 +1，让所有 key 失效
+
+
+class ContactSheets:
+    def __init__(self, directory, fetch, per_page=24, columns=6, quality=80,
+                 tile_cache_bytes=64 * 1024 * 1024, ttl=7 * 86400):
+        self.directory = directory
+        self.fetch = fetch  # fetch(url) -> bytes
+        self.per_page = per_page
+        self.columns = columns
+        self.quality = quality
+        self.ttl = ttl
+        self.tiles = DiskLRUCache(os.path.join(directory, "tiles"), tile_cache_bytes)
+        self.flight = SingleFlight(os.path.join(directory, ".locks"))
+        self._lock = threading.Lock()
+        self._building = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="contact-sheet")
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------- keys / paths ----------
+    @staticmethod
+    def sheet_key(entries):
+        raw = json.dumps([SHEET_VERSION, TILE_W, TILE_H, entries], separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+    def path(self, key, ext="jpg"):
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def _page_ends_after(self, name):
+        digest = hashlib.sha1(name.encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") % self.per_page == 0
+
+    def split(self, entries):
+        """Split [(album, cover), ...] into pages whose boundaries depend on album names only."""
+        page = []
+        for entry in entries:
+            page.append(entry)
+            if len(page) >= 2 * self.per_page or self._page_ends_after(entry[0]):
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def grid(self, count):
+        cols = min(self.columns, max(count, 1))
+        rows = (count + cols - 1) // cols
+        return cols, rows
+
+    # ---------- build ----------
+    def _tile(self, url):
+        key = hashlib.sha256(f"{url}|{TILE_W}x{TILE_H}".encode("utf-8")).hexdigest()
+        cached = self.tiles.get(key)
+        if cached is not None:
+            return Image.open(io.BytesIO(cached))
+        img = Image.open(io.BytesIO(self.fetch(url)))
+        if img.format == "JPEG":
+            img.draft("RGB", (TILE_W * 2, TILE_H * 2))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        tile = ImageOps.fit(img, (TILE_W, TILE_H), Image.LANCZOS)
+        out = io.BytesIO()
+        tile.save(out, format="JPEG", quality=90)
+        self.tiles.put(key, out.getvalue())
+        return tile
+
+    def build(self, entries):
+        """entries: [(album_name, cover_url), ...] for one page. Writes <key>.jpg + <key>.json."""
+        key = self.sheet_key(entries)
+        cols, rows = self.grid(len(entries))
+        sheet = Image.new("RGB", (cols * TILE_W, rows * TILE_H), (246, 247, 249))
+        positions = {}
+        for i, (name, url) in enumerate(entries):
+            col, row = i % cols, i // cols
+            try:
+                sheet.paste(self._tile(url), (col * TILE_W, row * TILE_H))
+                positions[name] = [col, row]
+            except Exception as e:
+                logger.warning("contact sheet: cover for %s failed: %s", name, e)
+
+        jpg_tmp = self.path(key, f"jpg.tmp-{os.getpid()}")
+        sheet.save(jpg_tmp, format="JPEG", quality=self.quality, optimize=True, progressive=True)
+        meta = {"key": key, "cols": cols, "rows": rows, "tile": [TILE_W, TILE_H], "positions": positions}
+        json_tmp = self.path(key, f"json.tmp-{os.getpid()}")
+        with open(json_tmp, "w") as fh:
+            json.dump(meta, fh, separators=(",", ":"), ensure_ascii=False)
+        os.replace(jpg_tmp, self.path(key))
+        os.replace(json_tmp, self.path(key, "json"))  # json 最后落盘：它存在 = sheet 完整
+        return meta
+
+    def _build_async(self, key, entries):
+        try:
+            # 别的 worker 可能同时在建同一页：拿到锁后先看 sheet 是不是已经有了
+            self.flight.do(key, lambda: self.load(key) or self.build(entries))
+            self.prune()
+        except Exception:
+            logger.exception("contact sheet build failed")
+        finally:
+            with self._lock:
+                self._building.discard(key)
+
+    # ---------- lookup ----------
+    def load(self, key):
+        try:
+            with open(self.path(key, "json")) as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(self.path(key, "json"), None)  # prune 按最近使用时间
+        except OSError:
+            pass
+        return meta
+
+    def pages(self, albums):
+        """
+        albums: [{"name", "cover"}, ...]. Returns one (entries, meta or None)
+        per page, scheduling a background build for pages without a sheet.
+        """
+        with_cover = [(a["name"], a["cover"]) for a in albums if a.get("cover")]
+        result = []
+        for entries in self.split(with_cover):
+            key = self.sheet_key(entries)
+            meta = self.load(key)
+            if meta is None:
+                with self._lock:
+                    if key not in self._building:
+                        self._building.add(key)
+                        self._executor.submit(self._build_async, key, entries)
+            result.append((entries, meta))
+        return result
+
+    def prune(self):
+        """Remove sheets not used for `ttl` seconds."""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    os.remove(path[:-len(".json")] + ".jpg")
+            except OSError:
+                pass
@@ -0,0 +1,105 @@
+# gc_orphans.py —— 孤儿对象 / 悬空行的 GC 辅助（引用集合、Cloudinary 分页、限速）
+"""
+Pure helpers for `flask --app main gc-orphans`.
+
+Objects and rows are compared by *key*: a storage key (see
+storage_sync.storage_key) for Supabase / local files and a Cloudinary public
+id for story images. Objects modified and rows created within the grace
+period are never collected, so uploads that are still in flight (signed
+direct uploads, resumable finalize) are left alone.
+
+A listing pass is not a snapshot: uploads shift its pages and a move
+(/photos/relocate) can land between the row pass and the storage pass. So
+the row set is read again after the listing (an object referenced by either
+pass is kept), and every "dangling" row is re-read and its object checked
+with a direct existence lookup right before it is deleted.
+"""
+import re
+import time
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, unquote
+
+CLOUDINARY_PAGE_SIZE = 500
+CLOUDINARY_DELETE_BATCH = 100  # Admin API 单次 delete_resources 上限
+
+_VERSION_RE = re.compile(r"^v\d+$")
+_TRANSFORM_RE = re.compile(r"^[a-z]{1,3}_[^/]*$")
+
+
+class RateLimiter:
+    """Allow at most `rate` calls per second (rate <= 0 disables limiting)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def cloudinary_public_id(url):
+    """public id ("story/abc") of a Cloudinary delivery url, or None."""
+    parsed = urlparse(url or "")
+    if "cloudinary.com" not in parsed.netloc or "/upload/" not in parsed.path:
+        return None
+    segments = unquote(parsed.path.split("/upload/", 1)[1]).split("/")
+    # 版本号（v1699999999）之后就是 public id；没有版本号时去掉开头的 transformation（w_320,c_fill）
+    for i, seg in enumerate(segments[:-1]):
+        if _VERSION_RE.match(seg):
+            segments = segments[i + 1:]
+            break
+    else:
+        while len(segments) > 1 and _TRANSFORM_RE.match(segments[0]):
+            segments = segments[1:]
+    path = "/".join(segments)
+    return path.rsplit(".", 1)[0] if "." in segments[-1] else path
+
+
+def iter_cloudinary_resources(api, prefix, page_size=CLOUDINARY_PAGE_SIZE, limiter=None):
+    """Yield every uploaded resource under prefix, following next_cursor."""
+    cursor = None
+    while True:
+        if limiter:
+            limiter.wait()
+        kwargs = {"type": "upload", "prefix": prefix, "max_results": page_size}
+        if cursor:
+            kwargs["next_cursor"] = cursor
+        resp = api.resources(**kwargs)
+        for res in resp.get("resources", []):
+            yield res
+        cursor = resp.get("next_cursor")
+        if not cursor:
+            return
+
+
+def older_than(timestamp, cutoff):
+    """
+    timestamp: epoch seconds, datetime or ISO-8601 string (naive = UTC, like
+    the utcnow() column defaults); unknown → treated as new.
+    """
+    if timestamp is None or timestamp == "":
+        return False
+    if isinstance(timestamp, (int, float)):
+        return timestamp < cutoff
+    if not isinstance(timestamp, datetime):
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            return False
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp() < cutoff
+
+
+def batched(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,115 @@
+# image_meta.py —— 只读文件头拿到尺寸 / MIME / EXIF 方向（不解码像素）
+"""
+Header-only image probing.
+
+`Image.open` only parses the header (JPEG markers up to SOF, PNG IHDR, ...),
+so probing never decodes pixels. Remote objects are read with HTTP Range
+requests: first HEADER_PROBE_BYTES, then a larger window if the header did
+not fit (e.g. a big EXIF/ICC block in front of the JPEG frame).
+"""
+import io
+import os
+import re
+import urllib.request
+
+from PIL import Image, UnidentifiedImageError
+
+from image_proxy import local_static_path
+
+HEADER_PROBE_BYTES = 64 * 1024
+MAX_PROBE_BYTES = 1024 * 1024
+EXIF_ORIENTATION = 0x0112
+
+_CONTENT_RANGE_RE = re.compile(r"bytes \d+-\d+/(\d+)")
+
+
+def probe_image(data):
+    """{width, height, mime_type, orientation} from (partial) image bytes; None if unreadable."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            try:
+                orientation = int(img.getexif().get(EXIF_ORIENTATION, 1) or 1)
+            except Exception:
+                orientation = 1
+            return {
+                "width": img.width,
+                "height": img.height,
+                "mime_type": Image.MIME.get(img.format),
+                "orientation": orientation if 1 <= orientation <= 8 else 1,
+            }
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+def display_size(width, height, orientation):
+    """Size as shown after EXIF rotation (orientations 5-8 swap the axes)."""
+    if width and height and orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def probe_bytes(data):
+    """Metadata for a complete file already in memory (upload path)."""
+    meta = probe_image(data)
+    if meta is None:
+        return {}
+    meta["byte_size"] = len(data)
+    return meta
+
+
+def probe_local(path):
+    size = os.path.getsize(path)
+    window = HEADER_PROBE_BYTES
+    with open(path, "rb") as fh:
+        while True:
+            fh.seek(0)
+            meta = probe_image(fh.read(window))
+            if meta is not None or window >= min(size, MAX_PROBE_BYTES):
+                break
+            window = MAX_PROBE_BYTES
+    if meta is None:
+        return {}
+    meta["byte_size"] = size
+    return meta
+
+
+def _fetch_range(url, length, timeout):
+    req = urllib.request.Request(url, headers={
+        "Range": f"bytes=0-{length - 1}",
+        "User-Agent": "XiaLens-meta-probe",
+    })
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        total = None
+        match = _CONTENT_RANGE_RE.match(resp.headers.get("Content-Range") or "")
+        if match:
+            total = int(match.group(1))
+        elif resp.status == 200 and resp.headers.get("Content-Length"):
+            total = int(resp.headers["Content-Length"])  # server ignored Range
+        # 即使服务器忽略 Range 也只读前 length 字节
+        return resp.read(length), total
+
+
+def fetch_header(url, timeout=15):
+    """
+    (leading bytes, total size or None) of a remote object: HEADER_PROBE_BYTES,
+    or MAX_PROBE_BYTES when the image header did not fit. HTTPError if missing.
+    """
+    data, total = _fetch_range(url, HEADER_PROBE_BYTES, timeout)
+    if probe_image(data) is None and len(data) >= HEADER_PROBE_BYTES and (total is None or total > len(data)):
+        data, total = _fetch_range(url, MAX_PROBE_BYTES, timeout)
+    return data, total
+
+
+def probe_url(url, static_root, timeout=15):
+    """Metadata for a stored photo url (local static file or remote object)."""
+    local = local_static_path(url, static_root)
+    if local:
+        return probe_local(local)
+    if not (url or "").startswith(("http://", "https://")):
+        return {}
+    data, total = fetch_header(url, timeout)
+    meta = probe_image(data)
+    if meta is None:
+        return {}
+    meta["byte_size"] = total
+    return meta
@@ -0,0 +1,486 @@
+# image_proxy.py —— /img/<photo_id> 按需缩放 + 本地磁盘缓存
+"""
+On-demand image resizing for photos that have no pre-built thumbnails.
+
+- DiskLRUCache: content-addressed files on local disk, evicted by total bytes
+  in least-recently-used order; the bound holds for the whole directory, not
+  per worker.
+- SingleFlight: concurrent misses for the same key wait for one leader
+  (threads in-process, a per-key in-flight marker across gunicorn workers).
+- render_variant: Pillow resize / re-encode of a source image.
+"""
+import io
+import os
+import time
+import hashlib
+import threading
+import urllib.request
+from collections import OrderedDict
+from contextlib import nullcontext
+from urllib.parse import urlparse, unquote
+
+from PIL import Image, ImageOps
+
+try:
+    import fcntl  # POSIX only; single-flight degrades to per-process elsewhere
+except ImportError:
+    fcntl = None
+
+
+# --------------------------
+# Variant parameters
+# --------------------------
+# widths are snapped to this ladder so arbitrary ?w= values can't blow up the cache
+VARIANT_WIDTHS = (160, 320, 480, 640, 800, 1080, 1280, 1600, 2048)
+VARIANT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+DEFAULT_QUALITY = 80
+
+
+def snap_width(width):
+    """Round a requested width up to the nearest allowed variant width."""
+    if not width or width <= 0:
+        return VARIANT_WIDTHS[-1]
+    for w in VARIANT_WIDTHS:
+        if width <= w:
+            return w
+    return VARIANT_WIDTHS[-1]
+
+
+def normalize_params(width=None, fmt=None, quality=None):
+    """Return (width, fmt, quality) clamped to supported values."""
+    fmt = (fmt or "jpeg").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in VARIANT_FORMATS:
+        fmt = "jpeg"
+    try:
+        quality = int(quality) if quality is not None else DEFAULT_QUALITY
+    except (TypeError, ValueError):
+        quality = DEFAULT_QUALITY
+    quality = max(30, min(95, quality))
+    return snap_width(width), fmt, quality
+
+
+def variant_key(source_url, width, fmt, quality):
+    """Cache key for one rendered variant (stable across workers/restarts)."""
+    raw = f"{source_url}|w={width}|f={fmt}|q={quality}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def source_key(source_url):
+    return "src-" + hashlib.sha256(source_url.encode("utf-8")).hexdigest()
+
+
+# --------------------------
+# Disk cache (LRU by total bytes)
+# --------------------------
+class DiskLRUCache:
+    """
+    Size-bounded cache of immutable blobs on local disk.
+
+    Each worker keeps an in-memory index (rebuilt from file mtimes on start)
+    and evicts from it on put; files evicted by another worker are detected
+    on lookup and dropped from the index. Workers share the directory, so
+    every `max_bytes / SWEEP_FRACTION` bytes written a worker also sweeps the
+    directory itself (flock, one sweeper at a time): least recently used
+    files (hits touch the mtime) are removed until the whole directory fits,
+    and the index is resynced with what is on disk.
+    """
+
+    SWEEP_FRACTION = 16
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> size, oldest first
+        self._total = 0
+        self._written = 0  # 上次 sweep 之后本进程写入的字节数
+        self._sweep_lock = os.path.join(root, ".locks", "sweep.lock")
+        os.makedirs(os.path.dirname(self._sweep_lock), exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[-2:], key)
+
+    def _scan(self):
+        """[(mtime, key, size), ...] of every cached file, oldest first."""
+        entries = []
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                if shard.name.startswith(".") or not shard.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    with os.scandir(shard.path) as it:
+                        for entry in it:
+                            if entry.name.startswith(".tmp-") or not entry.is_file(follow_symlinks=False):
+                                continue
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            entries.append((st.st_mtime, entry.name, st.st_size))
+                except OSError:
+                    continue
+        entries.sort()
+        return entries
+
+    def _load(self):
+        for _, name, size in self._scan():
+            self._index[name] = size
+            self._total += size
+
+    def sweep(self):
+        """Evict across workers until the directory is under max_bytes (skipped if another worker is sweeping)."""
+        with open(self._sweep_lock, "a") as lock_fh:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+            try:
+                entries = self._scan()
+                total = sum(size for _, _, size in entries)
+                index = OrderedDict()
+                for _, name, size in entries:
+                    if total > self.max_bytes:
+                        try:
+                            os.remove(self._path(name))
+                        except FileNotFoundError:
+                            pass
+                        except OSError:
+                            index[name] = size
+                            continue
+                        total -= size
+                        continue
+                    index[name] = size
+                with self._lock:
+                    self._index = index
+                    self._total = total
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    @property
+    def total_bytes(self):
+        return self._total
+
+    def __len__(self):
+        return len(self._index)
+
+    def path_for(self, key):
+        """Return the on-disk path of a cached key, or None (counts hit/miss)."""
+        path = self._path(key)
+        with self._lock:
+            if os.path.exists(path):
+                if key in self._index:
+                    self._index.move_to_end(key)
+                else:
+                    size = os.path.getsize(path)
+                    self._index[key] = size
+                    self._total += size
+                self.hits += 1
+                try:
+                    os.utime(path, None)  # keep recency across restarts
+                except OSError:
+                    pass
+                return path
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._total -= size
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        path = self.path_for(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as fh:
+                return fh.read()
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        """Atomically store bytes under key and evict until under max_bytes."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(path), f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._total -= old
+            self._index[key] = len(data)
+            self._total += len(data)
+            self._evict_locked(keep=key)
+            self._written += len(data)
+            sweep = self._written * self.SWEEP_FRACTION >= self.max_bytes
+            if sweep:
+                self._written = 0
+        if sweep:
+            self.sweep()
+        return path
+
+    def delete(self, key):
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None:
+                self._total -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict_locked(self, keep=None):
+        while self._total > self.max_bytes and self._index:
+            key, size = next(iter(self._index.items()))
+            if key == keep and len(self._index) == 1:
+                break
+            self._index.pop(key)
+            self._total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# --------------------------
+# Single-flight
+# --------------------------
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one execution.
+
+    Threads in this process share the leader's result. Across worker
+    processes the leader owns an in-flight marker file for the key while fn
+    runs; other workers poll until the marker is gone and then run fn
+    themselves, which is expected to re-check the cache first (see `fill`).
+    Checking and creating the marker happens under an flock on one of
+    `stripes` lock files, held only for that check, never during fn, so
+    unrelated keys on the same stripe don't wait for each other's fetches.
+    Markers are removed when fn returns; a marker left by a crashed worker
+    (pid gone, or older than `stale_after` seconds) is taken over.
+    """
+
+    def __init__(self, lock_dir=None, stripes=64, poll=0.05, stale_after=300):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.poll = poll
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._calls = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def _stripe_path(self, digest):
+        return os.path.join(self.lock_dir, f"stripe-{int.from_bytes(digest[:4], 'big') % self.stripes:03d}.lock")
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_locked(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _busy(self, marker):
+        try:
+            st = os.stat(marker)
+            with open(marker) as fh:
+                pid = int(fh.read().strip() or 0)
+        except (OSError, ValueError):
+            return False
+        if time.time() - st.st_mtime > self.stale_after:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False  # 持有者已经挂了
+        except OSError:
+            pass
+        return True
+
+    def _claim(self, digest, marker):
+        """Take the marker if nobody holds it; the stripe flock makes check + create atomic across workers."""
+        with open(self._stripe_path(digest), "a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                if self._busy(marker):
+                    return False
+                with open(marker, "w") as fh:
+                    fh.write(str(os.getpid()))
+                return True
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    def _run_locked(self, key, fn):
+        if not (self.lock_dir and fcntl):
+            return fn()
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        marker = os.path.join(self.lock_dir, f"{digest.hex()}.inflight")
+        while not self._claim(digest, marker):
+            time.sleep(self.poll)
+        try:
+            return fn()
+        finally:
+            try:
+                os.remove(marker)
+            except OSError:
+                pass
+
+
+def fill(cache, flight, key, produce):
+    """Return cached bytes for key, producing them at most once on a miss."""
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    def _produce():
+        # another worker may have filled it while we waited on the lock
+        path = cache._path(key)
+        if os.path.exists(path):
+            with open(path, "rb") as fh:
+                return fh.read()
+        blob = produce()
+        cache.put(key, blob)
+        return blob
+
+    return flight.do(key, _produce)
+
+
+# --------------------------
+# Source fetch + render
+# --------------------------
+def local_static_path(url, static_root):
+    """Map a /static/... URL onto a file under static_root, or None."""
+    path = unquote(urlparse(url).path or "")
+    if not path.startswith("/static/"):
+        return None
+    rel = path[len("/static/"):]
+    full = os.path.realpath(os.path.join(static_root, rel))
+    if not full.startswith(os.path.realpath(static_root) + os.sep):
+        return None
+    return full if os.path.isfile(full) else None
+
+
+def read_source(url, static_root, timeout=20):
+    """Read original image bytes from local static files or over HTTP(S)."""
+    local = local_static_path(url, static_root)
+    if local:
+        with open(local, "rb") as fh:
+            return fh.read()
+    if not url.startswith(("http://", "https://")):
+        raise ValueError(f"unsupported source url: {url}")
+    req = urllib.request.Request(url, headers={"User-Agent": "XiaLens-img-proxy"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read()
+
+
+def render_variant(source_bytes, width, fmt, quality):
+    """Decode, orient, downscale and re-encode one variant. Returns bytes."""
+    pil_format, _ = VARIANT_FORMATS[fmt]
+    img = Image.open(io.BytesIO(source_bytes))
+    if img.format == "JPEG":
+        # DCT-domain downscale while decoding: much cheaper than a full decode
+        img.draft("RGB", (width, width))
+    img = ImageOps.exif_transpose(img)
+
+    if img.width > width:
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+
+    if pil_format == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+    elif pil_format != "JPEG" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+
+    out = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    else:
+        img.save(out, format=pil_format, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+class ImageProxy:
+    """Glue: cache + single-flight for both the source fetch and the variant."""
+
+    def __init__(self, cache_dir, max_bytes, static_root, timer=None, fetch=None, cache_sources=True):
+        self.cache = DiskLRUCache(cache_dir, max_bytes)
+        # 缩略图的 fill 里会再 fill 原图：两层各用一个 SingleFlight（marker 分目录，互不排队）
+        self.flight = SingleFlight(os.path.join(cache_dir, ".locks"))
+        self.source_flight = SingleFlight(os.path.join(cache_dir, ".locks", "source"))
+        self.static_root = static_root
+        # timer(category) -> context manager; used for per-request timing
+        self.timer = timer or (lambda category: nullcontext())
+        # fetch(url) -> bytes. cache_sources: bool, or cache_sources(url) -> bool; False for
+        # sources that are already on local disk or behind a cache of their own
+        self.fetch = fetch or (lambda url: read_source(url, self.static_root))
+        self.cache_sources = cache_sources if callable(cache_sources) else (lambda url: cache_sources)
+
+    def _fetch(self, url):
+        with self.timer("storage"):
+            return self.fetch(url)
+
+    def _render(self, url, width, fmt, quality):
+        source = self.source(url)
+        with self.timer("pillow"):
+            return render_variant(source, width, fmt, quality)
+
+    def source(self, url):
+        if not self.cache_sources(url):
+            return self._fetch(url)
+        return fill(self.cache, self.source_flight, source_key(url), lambda: self._fetch(url))
+
+    def variant(self, url, width=None, fmt=None, quality=None):
+        """Return (bytes, mimetype, etag) for a resized variant of url."""
+        width, fmt, quality = normalize_params(width, fmt, quality)
+        key = variant_key(url, width, fmt, quality)
+        data = fill(self.cache, self.flight, key, lambda: self._render(url, width, fmt, quality))
+        return data, VARIANT_FORMATS[fmt][1], key
@@ -0,0 +1,322 @@
+# instrumentation.py —— 每个请求的耗时拆分（DB / Supabase / Storage / Cloudinary / Pillow / 模板）
+"""
+Lightweight per-request timing.
+
+    with timed("cloudinary"):
+        cloudinary.uploader.upload(...)
+
+Totals per category are kept on `flask.g` and emitted at the end of the
+request as a `Server-Timing` header plus one structured (JSON) log line.
+Outside a request context only the registered listeners (metrics) see the
+timing, so helpers can be called from scripts and background threads unchanged.
+Work fanned out to a thread pool during a request is counted for that request
+when each task runs through `in_request(fn)`.
+"""
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+timing_logger = logging.getLogger("xialens.timing")
+
+# Server-Timing 里的固定顺序
+CATEGORIES = ("db", "supabase", "storage", "cloudinary", "pillow", "template")
+
+
+# --------------------------
+# Recording
+# --------------------------
+def _timings():
+    if not has_request_context():
+        return None
+    t = getattr(g, "_timings", None)
+    if t is None:
+        t = g._timings = {}
+    return t
+
+
+_record_lock = threading.Lock()  # in_request() 的线程池会并发写同一个请求的 totals
+
+
+def record(category, seconds, error=False):
+    """Add one call of `seconds` to the current request's category total."""
+    for listener in _listeners:
+        listener(category, seconds, error)
+    t = _timings()
+    if t is None:
+        return
+    with _record_lock:
+        entry = t.get(category)
+        if entry is None:
+            t[category] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+def in_request(fn):
+    """
+    Wrap fn so each call runs in a copy of the caller's contextvars, i.e. with
+    the caller's Flask request / app context (and `g`): timings and query
+    shapes recorded in pool threads land on the request. Call it in the
+    request thread. copy_current_request_context would push a new app context
+    (a new `g`) in the worker. The pooled work must not use db.session, which
+    is scoped to the shared app context.
+    """
+    ctx = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        # 同一个 Context 不能被两个线程同时进入：每次调用各跑在一份拷贝里
+        return ctx.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+_listeners = []
+
+
+def add_listener(fn):
+    """
+    fn(category, seconds, error) is called for every recorded timing, also
+    outside a request (e.g. metrics counters).
+    """
+    _listeners.append(fn)
+
+
+_query_listeners = []
+
+
+def add_query_listener(fn):
+    """fn(shape) is called before every Supabase table query executes."""
+    _query_listeners.append(fn)
+
+
+@contextmanager
+def timed(category):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(category, time.perf_counter() - start, error=True)
+        raise
+    record(category, time.perf_counter() - start)
+
+
+def log_sampled(logger, level, msg, *args, rate=0.01):
+    """
+    Level-gated, sampled logging for hot paths: formatting and I/O only happen
+    when the level is enabled *and* the request falls into the sample.
+    """
+    if rate <= 0 or not logger.isEnabledFor(level):
+        return
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.log(level, msg, *args)
+
+
+# --------------------------
+# Supabase client wrapper
+# --------------------------
+class _TimedChain:
+    """
+    Proxy for a postgrest query builder: every chained call returns another
+    proxy, and `.execute()` is timed under `category`. The chain also keeps a
+    value-free *shape* (table, select list, filtered columns) for the query
+    listeners.
+    """
+
+    __slots__ = ("_target", "_category", "_shape")
+
+    # 这些方法的第一个参数是列名 / 列表达式，记录到 shape；其余参数（值）丢弃
+    _SHAPE_ARG_METHODS = frozenset((
+        "select", "eq", "neq", "gt", "gte", "lt", "lte", "like", "ilike", "is_",
+        "in_", "contains", "order", "filter", "match",
+    ))
+
+    def __init__(self, target, category, shape=()):
+        self._target = target
+        self._category = category
+        self._shape = shape
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        category = self._category
+        shape = self._shape
+
+        if name == "execute":
+            def _execute(*args, **kwargs):
+                if _query_listeners:
+                    text = " ".join(shape)
+                    for listener in _query_listeners:
+                        listener(text)
+                with timed(category):
+                    return attr(*args, **kwargs)
+            return _execute
+
+        def _call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                if name in self._SHAPE_ARG_METHODS and args and isinstance(args[0], str):
+                    step = f"{name}({args[0]})"
+                elif name == "match" and args and isinstance(args[0], dict):
+                    step = f"match({','.join(sorted(args[0]))})"
+                else:
+                    step = name
+                return _TimedChain(result, category, shape + (step,))
+            return result
+        return _call
+
+
+class _TimedCalls:
+    """Proxy that times every method call on the wrapped object (storage buckets)."""
+
+    __slots__ = ("_target", "_category")
+
+    def __init__(self, target, category):
+        self._target = target
+        self._category = category
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        category = self._category
+
+        def _call(*args, **kwargs):
+            with timed(category):
+                return attr(*args, **kwargs)
+        return _call
+
+
+class _TimedStorage:
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        self._target = target
+
+    def from_(self, bucket):
+        return _TimedCalls(self._target.from_(bucket), "storage")
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class InstrumentedSupabase:
+    """Drop-in wrapper for a supabase Client: table() → "supabase", storage → "storage"."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return _TimedChain(self._client.table(name), "supabase", (name,))
+
+    @property
+    def storage(self):
+        return _TimedStorage(self._client.storage)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_supabase(client):
+    return InstrumentedSupabase(client) if client is not None else None
+
+
+# --------------------------
+# Flask / SQLAlchemy hooks
+# --------------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_xl_query_start", []).append(time.perf_counter())
+    if context is not None:
+        context._xl_timing = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._xl_timing = False
+    starts = conn.info.get("_xl_query_start")
+    if starts:
+        record("db", time.perf_counter() - starts.pop())
+
+
+def _handle_error(exception_context):
+    # 语句抛错时 after_cursor_execute 不会触发：在这里出栈，否则连接回池后栈越积越多、后面的计时全错位。
+    # 只认 before 之后、after 之前失败的语句（编译 / 取结果时的错误不在栈上）
+    context = exception_context.execution_context
+    if context is None or not getattr(context, "_xl_timing", False):
+        return
+    context._xl_timing = False
+    starts = exception_context.connection.info.get("_xl_query_start")
+    if starts:
+        record("db", time.perf_counter() - starts.pop(), error=True)
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g._template_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    start = getattr(g, "_template_start", None) if has_request_context() else None
+    if start is not None:
+        record("template", time.perf_counter() - start)
+        g._template_start = None
+
+
+def server_timing_header(timings, total_seconds):
+    parts = []
+    for name in CATEGORIES + tuple(sorted(set(timings) - set(CATEGORIES))):
+        if name in timings:
+            seconds, count = timings[name]
+            parts.append(f'{name};desc="{count}x";dur={seconds * 1000:.1f}')
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def init_app(app, engines=(), log_sample_rate=0.0):
+    """Register request hooks on app and query timing on each SQLAlchemy engine."""
+    for engine in engines:
+        instrument_engine(engine)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_start = time.perf_counter()
+        g._timings = {}
+
+    @app.after_request
+    def _emit_request_timings(response):
+        start = getattr(g, "_request_start", None)
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        timings = getattr(g, "_timings", None) or {}
+        response.headers["Server-Timing"] = server_timing_header(timings, total)
+
+        if timing_logger.isEnabledFor(logging.INFO) and (log_sample_rate >= 1 or random.random() < log_sample_rate):
+            timing_logger.info(json.dumps({
+                "event": "request",
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "total_ms": round(total * 1000, 2),
+                "timings": {k: {"ms": round(v[0] * 1000, 2), "n": v[1]} for k, v in timings.items()},
+            }, separators=(",", ":"), ensure_ascii=False))
+        return response
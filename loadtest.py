@@ -0,0 +1,331 @@
+# loadtest.py —— 按线上路由比例压测（完全离线：SQLite + 本地存储替身）
+"""
+Seed a throwaway SQLite DB at a chosen scale, start the app locally and drive
+a weighted mix of reads and uploads against it. Reports req/s and
+p50/p95/p99 latency per route and writes the results as JSON.
+
+    python loadtest.py --albums 20 --photos 200 --stories 100 \
+        --duration 30 --concurrency 8 --output loadtest_results.json
+
+    # measure one gunicorn worker instead of the werkzeug dev server
+    python loadtest.py --server gunicorn --gunicorn-workers 1
+
+Nothing here talks to Supabase or Cloudinary: SUPABASE_* is cleared so main.py
+takes its SQLite fallback paths, and uploads land in a temp LOCAL_UPLOAD_DIR.
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+DEFAULT_MIX = "albums=30,view_album=40,story_list=20,upload=10"
+
+
+# --------------------------
+# Environment + seeding
+# --------------------------
+def prepare_env(workdir):
+    """Point main.py at a private SQLite DB and local storage before it is imported."""
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "LOCAL_UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "IMG_CACHE_DIR": os.path.join(workdir, "img_cache"),
+        "UPLOAD_TMP_DIR": os.path.join(workdir, "upload_tmp"),
+    }
+    os.environ.update(env)
+    for key in ("SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY"):
+        os.environ.pop(key, None)
+    return env
+
+
+def seed(albums, photos_per_album, stories, images_per_story):
+    """Bulk-insert albums × photos and stories × images. Returns the album names."""
+    from main import app, db, Photo, Album, Story, StoryImage
+
+    album_names = [f"album_{i:04d}" for i in range(albums)]
+    now = datetime.utcnow()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(db.insert(Album), [{"name": n} for n in album_names])
+        photo_rows = []
+        for a, name in enumerate(album_names):
+            for p in range(photos_per_album):
+                photo_rows.append({
+                    "album": name,
+                    "url": f"http://localhost/static/uploads/{name}/{uuid.uuid4().hex}_{p}.jpg",
+                    "created_at": now - timedelta(minutes=a * photos_per_album + p),
+                    "is_private": False,
+                })
+        for i in range(0, len(photo_rows), 5000):
+            db.session.execute(db.insert(Photo), photo_rows[i:i + 5000])
+
+        story_rows = [{"id": s + 1, "text": f"story {s} " + "lorem ipsum " * 20,
+                       "created_at": now - timedelta(hours=s)} for s in range(stories)]
+        if story_rows:
+            db.session.execute(db.insert(Story), story_rows)
+        image_rows = [{
+            "story_id": s + 1,
+            "image_url": f"https://res.cloudinary.com/dpr0pl2tf/image/upload/v1/story/{uuid.uuid4().hex}.jpg",
+        } for s in range(stories) for _ in range(images_per_story)]
+        if image_rows:
+            db.session.execute(db.insert(StoryImage), image_rows)
+        db.session.commit()
+    return album_names
+
+
+# --------------------------
+# Server
+# --------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def start_server(kind, port, gunicorn_workers):
+    """Start the app on 127.0.0.1:port. Returns a stop() callable."""
+    if kind == "gunicorn":
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "main:app",
+             "--bind", f"127.0.0.1:{port}", "--workers", str(gunicorn_workers), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=os.environ.copy(),
+        )
+        wait_for_port(port)
+
+        def stop():
+            proc.terminate()
+            proc.wait(timeout=10)
+        return stop
+
+    from werkzeug.serving import make_server
+    from main import app
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    wait_for_port(port)
+
+    def stop():
+        server.shutdown()
+        thread.join(timeout=10)
+    return stop
+
+
+# --------------------------
+# Workload
+# --------------------------
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"albums", "view_album", "story_list", "upload"}
+    if unknown:
+        raise SystemExit(f"unknown routes in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def sample_jpeg(size_px):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (size_px, size_px), (120, 160, 200)).save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def multipart_body(album, filename, payload):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"album\"\r\n\r\n{album}\r\n".encode(),
+        (f"--{boundary}\r\nContent-Disposition: form-data; name=\"photo\"; filename=\"{filename}\"\r\n"
+         f"Content-Type: image/jpeg\r\n\r\n").encode(),
+        payload,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ]
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def build_request(route, album_names, upload_payload):
+    """Return (method, path, body, headers) for one request of the given route."""
+    if route == "albums":
+        return "GET", "/album", None, {}
+    if route == "view_album":
+        return "GET", f"/album/{quote(random.choice(album_names))}", None, {}
+    if route == "story_list":
+        return "GET", "/story_list", None, {}
+    body, ctype = multipart_body(random.choice(album_names), f"lt_{uuid.uuid4().hex[:8]}.jpg", upload_payload)
+    return "POST", "/upload", body, {"Content-Type": ctype}
+
+
+def worker(port, deadline, mix, album_names, upload_payload, results, lock):
+    routes = list(mix)
+    weights = [mix[r] for r in routes]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    local = {r: {"latencies": [], "errors": 0, "bytes": 0} for r in routes}
+    while time.time() < deadline:
+        route = random.choices(routes, weights)[0]
+        method, path, body, headers = build_request(route, album_names, upload_payload)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            elapsed = time.perf_counter() - start
+            local[route]["latencies"].append(elapsed)
+            local[route]["bytes"] += len(data)
+            if resp.status >= 400:
+                local[route]["errors"] += 1
+        except (OSError, http.client.HTTPException):
+            local[route]["errors"] += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    conn.close()
+    with lock:
+        for r, stats in local.items():
+            results[r]["latencies"].extend(stats["latencies"])
+            results[r]["errors"] += stats["errors"]
+            results[r]["bytes"] += stats["bytes"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(results, wall_seconds):
+    report = {}
+    total = 0
+    for route, stats in results.items():
+        lat = sorted(stats["latencies"])
+        total += len(lat)
+        report[route] = {
+            "requests": len(lat),
+            "errors": stats["errors"],
+            "req_per_s": round(len(lat) / wall_seconds, 2) if wall_seconds else 0,
+            "mean_ms": round(1000 * sum(lat) / len(lat), 2) if lat else None,
+            "p50_ms": round(1000 * percentile(lat, 50), 2) if lat else None,
+            "p95_ms": round(1000 * percentile(lat, 95), 2) if lat else None,
+            "p99_ms": round(1000 * percentile(lat, 99), 2) if lat else None,
+            "bytes": stats["bytes"],
+        }
+    report["_total"] = {"requests": total, "req_per_s": round(total / wall_seconds, 2) if wall_seconds else 0}
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<12} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}")
+    for route, r in report.items():
+        if route.startswith("_"):
+            continue
+        print(f"{route:<12} {r['requests']:>7} {r['errors']:>5} {r['req_per_s']:>8} "
+              f"{r['p50_ms'] or '-':>8} {r['p95_ms'] or '-':>8} {r['p99_ms'] or '-':>8}")
+    print(f"{'total':<12} {report['_total']['requests']:>7} {'':>5} {report['_total']['req_per_s']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the production route mix against a local app.")
+    parser.add_argument("--albums", type=int, default=20)
+    parser.add_argument("--photos", type=int, default=100, help="photos per album")
+    parser.add_argument("--stories", type=int, default=50)
+    parser.add_argument("--images-per-story", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of unrecorded warmup")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="route=weight,... (albums, view_album, story_list, upload)")
+    parser.add_argument("--upload-px", type=int, default=1200, help="edge length of the uploaded test JPEG")
+    parser.add_argument("--server", choices=("werkzeug", "gunicorn"), default="werkzeug")
+    parser.add_argument("--gunicorn-workers", type=int, default=1)
+    parser.add_argument("--workdir", default=None, help="keep DB/uploads here instead of a temp dir")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the route mix")
+    parser.add_argument("--output", default="loadtest_results.json")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="xialens_loadtest_")
+    os.makedirs(workdir, exist_ok=True)
+    prepare_env(workdir)
+    mix = parse_mix(args.mix)
+
+    t0 = time.time()
+    album_names = seed(args.albums, args.photos, args.stories, args.images_per_story)
+    print(f"seeded {args.albums} albums × {args.photos} photos, {args.stories} stories "
+          f"in {time.time() - t0:.1f}s ({workdir})")
+
+    port = free_port()
+    stop = start_server(args.server, port, args.gunicorn_workers)
+    upload_payload = sample_jpeg(args.upload_px)
+    try:
+        def run(seconds):
+            results = {r: {"latencies": [], "errors": 0, "bytes": 0} for r in mix}
+            lock = threading.Lock()
+            deadline = time.time() + seconds
+            threads = [threading.Thread(target=worker,
+                                        args=(port, deadline, mix, album_names, upload_payload, results, lock))
+                       for _ in range(args.concurrency)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return results, time.time() - start
+
+        if args.warmup > 0:
+            run(args.warmup)
+        results, wall = run(args.duration)
+    finally:
+        stop()
+
+    report = summarize(results, wall)
+    print_report(report)
+    output = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "config": {
+            "albums": args.albums,
+            "photos_per_album": args.photos,
+            "stories": args.stories,
+            "images_per_story": args.images_per_story,
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "mix": mix,
+            "server": args.server,
+            "gunicorn_workers": args.gunicorn_workers if args.server == "gunicorn" else None,
+            "upload_px": args.upload_px,
+        },
+        "wall_seconds": round(wall, 3),
+        "routes": report,
+    }
+    with open(args.output, "w") as fh:
+        json.dump(output, fh, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,55 @@
 # main.py  —— 可直接替换（覆盖你当前文件）
 import os
 import re
+import json
+import logging
 import io
 import uuid
 import stat
 import shutil
 import tempfile
-from datetime import datetime
+import mimetypes
+import time
+import random
+import threading
+from itertools import chain
+from datetime import datetime, timedelta
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
 from urllib.parse import urlparse, quote
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, g, stream_with_context, stream_template, send_file, has_request_context
+from markupsafe import Markup, escape
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestEntityTooLarge
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from PIL import Image, ExifTags, UnidentifiedImageError
 
+from image_proxy import ImageProxy, local_static_path, read_source
+from contact_sheet import ContactSheets
+from image_meta import probe_bytes, probe_image, probe_local, probe_url, fetch_header, display_size
+from perceptual_hash import NearDuplicateIndex, dhash_bytes, from_hex, to_hex
+from upload_guard import SNIFF_BYTES, RejectedUpload, UploadPolicy
+from responsive import GRID_WIDTHS, THUMB_WIDTHS, cloudinary_variant, img_attrs, is_cloudinary, pick_widths
+from storage import LocalStorage, SupabaseStorage, MemoryStorage, CachedStorage
+from admission import ByteBudget, UploadGate, DecodeGate, Overloaded
+from change_feed import PRUNED, sqlite_trigger_statements, collapse, cursor_expired, feed_cursor, valid_cursor
+from compression import CompressionMiddleware, EXTENSIONS, STATIC_EXTENSIONS, iter_static_assets, negotiate, precompress
+from zip_stream import iter_zip, entry_name
+from gc_orphans import RateLimiter, cloudinary_public_id, iter_cloudinary_resources, older_than, batched, CLOUDINARY_DELETE_BATCH
+from bulk_jobs import JobStore, start_background
+from storage_sync import SyncCheckpoint, storage_key, walk_supabase, walk_local, newest
+from resumable_upload import UploadSessionStore, UploadNotFound, OffsetMismatch, UploadTooLarge
+import instrumentation
+from instrumentation import timed, log_sampled, instrument_supabase, in_request
+from metrics import Registry, pool_stats
+from query_recorder import QueryRecorder
+from profiler import SamplingProfiler, ProfileStore
+from api_pagination import InvalidQuery, decode_cursor, encode_cursor, parse_fields, parse_limit, paginate, dumps_compact
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
@@ -31,9 +67,11 @@ import cloudinary.api
 from cloudinary.utils import api_sign_request
 
 # (optional helper used in test-db route)
-from sqlalchemy import text
+from sqlalchemy import text, event
 from sqlalchemy import create_engine
 from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 # --------------------------
 # Flask init
@@ -41,6 +79,18 @@ from sqlalchemy.pool import QueuePool
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET', 'xia0720_secret')
 
+# --------------------------
+# Logging（生产默认 WARNING；调试日志按 LOG_LEVEL 打开）
+# --------------------------
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+app.logger.setLevel(os.getenv("LOG_LEVEL", "WARNING").upper())
+# 每个请求一行 JSON 耗时日志，默认关闭；TIMING_LOG_SAMPLE=0.01 = 抽样 1%，1.0 = 每个请求都记
+TIMING_LOG_SAMPLE = float(os.getenv("TIMING_LOG_SAMPLE", "0"))
+if TIMING_LOG_SAMPLE > 0:
+    instrumentation.timing_logger.setLevel(logging.INFO)
+# 热路径调试日志的抽样率（还需要 LOG_LEVEL=DEBUG 才会输出）
+DEBUG_LOG_SAMPLE = float(os.getenv("DEBUG_LOG_SAMPLE", "0.01"))
+
 # --------------------------
 # Cloudinary config (left for Story features)
 # --------------------------
@@ -62,7 +112,8 @@ supabase = None
 
 if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY and create_client:
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+        # 包一层计时代理：table().execute() 记为 supabase，storage 调用记为 storage
+        supabase = instrument_supabase(create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY))
         use_supabase = True
         app.logger.info("✅ Supabase client initialized successfully (Service Role Key).")
     except Exception as e:
@@ -105,6 +156,49 @@ class Photo(db.Model):
     url = db.Column(db.String(512), nullable=False, unique=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_private = db.Column(db.Boolean, default=False)
+    # 上传时记录（旧数据用 flask --app main backfill-photo-meta 补齐）
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    byte_size = db.Column(db.BigInteger, nullable=True)
+    mime_type = db.Column(db.String(64), nullable=True)
+    orientation = db.Column(db.SmallInteger, nullable=True)  # EXIF 1-8
+    # 64 位 dHash 的 16 位十六进制（近似重复查找；旧数据用 flask --app main backfill-photo-dhash）
+    dhash = db.Column(db.String(16), nullable=True)
+
+    # 每个相册最新一张（封面、按 id 翻页）
+    __table_args__ = (db.Index("ix_photo_album_id", "album", "id"),)
+
+def supabase_schema_flag(name, probe):
+    """
+    Supabase 上要手动跑 SQL 的 schema 变更（列 / 函数）用的开关：1 = 已迁移，0 = 没有，
+    auto（默认）= 启动时用 probe() 探测一次，报错（列 / 函数不存在）就当没有。
+    先部署代码、后跑 SQL 也不会 500
+    """
+    value = os.getenv(name, "auto").strip().lower()
+    if value != "auto":
+        return value == "1"
+    if not (use_supabase and supabase):
+        return False
+    try:
+        probe()
+        return True
+    except Exception as e:
+        app.logger.warning(f"⚠️ {name}: Supabase schema not migrated yet, feature off ({e})")
+        return False
+
+PHOTO_META_FIELDS = ("width", "height", "byte_size", "mime_type", "orientation")
+# Supabase photo 表的 width/height/... 列（见 migrations 5b7e2c9d41a3）
+SUPABASE_PHOTO_META = supabase_schema_flag(
+    "SUPABASE_PHOTO_META",
+    lambda: supabase.table("photo").select(",".join(PHOTO_META_FIELDS)).limit(1).execute())
+# Supabase photo 表的 dhash 列（见 migrations 3e91c5a7d204）
+SUPABASE_PHOTO_DHASH = supabase_schema_flag(
+    "SUPABASE_PHOTO_DHASH",
+    lambda: supabase.table("photo").select("dhash").limit(1).execute())
+# Supabase 的 album_covers() 函数；没有时退回每个相册一条 limit(1)（见 migrations c4a8e1f09b36）
+SUPABASE_ALBUM_COVERS_RPC = supabase_schema_flag(
+    "SUPABASE_ALBUM_COVERS_RPC",
+    lambda: supabase.rpc("album_covers", {"names": []}).execute())
 
 class Story(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -122,8 +216,31 @@ class Album(db.Model):
     name = db.Column(db.String(255), unique=True, nullable=False)
     drive_folder_id = db.Column(db.String(255), nullable=True)  # Google Drive 文件夹 ID
 
+class ChangeLog(db.Model):
+    """photo / story 的变更流水，由触发器写入（见 change_feed.py）；(txid, id) 就是 /api/changes 的游标"""
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}  # id 不复用，保证单调
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(16), nullable=False)   # photo | story
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)         # upsert | delete（墓碑）
+    album = db.Column(db.String(255), nullable=True)
+    is_private = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Postgres: xid8，默认 pg_current_xact_id()（写入它的事务号，见 migrations f2a9c3e6d815）；SQLite 单写者，留空
+    txid = db.Column(db.BigInteger, nullable=True)
+
+@event.listens_for(db.metadata, "after_create")
+def _create_change_log_triggers(target, connection, **kw):
+    """create_all（reset_db.py / loadtest.py）建表时一起建触发器；正式库走 migration"""
+    if connection.dialect.name == "sqlite":
+        for statement in sqlite_trigger_statements():
+            connection.execute(text(statement))
+
 # ensure static upload folder exists (fallback)
-LOCAL_UPLOAD_DIR = os.path.join(app.root_path, "static", "uploads")
+# LOCAL_UPLOAD_DIR 可用环境变量改到别处（loadtest.py 用临时目录当本地存储替身）；
+# 注意 static/ 以外的目录不会被 /static 路由直接提供
+LOCAL_UPLOAD_DIR = os.getenv("LOCAL_UPLOAD_DIR", os.path.join(app.root_path, "static", "uploads"))
 os.makedirs(LOCAL_UPLOAD_DIR, exist_ok=True)
 
 # 检查是否可写
@@ -134,6 +251,256 @@ if not os.access(LOCAL_UPLOAD_DIR, os.W_OK):
 # create tables if not exist
 with app.app_context():
     pass  # 不要直接创建表，交给 Flask-Migrate 管理
+    # 请求耗时统计：两个 engine 的 SQL 都计入 db
+    instrumentation.init_app(app, engines=[engine, db.engine], log_sample_rate=TIMING_LOG_SAMPLE)
+
+# --------------------------
+# 文件存储（storage.py）：STORAGE_BACKEND=auto|supabase|local|memory
+# auto = 有 Supabase 就用 Supabase，否则本地 static/uploads。
+# 远程后端前面套一层本地磁盘读缓存（STORAGE_CACHE_MAX_BYTES=0 关闭），
+# /img、ZIP 下载、封面拼图读原图都先走这层
+# --------------------------
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto").lower()
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "xialens_storage_cache"))
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+STORAGE_LIST_PAGE = 1000
+STORAGE_REMOVE_BATCH = int(os.getenv("STORAGE_REMOVE_BATCH", "100"))
+STORAGE_REMOVE_WORKERS = int(os.getenv("STORAGE_REMOVE_WORKERS", "4"))
+
+def _local_storage_url(key):
+    if has_request_context():
+        return url_for("static", filename=f"uploads/{key}", _external=True)
+    return f"{PUBLIC_BASE_URL}/static/uploads/{quote(key)}"  # CLI / 后台线程里没有 request
+
+local_storage = LocalStorage(LOCAL_UPLOAD_DIR, _local_storage_url)
+
+def build_storage(kind):
+    if kind == "auto":
+        kind = "supabase" if use_supabase and supabase else "local"
+    if kind == "supabase" and supabase:
+        backend = SupabaseStorage(supabase, SUPABASE_BUCKET, SUPABASE_URL, list_page=STORAGE_LIST_PAGE,
+                                  remove_batch=STORAGE_REMOVE_BATCH, remove_workers=STORAGE_REMOVE_WORKERS)
+    elif kind == "memory":
+        backend = MemoryStorage()
+    else:
+        return local_storage  # 本地文件本身就在磁盘上，不需要再缓存
+    if STORAGE_CACHE_MAX_BYTES > 0:
+        return CachedStorage(backend, STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+    return backend
+
+photo_storage = build_storage(STORAGE_BACKEND)
+app.logger.info(f"🗄️ photo storage: {photo_storage.name}{' + disk cache' if isinstance(photo_storage, CachedStorage) else ''}")
+
+def storage_backends():
+    """主存储 + 本地（远程上传失败时会落到本地，删除时两边都要清）"""
+    return [photo_storage] if photo_storage is local_storage else [photo_storage, local_storage]
+
+def read_photo_bytes(url):
+    """photo url → 原图 bytes：能映射到 storage key 的走存储后端（含读缓存），其余直接 HTTP"""
+    for backend in storage_backends():
+        key = backend.key_for_url(url)
+        if key is None:
+            continue
+        try:
+            return backend.get(key)
+        except KeyError:
+            raise FileNotFoundError(url)
+        except Exception as e:
+            app.logger.warning(f"⚠️ {backend.name} read failed for {key}, falling back to url: {e}")
+            break
+    return read_source(url, app.static_folder)
+
+def delete_photo_object(url):
+    """删掉 photo url 对应的存储对象，返回删了几个"""
+    for backend in storage_backends():
+        key = backend.key_for_url(url)
+        if key:
+            return backend.delete([key])
+    return 0
+
+# --------------------------
+# Metrics（/metrics，Prometheus 文本格式；多 worker 通过 METRICS_DIR 汇总）
+# --------------------------
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "xialens_metrics"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # 设置后需 Authorization: Bearer <token>
+metrics_registry = Registry(METRICS_DIR)
+
+REQUEST_LATENCY = metrics_registry.histogram(
+    "xialens_http_request_duration_seconds", "Request latency by route.", ("endpoint", "method", "status"))
+DB_POOL = metrics_registry.gauge(
+    "xialens_db_pool_connections", "SQLAlchemy pool state summed over live workers.", ("engine", "state"))
+EXTERNAL_CALLS = metrics_registry.counter(
+    "xialens_external_calls_total", "Calls to Supabase / storage / Cloudinary / DB / Pillow.", ("service",))
+EXTERNAL_ERRORS = metrics_registry.counter(
+    "xialens_external_errors_total", "Failed external calls.", ("service",))
+EXTERNAL_LATENCY = metrics_registry.histogram(
+    "xialens_external_call_duration_seconds", "Latency of external calls.", ("service",))
+UPLOAD_FILES = metrics_registry.counter(
+    "xialens_upload_files_total", "Uploaded files (rate() = files/s).", ("target",))
+UPLOAD_BYTES = metrics_registry.counter(
+    "xialens_upload_bytes_total", "Uploaded bytes as received (rate() = bytes/s).", ("target",))
+COMPRESS_RATIO = metrics_registry.histogram(
+    "xialens_compress_ratio", "compress_image_bytes output/input size.", (),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.5))
+COMPRESS_SECONDS = metrics_registry.histogram(
+    "xialens_compress_duration_seconds", "compress_image_bytes wall time.", ())
+
+def _observe_external(category, seconds, error):
+    if category == "template":
+        return
+    EXTERNAL_CALLS.inc(service=category)
+    EXTERNAL_LATENCY.observe(seconds, service=category)
+    if error:
+        EXTERNAL_ERRORS.inc(service=category)
+
+instrumentation.add_listener(_observe_external)
+
+def _collect_pool_stats():
+    for name, eng in (("standalone", engine), ("flask", db.engine)):
+        for state, value in pool_stats(eng).items():
+            DB_POOL.set(value, engine=name, state=state)
+
+metrics_registry.add_collector(_collect_pool_stats)
+
+DISK_CACHE = metrics_registry.gauge(
+    "xialens_disk_cache", "Disk cache hits / misses / bytes / entries per worker (hit ratio = hits / (hits + misses)).",
+    ("cache", "stat"))
+
+def disk_cache_stats():
+    caches = {"img_proxy": image_proxy.cache.stats()}
+    if isinstance(photo_storage, CachedStorage):
+        caches["storage"] = photo_storage.stats()
+    return caches
+
+def _collect_cache_stats():
+    for name, stats in disk_cache_stats().items():
+        for stat in ("hits", "misses", "bytes", "entries"):
+            DISK_CACHE.set(stats[stat], cache=name, stat=stat)
+
+metrics_registry.add_collector(_collect_cache_stats)
+
+@app.before_request
+def _metrics_start():
+    g._metrics_start = time.perf_counter()
+
+@app.after_request
+def _metrics_observe(response):
+    start = getattr(g, "_metrics_start", None)
+    if start is not None and request.endpoint != "metrics":
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or "unmatched",
+            method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+    metrics_registry.maybe_flush()
+    return response
+
+def count_upload(target, nbytes):
+    UPLOAD_FILES.inc(target=target)
+    UPLOAD_BYTES.inc(nbytes, target=target)
+
+# --------------------------
+# Query budget / N+1 检测（QUERY_RECORDER=off|warn|raise，默认 off）
+# 预算 = 每个请求允许的 SQL + Supabase 查询条数；tests/test_query_budgets.py 以 raise 模式逐个页面检查
+# --------------------------
+QUERY_BUDGETS = {
+    "albums": 2,
+    "view_album": 3,
+    "story_list": 3,
+    "private_space": 2,
+    "api_albums": 2,
+    "api_album_photos": 1,
+    "api_photos": 1,
+    "api_stories": 2,
+    "api_changes": 5,  # bounds + page + photos + stories (selectinload = 2)
+}
+query_recorder = QueryRecorder(
+    mode=os.getenv("QUERY_RECORDER", "off"),
+    budgets=QUERY_BUDGETS,
+    repeat_threshold=int(os.getenv("QUERY_REPEAT_THRESHOLD", "5")),
+)
+with app.app_context():
+    query_recorder.init_app(app, engines=[engine, db.engine])
+
+# --------------------------
+# Sampling profiler（folded stacks，可直接喂给 flamegraph.pl / speedscope）
+# 管理员：任意 URL 加 ?__profile=return（直接下载）或 ?__profile=store（存盘），
+#         也可用请求头 X-Profile: return|store（表单 POST 比如 /upload_private）
+# 随机抽样：PROFILE_SAMPLE_RATE=0.001 → 约千分之一请求存盘，默认关闭
+# --------------------------
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "xialens_profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+profile_store = ProfileStore(
+    PROFILE_DIR,
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "200")),
+    max_bytes=int(os.getenv("PROFILE_MAX_BYTES", str(50 * 1024 * 1024))),
+)
+
+@app.before_request
+def _profile_start():
+    mode = request.args.get("__profile") or request.headers.get("X-Profile")
+    if mode in ("return", "store", "1"):
+        if not session.get("logged_in"):
+            return
+        mode = "return" if mode == "return" else "store"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        mode = "store"
+    else:
+        return
+    if request.endpoint in ("metrics", "list_profiles", "download_profile"):
+        return
+    g._profile_mode = mode
+    g._profiler = SamplingProfiler(interval=PROFILE_INTERVAL).start()
+
+def _profile_name(endpoint, took):
+    return "{}_{}_{}_{}".format(
+        datetime.utcnow().strftime("%Y%m%dT%H%M%S"), endpoint or "unmatched", took, uuid.uuid4().hex[:6],
+    )
+
+def _store_profile(profiler, name):
+    try:
+        return profile_store.save(name, profiler.folded())
+    except OSError:
+        app.logger.exception("failed to store profile")
+
+@app.after_request
+def _profile_finish(response):
+    profiler = getattr(g, "_profiler", None)
+    if profiler is None:
+        return response
+    g._profiler = None
+    mode = g._profile_mode
+    if response.is_streamed:
+        if mode == "return":
+            # 要把 profile 当响应体返回，只能先把流在这里跑完（整页缓冲，profile 覆盖 body 里的查询）
+            response.make_sequence()
+            response.close()
+        else:
+            # body 还没生成：id 先发出去（名字里没有耗时），profiler 等流发完（close）再停、再存盘
+            name = _profile_name(request.endpoint, "stream")
+            response.headers["X-Profile-Id"] = name + profile_store.SUFFIX
+
+            def finish():
+                profiler.stop()
+                _store_profile(profiler, name)
+
+            response.call_on_close(finish)
+            return response
+    profiler.stop()
+    name = _profile_name(request.endpoint, f"{int(profiler.duration * 1000)}ms")
+    if mode == "return":
+        return Response(
+            profiler.folded(),
+            mimetype="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="{name}.folded"',
+                     "X-Profile-Status": str(response.status_code)},
+        )
+    profile_id = _store_profile(profiler, name)
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
     
 # --------------------------
 # Helper: inject logged_in into all templates
@@ -143,20 +510,155 @@ def inject_logged_in():
     # Use the same session key your login sets. Here we use 'logged_in' as earlier code did.
     return dict(logged_in=bool(session.get("logged_in", False)))
 
+# --------------------------
+# 上传限流（admission.py）：每进程并发上传数 + 所有 worker 共享的字节预算，
+# 超出直接 503 + Retry-After（读请求不经过这里，照常响应）
+# --------------------------
+UPLOAD_MAX_CONCURRENT = int(os.getenv("UPLOAD_MAX_CONCURRENT", "2"))
+UPLOAD_BYTE_BUDGET = int(os.getenv("UPLOAD_BYTE_BUDGET", str(256 * 1024 * 1024)))  # 0 = 不限
+UPLOAD_DECODE_CONCURRENT = int(os.getenv("UPLOAD_DECODE_CONCURRENT", "2"))
+UPLOAD_DECODE_WAIT = float(os.getenv("UPLOAD_DECODE_WAIT", "10"))
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "5"))
+ADMISSION_DIR = os.getenv("ADMISSION_DIR", os.path.join(tempfile.gettempdir(), "xialens_admission"))
+UPLOAD_ENDPOINTS = {"upload", "upload_private", "upload_story", "edit_story", "resumable_upload", "resumable_finalize"}
+
+upload_gate = UploadGate(UPLOAD_MAX_CONCURRENT, ByteBudget(ADMISSION_DIR, UPLOAD_BYTE_BUDGET), UPLOAD_RETRY_AFTER)
+decode_gate = DecodeGate(UPLOAD_DECODE_CONCURRENT, UPLOAD_DECODE_WAIT, UPLOAD_RETRY_AFTER)
+
+UPLOAD_REJECTED = metrics_registry.counter(
+    "xialens_upload_rejected_total", "Uploads refused with 503 by admission control.", ("reason",))
+UPLOAD_ACTIVE = metrics_registry.gauge(
+    "xialens_upload_active", "Upload requests currently admitted per worker.", ())
+
+metrics_registry.add_collector(lambda: UPLOAD_ACTIVE.set(upload_gate.stats()["active"]))
+
+@app.before_request
+def _admit_upload():
+    if request.method not in ("POST", "PATCH") or request.endpoint not in UPLOAD_ENDPOINTS:
+        return
+    # 在读 body 之前决定；Content-Length 缺失（chunked）时只占并发名额
+    g._upload_bytes = upload_gate.acquire(request.content_length or 0)
+
+@app.teardown_request
+def _release_upload(exc):
+    nbytes = g.pop("_upload_bytes", None)
+    if nbytes is not None:
+        upload_gate.release(nbytes)
+
+@app.errorhandler(Overloaded)
+def upload_overloaded(e):
+    UPLOAD_REJECTED.inc(reason=e.reason)
+    resp = jsonify({"success": False, "error": "server busy, please retry", "reason": e.reason})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+def decode_limited(fn):
+    """Pillow 解码 / 重新编码占名额；等不到 UPLOAD_DECODE_WAIT 秒就 503"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with decode_gate.slot():
+            return fn(*args, **kwargs)
+    return wrapper
+
+# --------------------------
+# 上传前置校验（upload_guard.py）：先看大小和文件头魔数，再让 Pillow 只解析文件头
+# （格式白名单 / 像素上限），都过了才读整个文件、才解码。不是图片 → 415，太大 → 413
+# --------------------------
+UPLOAD_ALLOWED_FORMATS = tuple(
+    f.strip().upper() for f in os.getenv("UPLOAD_ALLOWED_FORMATS", "JPEG,PNG,WEBP,GIF").split(",") if f.strip()
+)
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", "80000000"))  # 手机 4800 万像素的照片也能过
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(256 * 1024 * 1024)))
+
+upload_policy = UploadPolicy(UPLOAD_ALLOWED_FORMATS, UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_PIXELS)
+# 所有 Pillow 解码的兜底：超过 2 倍上限时 Image.open 直接抛 DecompressionBombError
+Image.MAX_IMAGE_PIXELS = UPLOAD_MAX_PIXELS
+# 整个请求体的上限：超过就在解析表单（写临时文件）之前回 413
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_REQUEST_BYTES
+
+UPLOAD_INVALID = metrics_registry.counter(
+    "xialens_upload_invalid_total", "Uploads refused by pre-validation (not an image / too large).", ("status",))
+
+def validate_upload(f):
+    """FileStorage 过一遍校验，返回 {format, mime_type, width, height}；文件位置不变，之后照常 f.read()"""
+    try:
+        return upload_policy.inspect_stream(f.stream)
+    except RejectedUpload as e:
+        e.filename = f.filename
+        raise
+
+@app.errorhandler(RejectedUpload)
+def upload_rejected(e):
+    UPLOAD_INVALID.inc(status=str(e.status))
+    app.logger.info("🚫 upload rejected %s: %s", e.filename or "-", e.reason)
+    return jsonify({"success": False, "error": e.reason, "file": e.filename}), e.status
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    UPLOAD_INVALID.inc(status="413")
+    return jsonify({"success": False, "error": f"request too large (max {UPLOAD_MAX_REQUEST_BYTES} bytes)"}), 413
+
+# --------------------------
+# 响应压缩（compression.py）：HTML / JSON 按 Accept-Encoding 走 br（装了 brotli 时）或 gzip，
+# 流式响应逐块 flush。静态 CSS / JS 只压一次：部署时 flask --app main precompress-static，
+# 漏了的话第一次请求时生成 .br / .gz，之后直接发文件
+# --------------------------
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "5"))   # 6+ 体积几乎不变，CPU 明显变多
+COMPRESS_BR_QUALITY = int(os.getenv("COMPRESS_BR_QUALITY", "4"))   # 动态内容用 4-5；静态预压缩用 11
+
+if COMPRESS_RESPONSES:
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, min_size=COMPRESS_MIN_BYTES,
+                                         gzip_level=COMPRESS_GZIP_LEVEL, br_quality=COMPRESS_BR_QUALITY)
+
+_serve_static = app.view_functions["static"]
+
+def static_precompressed(filename):
+    encoding = negotiate(request.headers.get("Accept-Encoding")) if filename.endswith(STATIC_EXTENSIONS) else None
+    path = safe_join(app.static_folder, filename) if encoding else None
+    if path and os.path.isfile(path):
+        try:
+            precompress(path, [encoding])  # 已经是最新的就什么都不做
+        except OSError as e:
+            app.logger.warning(f"⚠️ precompress {filename} failed: {e}")
+        else:
+            resp = send_file(path + EXTENSIONS[encoding], mimetype=mimetypes.guess_type(path)[0],
+                             conditional=True, max_age=app.get_send_file_max_age(filename))
+            resp.headers["Content-Encoding"] = encoding
+            resp.headers["Vary"] = "Accept-Encoding"
+            return resp
+    return _serve_static(filename=filename)
+
+app.view_functions["static"] = static_precompressed
+
+@app.cli.command("precompress-static")
+def precompress_static_command():
+    """给 static/ 下的 CSS / JS / SVG 生成 .br / .gz（跳过 uploads/），构建时跑一次"""
+    written = 0
+    for path in iter_static_assets(app.static_folder):
+        written += len(precompress(path))
+    click.echo(f"🗜️ wrote {written} precompressed files")
+
 # --------------------------
 # Utils: image compress
 # --------------------------
 MAX_UPLOAD_BYTES = 3 * 1024 * 1024  # try to compress to <= 3MB
 
+@decode_limited
+@timed("pillow")
 def compress_image_bytes(input_bytes, target_bytes=MAX_UPLOAD_BYTES, max_dim=3000):
     """
     Return BytesIO containing JPEG bytes compressed to be <= target_bytes if possible.
     """
+    started = time.perf_counter()
     try:
         img = Image.open(io.BytesIO(input_bytes))
     except UnidentifiedImageError:
-        # not an image -> return original
-        return io.BytesIO(input_bytes)
+        # 不是图片：不再原样存进去（正常情况下 validate_upload 已经先拒绝了）
+        raise RejectedUpload("not an image")
 
     # fix orientation if any
     try:
@@ -195,6 +697,8 @@ def compress_image_bytes(input_bytes, target_bytes=MAX_UPLOAD_BYTES, max_dim=300
         img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
 
     out.seek(0)
+    COMPRESS_SECONDS.observe(time.perf_counter() - started)
+    COMPRESS_RATIO.observe(out.getbuffer().nbytes / max(1, len(input_bytes)))
     return out
 
 def safe_filename(name):
@@ -211,6 +715,8 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@decode_limited
+@timed("pillow")
 def compress_image_file(tmp_path, output_dir=LOCAL_UPLOAD_DIR, max_size=(1280,1280), quality=70):
     """
     ⚡ 压缩图片文件并保存到 output_dir，返回压缩后的文件路径
@@ -258,14 +764,68 @@ def compress_image_file(tmp_path, output_dir=LOCAL_UPLOAD_DIR, max_size=(1280,12
     return output_path
     
 
+# story 模板 srcset 用到的裁剪尺寸，上传时让 Cloudinary 预先生成（eager_async）
+STORY_EAGER = [  # 和模板里 responsive(box=...) 的 srcset 候选一致（正方形裁剪）
+    {"width": w, "height": w, "crop": "fill", "fetch_format": "auto", "quality": "auto"}
+    for w in sorted(set(GRID_WIDTHS) | set(THUMB_WIDTHS))
+]
+STORY_MAX_DIM = int(os.getenv("STORY_MAX_DIM", "2048"))
+STORY_TARGET_BYTES = int(os.getenv("STORY_TARGET_BYTES", str(1536 * 1024)))
+STORY_UPLOAD_WORKERS = int(os.getenv("STORY_UPLOAD_WORKERS", "4"))
+
+@timed("cloudinary")
 def upload_to_cloudinary(file):
     upload_result = cloudinary.uploader.upload(
         file,
         folder="story",
-        upload_preset="unsigned_preset"  # 你的 unsigned preset 名称
+        upload_preset="unsigned_preset",  # 你的 unsigned preset 名称
+        eager=STORY_EAGER,
+        eager_async=True,
     )
     return upload_result["secure_url"]
 
+def _upload_story_file(file):
+    """读取 → 本地缩放/重新编码（和私密相册同一个 compress_image_bytes）→ 上传"""
+    validate_upload(file)  # 不是图片 / 太大：不读、不解码，这张算失败
+    raw = file.read()
+    resized = compress_image_bytes(raw, target_bytes=STORY_TARGET_BYTES, max_dim=STORY_MAX_DIM)
+    return upload_to_cloudinary(resized)
+
+def upload_story_images(files):
+    """
+    并发（最多 STORY_UPLOAD_WORKERS 个）处理并上传 Story 图片，保持原顺序。
+    返回 (urls, failed)；单张失败只记日志，不影响其他图片。
+    解码名额等不到（Overloaded）不算单张失败：整个请求 503 + Retry-After，让客户端重试。
+    """
+    files = [f for f in files if f and f.filename]
+    if not files:
+        return [], 0
+
+    def _safe(file):
+        try:
+            return _upload_story_file(file)
+        except Overloaded:
+            raise
+        except Exception as e:
+            app.logger.warning("⚠️ Story 图片上传失败 %s: %s", file.filename, e)
+            return None
+
+    # in_request：线程里的 timed("pillow") / timed("cloudinary") 记到当前请求上（Server-Timing）
+    with ThreadPoolExecutor(max_workers=min(STORY_UPLOAD_WORKERS, len(files))) as pool:
+        results = list(pool.map(in_request(_safe), files))
+    urls = [u for u in results if u]
+    return urls, len(results) - len(urls)
+
+def insert_story_images(story_id, urls, story=None):
+    """一条 INSERT 写入整批图片行（Supabase image 表 / 本地 story_image）"""
+    if not urls:
+        return
+    if use_supabase and supabase and story is None:
+        supabase.table("image").insert([{"story_id": story_id, "image_url": u} for u in urls]).execute()
+    else:
+        db.session.add_all([StoryImage(image_url=u, story=story) if story is not None
+                            else StoryImage(image_url=u, story_id=story_id) for u in urls])
+
 
 def get_album_names_from_db():
     """从数据库或 Supabase 获取所有相册名"""
@@ -281,9 +841,150 @@ def get_album_names_from_db():
             rows = db.session.query(Photo.album).distinct().all()
             return [r[0] for r in rows if r[0]]
     except Exception as e:
-        print("⚠️ Failed to load album names:", e)
+        app.logger.warning("⚠️ Failed to load album names: %s", e)
         return []
 
+# --------------------------
+# On-demand resized images (/img/<photo_id>)
+# --------------------------
+IMG_CACHE_DIR = os.getenv("IMG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "xialens_img_cache"))
+IMG_CACHE_MAX_BYTES = int(os.getenv("IMG_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+def _cache_proxy_source(url):
+    """原图要不要进 /img 缓存：只缓存远程的；本地文件本来就在磁盘上，远程后端套了读缓存的也不用再存一份"""
+    if local_storage.key_for_url(url) is not None or local_static_path(url, app.static_folder):
+        return False
+    return not (isinstance(photo_storage, CachedStorage) and photo_storage.key_for_url(url) is not None)
+
+image_proxy = ImageProxy(
+    IMG_CACHE_DIR, IMG_CACHE_MAX_BYTES, app.static_folder, timer=timed,
+    fetch=read_photo_bytes,
+    cache_sources=_cache_proxy_source,
+)
+
+def get_photo_record(photo_id):
+    """按 id 读取一条 photo 记录，返回 {"id","url","album","is_private"} 或 None"""
+    if use_supabase and supabase:
+        resp = (
+            supabase.table("photo")
+            .select("id,url,album,is_private")
+            .eq("id", photo_id)
+            .limit(1)
+            .execute()
+        )
+        return resp.data[0] if resp.data else None
+    p = db.session.get(Photo, photo_id)
+    if not p:
+        return None
+    return {"id": p.id, "url": p.url, "album": p.album, "is_private": bool(p.is_private)}
+
+@app.route("/img/<int:photo_id>")
+def resized_image(photo_id):
+    """
+    ?w=<width>&fmt=jpeg|webp|png&q=<quality>
+    Variant URLs never change content for a given photo id, so they are cached immutable.
+    """
+    try:
+        record = get_photo_record(photo_id)
+    except Exception as e:
+        app.logger.warning(f"⚠️ /img lookup failed for {photo_id}: {e}")
+        abort(503)
+    if not record or not record.get("url"):
+        abort(404)
+    if record.get("is_private") and not session.get("logged_in"):
+        abort(404)
+
+    source_url = record["url"].replace(" ", "%20").rstrip("?")
+    try:
+        data, mimetype, etag = image_proxy.variant(
+            source_url,
+            width=request.args.get("w", type=int),
+            fmt=request.args.get("fmt"),
+            quality=request.args.get("q", type=int),
+        )
+    except (UnidentifiedImageError, ValueError, OSError) as e:
+        app.logger.warning(f"⚠️ /img render failed for {photo_id}: {e}")
+        abort(404)
+
+    resp = Response(data, mimetype=mimetype)
+    resp.set_etag(etag)
+    if record.get("is_private"):
+        resp.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    else:
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(request)
+
+# --------------------------
+# 响应式图片：{{ image | responsive(sizes=...) }} → src / srcset / sizes / width / height
+# Cloudinary 直接拼 URL 变换；Supabase / 本地照片走上面的 /img/<id>?w=
+# --------------------------
+@app.template_filter("responsive")
+def responsive_filter(image, sizes, widths=GRID_WIDTHS, box=None):
+    """
+    image: Cloudinary url string, or a photo dict {"id","url","width","height"}.
+    box=(w, h): crop every candidate to that aspect (Cloudinary c_fill) and
+    use it as the img's width/height; otherwise the photo's own size is used.
+    """
+    photo = image if isinstance(image, dict) else {"url": image}
+    url = photo.get("url") or ""
+    src_w, src_h = photo.get("width"), photo.get("height")
+
+    if is_cloudinary(url):
+        variant = lambda w: cloudinary_variant(url, w, box)
+        candidates = pick_widths(widths)
+    elif photo.get("id"):
+        variant = lambda w: url_for("resized_image", photo_id=photo["id"], w=w)
+        candidates = pick_widths(widths, src_w)
+    else:
+        return Markup(f'src="{escape(url)}"')
+
+    width, height = box if box else (src_w, src_h)
+    return img_attrs(variant, candidates, sizes, width, height)
+
+# 模板里写 responsive(widths=THUMB_WIDTHS)，不要再手写宽度列表
+app.jinja_env.globals.update(GRID_WIDTHS=GRID_WIDTHS, THUMB_WIDTHS=THUMB_WIDTHS)
+
+# --------------------------
+# /album 封面拼图：平均每 SPRITE_PER_PAGE 个相册一张 sprite（分页边界由相册名决定，按内容 hash 命名 → 永久缓存）
+# --------------------------
+SPRITE_DIR = os.getenv("SPRITE_DIR", os.path.join(tempfile.gettempdir(), "xialens_sprites"))
+contact_sheets = ContactSheets(
+    SPRITE_DIR,
+    fetch=image_proxy.source,  # 复用 /img 的原图磁盘缓存 + single-flight
+    per_page=int(os.getenv("SPRITE_PER_PAGE", "24")),
+    columns=int(os.getenv("SPRITE_COLUMNS", "6")),
+)
+
+def attach_sprites(albums_list):
+    """给已有 sprite 的相册加 album["sprite"]（url / 百分比坐标 / 行列数），没有的保持 <img>"""
+    by_name = {a["name"]: a for a in albums_list}
+    for entries, meta in contact_sheets.pages(albums_list):
+        if meta is None:
+            continue
+        cols, rows = meta["cols"], meta["rows"]
+        url = url_for("album_sprite", key=meta["key"], ext="jpg")
+        for name, (col, row) in meta["positions"].items():
+            album = by_name.get(name)
+            if album is not None:
+                album["sprite"] = {
+                    "url": url,
+                    "cols": cols,
+                    "rows": rows,
+                    "x": round(col * 100 / (cols - 1), 4) if cols > 1 else 0,
+                    "y": round(row * 100 / (rows - 1), 4) if rows > 1 else 0,
+                }
+    return albums_list
+
+@app.route("/album-sprites/<key>.<ext>")
+def album_sprite(key, ext):
+    if ext not in ("jpg", "json") or not re.fullmatch(r"[0-9a-f]{24}", key):
+        abort(404)
+    path = contact_sheets.path(key, ext)
+    if not os.path.isfile(path):
+        abort(404)
+    resp = send_file(path, mimetype="image/jpeg" if ext == "jpg" else "application/json", conditional=True)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
 # --------------------------
 # Routes: index / static pages
 # --------------------------
@@ -301,8 +1002,6 @@ def about():
 @app.route("/album")
 def albums():
     try:
-        print("✅ use_supabase =", use_supabase)
-
         albums_list = []
 
         if use_supabase and supabase:
@@ -366,64 +1065,140 @@ def albums():
                 if name in album_map
             ]
 
-        print("✅ Albums list:", albums_list)
+        attach_sprites(albums_list)
+        log_sampled(app.logger, logging.DEBUG, "✅ Albums list: %d albums", len(albums_list), rate=DEBUG_LOG_SAMPLE)
         return render_template("album.html", albums=albums_list, logged_in=session.get("logged_in"))
 
     except Exception as e:
         app.logger.exception("Failed to load albums")
         return f"Error loading albums: {e}", 500
 
+# --------------------------
+# 流式渲染：大相册 / Story 列表边查边发（stream_template），首字节时间和 worker 内存与行数无关
+# 行来自生成器：SQLite 用 yield_per（每次从游标取 STREAM_PAGE_SIZE 行），Supabase 用 range 分页
+# STREAM_TEMPLATES=0 → 回到一次性 render_template（调模板时能看到完整报错页）
+# --------------------------
+STREAM_TEMPLATES = os.getenv("STREAM_TEMPLATES", "1") == "1"
+STREAM_PAGE_SIZE = int(os.getenv("STREAM_PAGE_SIZE", "200"))
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "8192"))  # 模板碎片攒到这么大再发（压缩中间件每块 flush 一次）
+
+def supabase_pages(make_query, column="created_at", page_size=None):
+    """
+    逐页读 Supabase，按 (column, id) 倒序（Postgres 的 DESC：NULL 排最前），内存里只有一页。
+    make_query() 每页新建一次 builder（只带 select / 过滤）。keyset 分页：下一页从上一页最后一行的
+    (column, id) 之后接着取，和 api_pagination 一样不用 offset——时间相同的行、边发边有新上传都不会重复 / 漏掉
+    """
+    page_size = page_size or STREAM_PAGE_SIZE
+    last = None
+    while True:
+        query = make_query().order(column, desc=True).order("id", desc=True)
+        if last is not None:
+            value, last_id = last
+            if value is None:
+                query = query.or_(f"and({column}.is.null,id.lt.{last_id}),{column}.not.is.null")
+            else:
+                query = query.or_(f'{column}.lt."{value}",and({column}.eq."{value}",id.lt.{last_id})')
+        rows = query.limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = (rows[-1].get(column), rows[-1]["id"])
+
+def stream_session():
+    """
+    生成器自己的 session（用 with 打开，生成器结束 / 被关闭时关掉）。
+    请求的 db.session 在视图 return 后就被 teardown 掉了，body 还在生成时不能再用它的游标 / 对象
+    """
+    return db.session.session_factory()
+
+def peek(rows):
+    """先取第一行再接回去，空 → None。第一页查询出错时还没发响应头，照常走 500 / 回退"""
+    rows = iter(rows)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return None
+    return chain([first], rows)
+
+def _coalesce(chunks, size):
+    buf, n = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        n += len(chunk)
+        if n >= size:
+            yield "".join(buf)
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf)
+
+def render_page(template_name, **context):
+    """STREAM_TEMPLATES 开着就流式发，否则普通 render_template；模板两种都兼容（行可以是生成器）"""
+    if not STREAM_TEMPLATES:
+        return render_template(template_name, **context)
+    chunks = stream_template(template_name, **context)
+    return Response(stream_with_context(_coalesce(chunks, STREAM_CHUNK_BYTES)), mimetype="text/html")
+
 # --------------------------
 # View album (public)
 # --------------------------
+def iter_album_photos(album_name):
+    """相册公开照片（created_at 倒序），逐行产出模板用的 dict"""
+    if use_supabase and supabase:
+        columns = "id,url,created_at,width,height,orientation" if SUPABASE_PHOTO_META else "id,url,created_at"
+        rows = supabase_pages(lambda: (
+            supabase.table("photo")
+            .select(columns)
+            .eq("album", album_name)
+            .eq("is_private", False)
+        ))
+    else:
+        # SQLite 回退逻辑
+        def sqlite_rows():
+            with stream_session() as s:
+                query = (
+                    s.query(Photo.id, Photo.url, Photo.created_at, Photo.width, Photo.height, Photo.orientation)
+                    .filter(Photo.album == album_name, Photo.is_private == False)  # noqa: E712
+                    .order_by(Photo.created_at.desc(), Photo.id.desc())
+                    .yield_per(STREAM_PAGE_SIZE)
+                )
+                for r in query:
+                    yield r._asdict()
+        rows = sqlite_rows()
+
+    count = 0
+    try:
+        for p in rows:
+            url = p.get("url")
+            if url:
+                # 修正空格与尾 ? 之类的多余字符
+                width, height = display_size(p.get("width"), p.get("height"), p.get("orientation"))
+                count += 1
+                yield {
+                    "id": p.get("id"),
+                    "url": url.replace(" ", "%20").rstrip("?"),
+                    "created_at": p.get("created_at"),
+                    "width": width,
+                    "height": height,
+                }
+    except Exception:
+        if not count:
+            raise  # 第一页出错：peek() 还在视图里，照常 500
+        # 已经在发 body 了，没法再回 500：记下来，页面在已发的照片处结束
+        app.logger.exception("view_album: reading photos of %s failed mid-stream", album_name)
+    log_sampled(app.logger, logging.DEBUG, "✅ %s Photos: %d items", album_name, count, rate=DEBUG_LOG_SAMPLE)
+
 @app.route("/album/<album_name>")
 def view_album(album_name):
     try:
-        photos = []
         drive_link = None
-
-        # --------------- Photos: 从 photo 表读取公开照片 ---------------
-        if use_supabase and supabase:
-            # 读取 photo 表（只取公开照片）
-            resp = (
-                supabase.table("photo")
-                .select("id,url,created_at")
-                .eq("album", album_name)
-                .eq("is_private", False)
-                .order("created_at", desc=True)
-                .execute()
-            )
-            if resp.data:
-                for p in resp.data:
-                    url = p.get("url")
-                    if url:
-                        # 修正空格与尾 ? 之类的多余字符
-                        photos.append({
-                            "id": p.get("id"),
-                            "url": url.replace(" ", "%20").rstrip("?"),
-                            "created_at": p.get("created_at")
-                        })
-        else:
-            # SQLite 回退逻辑
-            photos_db = (
-                Photo.query.filter_by(album=album_name, is_private=False)
-                .order_by(Photo.created_at.desc())
-                .all()
-            )
-            for p in photos_db:
-                if p.url:
-                    photos.append({
-                        "id": p.id,
-                        "url": p.url.replace(" ", "%20").rstrip("?"),
-                        "created_at": p.created_at
-                    })
+        photos = peek(iter_album_photos(album_name))
 
         # --------------- Drive folder id: 使用 ADMIN (service role) 客户端读取 ---------------
         # 目的：保证无论用户是否登录，都能读取 drive_folder_id 并显示 "View Full Album"
+        # 全局 supabase 客户端本身就是 service role，不再每个请求 create_client 一次
         try:
             if use_supabase and SUPABASE_SERVICE_ROLE_KEY:
-                supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-                aresp = supabase_admin.table("album").select("drive_folder_id").eq("name", album_name).limit(1).execute()
+                aresp = supabase.table("album").select("drive_folder_id").eq("name", album_name).limit(1).execute()
                 # 如果表里有记录并且字段非空，就生成 drive_link
                 if aresp.data and len(aresp.data) > 0:
                     dfid = aresp.data[0].get("drive_folder_id")
@@ -444,10 +1219,7 @@ def view_album(album_name):
             app.logger.warning(f"读取 album.drive_folder_id 时出错（admin client）: {e}")
             drive_link = None
 
-        # 调试日志（部署时可以删除）
-        app.logger.info(f"✅ {album_name} Photos: {len(photos)} items; drive_link={drive_link}")
-
-        return render_template(
+        return render_page(
             "view_album.html",
             album_name=album_name,
             photos=photos,
@@ -459,6 +1231,51 @@ def view_album(album_name):
         app.logger.exception("view_album failed")
         return f"Error loading album: {e}", 500
         
+# --------------------------
+# Album ZIP 下载（边取边发；内存只与 ZIP_PREFETCH 有关，和相册大小无关）
+# --------------------------
+ZIP_PREFETCH = int(os.getenv("ZIP_PREFETCH", "4"))
+ZIP_PAGE_SIZE = 200
+
+def fetch_photo_source(url):
+    """本地 static 文件 → 返回路径（直接按块读）；Supabase / 远程 → bytes（走 storage 读缓存）"""
+    with timed("storage"):
+        local = local_static_path(url, app.static_folder)
+        if local:
+            return local
+        return read_photo_bytes(url)
+
+@app.route("/album/<album_name>/download")
+def download_album(album_name):
+    first_page, cursor = query_photos_page(["id", "url"], ZIP_PAGE_SIZE, None, album=album_name, is_private=False)
+    if not first_page:
+        abort(404)
+
+    def entries():
+        seen = set()
+        page, next_cursor = first_page, cursor
+        while True:
+            for p in page:
+                if p.get("url"):
+                    yield f"{album_name}/{entry_name(p['url'], seen)}", p["url"]
+            if not next_cursor:
+                return
+            page, next_cursor = query_photos_page(
+                ["id", "url"], ZIP_PAGE_SIZE, decode_cursor(next_cursor, int), album=album_name, is_private=False
+            )
+
+    filename = f"{album_name}.zip"
+    return Response(
+        stream_with_context(iter_zip(entries(), fetch_photo_source, prefetch=ZIP_PREFETCH)),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=\"{secure_filename(filename) or 'album.zip'}\"; "
+                                   f"filename*=UTF-8''{quote(filename)}",
+            "X-Accel-Buffering": "no",  # nginx 不要整包缓冲
+            "Cache-Control": "no-store",
+        },
+    )
+
 # --------------------------
 # Delete endpoints (handle id or url)
 # --------------------------
@@ -493,14 +1310,8 @@ def delete_images():
                     app.logger.debug(f"No record found for {ident}")
                     continue
 
-                # === 删除 Supabase 存储中的文件 ===
-                from urllib.parse import urlparse
-                parsed = urlparse(record["url"])
-                file_path = parsed.path.split("/object/public/photos/")[-1]
-                if file_path:
-                    supabase.storage.from_(SUPABASE_BUCKET).remove([file_path])
-                    deleted_storage += 1
-                    app.logger.debug(f"🗑️ Deleted file from Supabase: {file_path}")
+                # === 删除存储中的文件 ===
+                deleted_storage += delete_photo_object(record["url"])
 
                 # === 删除数据库记录 ===
                 supabase.table("photo").delete().eq("id", record["id"]).execute()
@@ -510,6 +1321,7 @@ def delete_images():
             else:
                 record = Photo.query.filter((Photo.id == ident) | (Photo.url == ident)).first()
                 if record:
+                    deleted_storage += delete_photo_object(record.url)
                     db.session.delete(record)
                     db.session.commit()
                     deleted_db += 1
@@ -547,85 +1359,566 @@ def delete_private_images():
     return redirect(url_for("view_private_album", album_name=album_name) if album_name else url_for("private_space"))
     
 # --------------------------
-# /debug_photos
+# JSON API（只读；keyset 游标分页 + fields 投影，列裁剪直接下推到 SQL / Supabase select）
+# GET /api/albums?limit=&cursor=&fields=name,drive_folder_id,cover
+# GET /api/albums/<album_name>/photos?limit=&cursor=&fields=id,url,created_at
+# GET /api/stories?limit=&cursor=&fields=id,text,created_at,images
+# GET /api/photos?album=&private=0|1   （需登录，含私密照片；取代原来整表导出的 /debug_photos）
+# 响应：{"items": [...], "next": "<cursor>" | null}
 # --------------------------
+API_ALBUM_FIELDS = ("name", "drive_folder_id", "cover")
+_API_META_FIELDS = PHOTO_META_FIELDS if (SUPABASE_PHOTO_META or not (use_supabase and supabase)) else ()
+API_PHOTO_FIELDS = ("id", "url", "album", "created_at", "is_private") + _API_META_FIELDS
+API_PUBLIC_PHOTO_FIELDS = ("id", "url", "album", "created_at") + _API_META_FIELDS
+API_STORY_FIELDS = ("id", "text", "created_at", "images")
+
+def api_json(payload, status=200):
+    return Response(dumps_compact(payload), status=status, mimetype="application/json")
+
+@app.errorhandler(InvalidQuery)
+def api_invalid_query(e):
+    return api_json({"error": str(e)}, 400)
+
+def _clean_photo_url(url):
+    return url.replace(" ", "%20").rstrip("?") if url else url
+
+def query_photos_page(fields, limit, cursor, album=None, is_private=None):
+    """按 id 倒序的一页照片（fields 必须包含 id）。返回 (items, next_cursor)"""
+    if use_supabase and supabase:
+        q = supabase.table("photo").select(",".join(fields))
+        if album is not None:
+            q = q.eq("album", album)
+        if is_private is not None:
+            q = q.eq("is_private", is_private)
+        if cursor is not None:
+            q = q.lt("id", cursor)
+        rows = q.order("id", desc=True).limit(limit + 1).execute().data or []
+    else:
+        q = db.session.query(*[getattr(Photo, f) for f in fields])
+        if album is not None:
+            q = q.filter(Photo.album == album)
+        if is_private is not None:
+            q = q.filter(Photo.is_private == is_private)
+        if cursor is not None:
+            q = q.filter(Photo.id < cursor)
+        rows = [dict(zip(fields, r)) for r in q.order_by(Photo.id.desc()).limit(limit + 1)]
+    items, next_cursor = paginate(rows, limit, "id")
+    if "url" in fields:
+        for item in items:
+            item["url"] = _clean_photo_url(item.get("url"))
+    return items, next_cursor
+
+def album_covers(names):
+    """{album: 最新公开照片 url}，每个相册只取一行（不把整页相册的照片全读出来）"""
+    if not names:
+        return {}
+    covers = {}
+    if use_supabase and supabase:
+        if SUPABASE_ALBUM_COVERS_RPC:
+            rows = supabase.rpc("album_covers", {"names": list(names)}).execute().data or []
+        else:
+            rows = []
+            for name in names:
+                rows.extend(
+                    supabase.table("photo")
+                    .select("album,url")
+                    .eq("album", name)
+                    .eq("is_private", False)
+                    .order("id", desc=True)
+                    .limit(1)
+                    .execute()
+                    .data or []
+                )
+        for row in rows:
+            if row.get("url"):
+                covers[row["album"]] = _clean_photo_url(row["url"])
+    else:
+        latest = (
+            db.session.query(db.func.max(Photo.id))
+            .filter(Photo.album.in_(names), Photo.is_private == False)  # noqa: E712
+            .group_by(Photo.album)
+        )
+        for album, url in db.session.query(Photo.album, Photo.url).filter(Photo.id.in_(latest)):
+            covers[album] = _clean_photo_url(url)
+    return covers
+
+@app.route("/api/albums")
+def api_albums():
+    limit = parse_limit(request.args.get("limit"))
+    cursor = decode_cursor(request.args.get("cursor"), str)
+    fields = parse_fields(request.args.get("fields"), API_ALBUM_FIELDS, "name")
+    columns = [f for f in fields if f != "cover"]
+
+    if use_supabase and supabase:
+        q = supabase.table("album").select(",".join(columns))
+        if cursor is not None:
+            q = q.gt("name", cursor)
+        rows = q.order("name").limit(limit + 1).execute().data or []
+    else:
+        q = db.session.query(*[getattr(Album, f) for f in columns])
+        if cursor is not None:
+            q = q.filter(Album.name > cursor)
+        rows = [dict(zip(columns, r)) for r in q.order_by(Album.name).limit(limit + 1)]
+
+    items, next_cursor = paginate(rows, limit, "name")
+    if "cover" in fields:
+        covers = album_covers([a["name"] for a in items])
+        for a in items:
+            a["cover"] = covers.get(a["name"])
+    return api_json({"items": items, "next": next_cursor})
+
+@app.route("/api/albums/<album_name>/photos")
+def api_album_photos(album_name):
+    items, next_cursor = query_photos_page(
+        parse_fields(request.args.get("fields"), API_PUBLIC_PHOTO_FIELDS, "id"),
+        parse_limit(request.args.get("limit")),
+        decode_cursor(request.args.get("cursor"), int),
+        album=album_name,
+        is_private=False,
+    )
+    return api_json({"items": items, "next": next_cursor})
+
+@app.route("/api/photos")
 @app.route("/debug_photos")
-def debug_photos():
-    try:
-        resp = supabase.table("photo").select("*").execute()
+def api_photos():
+    if not session.get("logged_in"):
+        return api_json({"error": "login required"}, 401)
+    private = request.args.get("private")
+    items, next_cursor = query_photos_page(
+        parse_fields(request.args.get("fields"), API_PHOTO_FIELDS, "id"),
+        parse_limit(request.args.get("limit")),
+        decode_cursor(request.args.get("cursor"), int),
+        album=request.args.get("album") or None,
+        is_private=None if private in (None, "") else private in ("1", "true"),
+    )
+    return api_json({"items": items, "next": next_cursor})
 
-        # v2 APIResponse: data 存在于 resp.data
-        return {"data": resp.data}
-    except Exception as e:
-        return {"error": str(e)}
+@app.route("/api/stories")
+def api_stories():
+    limit = parse_limit(request.args.get("limit"))
+    cursor = decode_cursor(request.args.get("cursor"), int)
+    fields = parse_fields(request.args.get("fields"), API_STORY_FIELDS, "id")
+    columns = [f for f in fields if f != "images"]
+
+    if use_supabase and supabase:
+        select = ",".join(columns + (["image(image_url)"] if "images" in fields else []))
+        q = supabase.table("story").select(select)
+        if cursor is not None:
+            q = q.lt("id", cursor)
+        rows = q.order("id", desc=True).limit(limit + 1).execute().data or []
+        items, next_cursor = paginate(rows, limit, "id")
+        if "images" in fields:
+            for s in items:
+                s["images"] = [fix_story_image_url(i.get("image_url")) for i in s.pop("image", None) or []]
+    else:
+        q = db.session.query(*[getattr(Story, f) for f in columns])
+        if cursor is not None:
+            q = q.filter(Story.id < cursor)
+        rows = [dict(zip(columns, r)) for r in q.order_by(Story.id.desc()).limit(limit + 1)]
+        items, next_cursor = paginate(rows, limit, "id")
+        if "images" in fields and items:
+            by_story = {s["id"]: s for s in items}
+            for s in items:
+                s["images"] = []
+            images = (
+                db.session.query(StoryImage.story_id, StoryImage.image_url)
+                .filter(StoryImage.story_id.in_(list(by_story)))
+                .order_by(StoryImage.id)
+            )
+            for story_id, image_url in images:
+                by_story[story_id]["images"].append(fix_story_image_url(image_url))
+    return api_json({"items": items, "next": next_cursor})
 
 # --------------------------
-# Delete entire album (新加)
+# /api/changes?since=<cursor>：增量变更流（change_log 由触发器写入，见 change_feed.py）
+# 不带 since → 只返回当前游标：客户端先全量加载一次，之后拿它轮询；
+# 游标早于已清理的流水（prune-changes）→ 410，客户端重新全量加载
 # --------------------------
-@app.route("/delete_album/<album_name>", methods=["POST"])
-@login_required
-def delete_album(album_name):
-    try:
-        # album_name 现在已经是 safe_album（全部无空格且文件夹一致）
-        safe_album = album_name.strip()
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+CHANGE_COLUMNS = ("id", "entity", "entity_id", "op", "album", "is_private")
 
-        deleted_photos = 0
-        deleted_files = 0
+def _change_log_on_postgres():
+    return db.engine.dialect.name == "postgresql"
 
-        if use_supabase and supabase:
-            bucket = SUPABASE_BUCKET or "photos"
+def read_change_log(since, limit, include_private):
+    """
+    游标 since=[txid, id] 之后、写入事务已经结束的变更（LIMIT limit+1），按 (txid, id) 升序。
+    Postgres / Supabase 走 change_log_page()：只给 txid < 快照 xmin 的行，还在跑的事务不会在游标后面冒出来；
+    SQLite 写者串行，id 就是提交顺序，txid 一律当 0
+    """
+    since_txid, since_id = since
+    if use_supabase and supabase:
+        return supabase.rpc("change_log_page", {
+            "since_txid": since_txid, "since_id": since_id, "lim": limit + 1, "include_private": include_private,
+        }).execute().data or []
+    if _change_log_on_postgres():
+        rows = db.session.execute(
+            text("select * from change_log_page(:since_txid, :since_id, :lim, :include_private)"),
+            {"since_txid": since_txid, "since_id": since_id, "lim": limit + 1, "include_private": include_private},
+        )
+        return [dict(r) for r in rows.mappings()]
+    q = db.session.query(*[getattr(ChangeLog, c) for c in CHANGE_COLUMNS]).filter(ChangeLog.id > since_id)
+    if not include_private:
+        q = q.filter(ChangeLog.is_private == False)  # noqa: E712
+    return [dict(zip(CHANGE_COLUMNS, r), txid=0) for r in q.order_by(ChangeLog.id).limit(limit + 1)]
+
+def change_log_bounds():
+    """(最新清理标记的游标 [txid, id]，没清理过为 None；最新已结束的游标 [txid, id])；空表返回 (None, [0, 0])"""
+    if use_supabase and supabase:
+        row = (supabase.rpc("change_log_bounds", {}).execute().data or [{}])[0]
+    elif _change_log_on_postgres():
+        row = dict(db.session.execute(text("select * from change_log_bounds()")).mappings().one())
+    else:
+        pruned, last = db.session.query(
+            db.func.max(db.case((ChangeLog.op == PRUNED, ChangeLog.id))), db.func.max(ChangeLog.id)).one()
+        return ([0, pruned] if pruned is not None else None), [0, last or 0]
+    pruned = [row.get("pruned_txid") or 0, row["pruned_id"]] if row.get("pruned_id") is not None else None
+    return pruned, [row.get("head_txid") or 0, row.get("head_id") or 0]
 
-            # === 1️⃣ 删除 Supabase Storage 中的文件 ===
-            try:
-                files_response = supabase.storage.from_(bucket).list(safe_album)
-
-                if files_response and isinstance(files_response, list):
-                    file_names = [f["name"] for f in files_response if "name" in f]
-
-                    if file_names:
-                        full_paths = [f"{safe_album}/{name}" for name in file_names]
-                        supabase.storage.from_(bucket).remove(full_paths)
-                        deleted_files = len(full_paths)
-                        app.logger.info(f"✅ Deleted {deleted_files} files from Supabase album '{safe_album}'")
-                    else:
-                        app.logger.info(f"⚠️ No files found in Supabase album: {safe_album}")
-                else:
-                    app.logger.info(f"⚠️ Supabase list returned empty or unexpected format for album: {safe_album}")
+def prune_change_log(cutoff):
+    """
+    删掉 cutoff 之前的流水：按 (txid, id) 顺序取 cutoff 之前最后一行，删掉它之前的所有行，
+    它自己留下并标成 op = "pruned"（游标在它之前的客户端收到 410，见 change_feed.cursor_expired）。返回删掉的行数
+    """
+    if use_supabase and supabase:
+        return supabase.rpc("change_log_prune", {"cutoff": cutoff.isoformat()}).execute().data or 0
+    if _change_log_on_postgres():
+        removed = db.session.execute(text("select change_log_prune(:cutoff)"), {"cutoff": cutoff}).scalar()
+    else:
+        marker = db.session.query(db.func.max(ChangeLog.id)).filter(ChangeLog.created_at < cutoff).scalar()
+        if marker is None:
+            return 0
+        removed = ChangeLog.query.filter(ChangeLog.id < marker).delete(synchronize_session=False)
+        ChangeLog.query.filter(ChangeLog.id == marker).update({"op": PRUNED}, synchronize_session=False)
+    db.session.commit()
+    return removed or 0
 
-            except Exception as e:
-                app.logger.warning(f"❌ Failed to clear Supabase storage for {safe_album}: {e}")
+def stories_by_ids(ids):
+    if not ids:
+        return {}
+    if use_supabase and supabase:
+        rows = supabase.table("story").select("id,text,created_at,image(image_url)").in_("id", ids).execute().data or []
+        for s in rows:
+            s["images"] = [fix_story_image_url(i.get("image_url")) for i in s.pop("image", None) or []]
+        return {s["id"]: s for s in rows}
+    stories = Story.query.options(selectinload(Story.images)).filter(Story.id.in_(ids)).all()
+    return {
+        s.id: {"id": s.id, "text": s.text, "created_at": s.created_at,
+               "images": [fix_story_image_url(i.image_url) for i in s.images]}
+        for s in stories
+    }
+
+@app.route("/api/changes")
+def api_changes():
+    include_private = bool(session.get("logged_in"))
+    since = decode_cursor(request.args.get("since"))
+    limit = parse_limit(request.args.get("limit"))
+
+    pruned, head = change_log_bounds()
+    if since is None:
+        return api_json({"changes": [], "next": encode_cursor(head), "has_more": False})
+    if not valid_cursor(since):
+        raise InvalidQuery("invalid cursor")
+    if cursor_expired(pruned, since):
+        return api_json({"error": "cursor expired, reload"}, 410)
+
+    rows = read_change_log(since, limit, include_private)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(feed_cursor(rows[-1]) if rows else since)
+
+    changes = collapse(rows)
+    photo_ids = [c["entity_id"] for c in changes if c["entity"] == "photo" and c["op"] == "upsert"]
+    story_ids = [c["entity_id"] for c in changes if c["entity"] == "story" and c["op"] == "upsert"]
+    fields = API_PHOTO_FIELDS if include_private else API_PUBLIC_PHOTO_FIELDS
+    photos = {}
+    for row in fetch_photo_rows(photo_ids) if photo_ids else []:
+        if row.get("is_private") and not include_private:
+            continue  # 变成私密了 → 对匿名客户端就是删除
+        row["url"] = _clean_photo_url(row.get("url"))
+        photos[row["id"]] = {f: row.get(f) for f in fields}
+    stories = stories_by_ids(story_ids)
+
+    out = []
+    for c in changes:
+        item = {"seq": c["id"], "entity": c["entity"], "id": c["entity_id"], "op": c["op"]}
+        if c["entity"] == "photo":
+            item["album"] = c.get("album")
+        if c["op"] == "upsert":
+            data = (photos if c["entity"] == "photo" else stories).get(c["entity_id"])
+            if data is None:
+                item["op"] = "delete"  # 行在这之后又被删了（下一页会有它的墓碑）
+            else:
+                item["data"] = data
+        out.append(item)
+    return api_json({"changes": out, "next": next_cursor, "has_more": has_more})
 
-            # === 2️⃣ 删除 photo 表中的记录 ===
+# --------------------------
+# 相册之间移动 / 复制照片（POST /photos/relocate）
+# 存储对象在服务端 move / copy（本地是 rename / copyfile），不经过 Flask 传字节；
+# photo 行：move 一次 UPDATE（Supabase 逐行 update），copy 一次批量 INSERT
+# --------------------------
+def fetch_photo_rows(ids):
+    columns = ["id", "album", "url", "is_private", "created_at"]
+    if not (use_supabase and supabase) or SUPABASE_PHOTO_META:
+        columns += list(PHOTO_META_FIELDS)
+    if not (use_supabase and supabase) or SUPABASE_PHOTO_DHASH:
+        columns.append("dhash")
+    rows = []
+    for batch in _chunks(ids, SYNC_BATCH_SIZE):
+        if use_supabase and supabase:
+            rows += supabase.table("photo").select(",".join(columns)).in_("id", batch).execute().data or []
+        else:
+            query = db.session.query(*[getattr(Photo, c) for c in columns]).filter(Photo.id.in_(batch))
+            rows += [dict(zip(columns, r)) for r in query]
+    return rows
+
+def _storage_object_for_url(url):
+    for backend in storage_backends():
+        key = backend.key_for_url(url)
+        if key:
+            return backend, key
+    return None, None
+
+def relocate_objects(rows, safe_target, copy=False):
+    """
+    每行的存储对象 move / copy 到 <safe_target>/（私密照片在 private/<safe_target>/）。
+    Cloudinary / 外链照片没有存储对象，原 url 不变。返回 ({id: (backend, old_key, new_key, new_url)}, failed_ids)
+    """
+    def _one(row):
+        backend, key = _storage_object_for_url(row["url"])
+        if backend is None:
+            return row["id"], (None, None, None, row["url"])
+        name = key.rsplit("/", 1)[-1]
+        if copy:
+            name = f"{uuid.uuid4().hex[:8]}_{name}"
+        new_key = f"private/{safe_target}/{name}" if row.get("is_private") else f"{safe_target}/{name}"
+        if new_key != key:
+            (backend.copy if copy else backend.move)(key, new_key)
+        return row["id"], (backend, key, new_key, backend.url(new_key))
+
+    done, failed = {}, []
+    with ThreadPoolExecutor(max_workers=STORAGE_REMOVE_WORKERS) as pool:
+        futures = {pool.submit(_one, row): row["id"] for row in rows}
+        for future, photo_id in futures.items():
             try:
-                resp = supabase.table("photo").delete().eq("album", safe_album).execute()
-                if resp.data:
-                    deleted_photos = len(resp.data)
-                app.logger.info(f"✅ Deleted {deleted_photos} photo records for album '{safe_album}'")
+                photo_id, result = future.result()
+                done[photo_id] = result
             except Exception as e:
-                app.logger.warning(f"❌ Supabase DB delete failed for album {safe_album}: {e}")
+                app.logger.warning(f"⚠️ relocate object failed for photo {photo_id}: {e}")
+                failed.append(photo_id)
+    return done, failed
+
+def update_moved_rows(album, new_urls):
+    """
+    改 album + 每行新 url，返回没改成功的 id。
+    Supabase 逐行 update ... eq(id)：并发删掉的行只是匹配 0 行（upsert 会把它插回成只有 id/url/album 的半行）
+    """
+    if use_supabase and supabase:
+        def _one(pid, url):
+            supabase.table("photo").update({"album": album, "url": url}, returning="minimal").eq("id", pid).execute()
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=STORAGE_REMOVE_WORKERS) as pool:
+            futures = {pool.submit(_one, pid, url): pid for pid, url in new_urls.items()}
+            for future, pid in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    app.logger.warning(f"⚠️ update moved photo {pid} failed: {e}")
+                    failed.append(pid)
+        return failed
+    # 本地：一条语句，要么全改要么抛异常
+    db.session.execute(
+        db.update(Photo)
+        .where(Photo.id.in_(list(new_urls)))
+        .values(album=album, url=db.case(new_urls, value=Photo.id))
+    )
+    db.session.commit()
+    return []
 
-            # === 3️⃣ 删除 album 表中的记录 ===
+def _move_objects_back(results):
+    """行没改成功 → 把对象搬回去，保持原 url 可用"""
+    for backend, key, new_key, _ in results:
+        if backend is not None and new_key != key:
             try:
-                supabase.table("album").delete().eq("name", safe_album).execute()
-                app.logger.info(f"✅ Deleted album record '{safe_album}'")
+                backend.move(new_key, key)
             except Exception as e:
-                app.logger.warning(f"❌ Failed to delete album record for {safe_album}: {e}")
+                app.logger.warning(f"⚠️ rollback move {new_key} -> {key} failed: {e}")
+
+def relocate_photos(ids, target_album, copy=False):
+    target_album = target_album.strip()
+    safe_target = target_album.replace(" ", "_")
+    # 和 store_album_photo 一致：Supabase 存 safe 名，本地 DB 存原名
+    db_album = safe_target if use_supabase and supabase else target_album
+    rows = [r for r in fetch_photo_rows(ids) if copy or r["album"] != db_album]
+    result = {"requested": len(ids), "done": 0, "failed": []}
+    if not rows:
+        return result
+
+    ensure_album(safe_target)
+    done, result["failed"] = relocate_objects(rows, safe_target, copy)
+    if not done:
+        return result
+
+    if copy:
+        by_id = {r["id"]: r for r in rows}
+        insert_photo_rows([
+            {**{k: v for k, v in by_id[pid].items() if k not in ("id", "created_at")}, "album": db_album, "url": new_url}
+            for pid, (_, _, _, new_url) in done.items()
+        ])
+    else:
+        try:
+            not_updated = update_moved_rows(db_album, {pid: new_url for pid, (_, _, _, new_url) in done.items()})
+        except Exception:
+            _move_objects_back(done.values())
+            raise
+        _move_objects_back([done.pop(pid) for pid in not_updated])
+        result["failed"] += not_updated
+    result["done"] = len(done)
+    return result
+
+@app.route("/photos/relocate", methods=["POST"])
+@login_required
+def relocate_photos_view():
+    data = request.get_json(silent=True) or {}
+    raw_ids = data.get("photo_ids") or request.form.getlist("photo_ids")
+    target = (data.get("target_album") or request.form.get("target_album") or "").strip()
+    mode = data.get("mode") or request.form.get("mode") or "move"
+    back = request.form.get("album_name")
+    ids = [int(i) for i in raw_ids if str(i).isdigit()]
+
+    if not ids or not target or mode not in ("move", "copy"):
+        if request.is_json:
+            return jsonify({"success": False, "error": "photo_ids, target_album and mode=move|copy required"}), 400
+        flash("Select photos and a target album.", "warning")
+        return redirect(url_for("view_album", album_name=back) if back else url_for("albums"))
 
+    try:
+        result = relocate_photos(ids, target, copy=(mode == "copy"))
+    except Exception as e:
+        app.logger.exception("relocate photos failed")
+        if request.is_json:
+            return jsonify({"success": False, "error": str(e)}), 500
+        flash(f"❌ {mode.title()} failed: {e}", "danger")
+        return redirect(url_for("view_album", album_name=back) if back else url_for("albums"))
+
+    app.logger.info(f"📦 {mode} {result['done']}/{result['requested']} photos -> '{target}'")
+    if request.is_json:
+        return jsonify(dict(result, success=True, mode=mode, target_album=target))
+    flash(f"✅ {'Copied' if mode == 'copy' else 'Moved'} {result['done']} photos to '{target}'"
+          + (f" ({len(result['failed'])} failed)" if result["failed"] else ""), "success")
+    return redirect(url_for("view_album", album_name=back) if back else url_for("albums"))
+
+# --------------------------
+# Delete album
+# Storage 分页列出 → 固定大小批次并发删除 → 行批量删除；
+# 照片数超过 DELETE_ALBUM_ASYNC_THRESHOLD 时转后台任务（JOBS_DIR 里记录进度，可续跑）
+# --------------------------
+DELETE_ALBUM_ASYNC_THRESHOLD = int(os.getenv("DELETE_ALBUM_ASYNC_THRESHOLD", "500"))
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "xialens_jobs"))
+job_store = JobStore(JOBS_DIR)
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def local_album_filter(column, safe_album):
+    """
+    和 store_album_photo / relocate_photos 一致：Supabase 存 safe 名，本地 DB 存原名（带空格）。
+    本地按“换成 safe 名后等于这个文件夹”匹配，文件夹里的文件和引用它们的行一起删
+    """
+    return db.func.replace(column, " ", "_") == safe_album
+
+def count_album_photos(safe_album):
+    if use_supabase and supabase:
+        return supabase.table("photo").select("id", count="exact").eq("album", safe_album).limit(1).execute().count or 0
+    return Photo.query.filter(local_album_filter(Photo.album, safe_album)).count()
+
+def delete_album_rows(safe_album):
+    """一条 DELETE 删掉整个相册的 photo 行，返回行数"""
+    if use_supabase and supabase:
+        resp = supabase.table("photo").delete(count="exact", returning="minimal").eq("album", safe_album).execute()
+        return resp.count or 0
+    n = Photo.query.filter(local_album_filter(Photo.album, safe_album)).delete(synchronize_session=False)
+    db.session.commit()
+    return n
+
+def run_album_delete(safe_album, job_id=None):
+    """
+    按阶段执行：storage → rows → album → done。每个阶段可重复执行，
+    job_id 不为空时从状态文件记录的阶段继续，并持续写进度。
+    """
+    def progress(**fields):
+        if job_id:
+            job_store.update(job_id, **fields)
+
+    job = job_store.get(job_id) if job_id else None
+    phase = (job or {}).get("phase") or "storage"
+    result = {"files": (job or {}).get("removed_files", 0), "photos": (job or {}).get("deleted_photos", 0)}
+
+    if phase == "storage":
+        progress(phase="storage", status="running")
+        listed = [(backend, backend.list(safe_album)) for backend in storage_backends()]
+        progress(total_files=sum(len(keys) for _, keys in listed), removed_files=0)
+        removed = 0
+        for backend, keys in listed:
+            done = removed
+            removed += backend.delete(keys, on_progress=lambda n: progress(removed_files=done + n))
+            backend.remove_prefix(safe_album)
+            app.logger.info(f"✅ Deleted {len(keys)} files from {backend.name} album '{safe_album}'")
+        result["files"] = removed
+        phase = "rows"
+
+    if phase == "rows":
+        progress(phase="rows")
+        result["photos"] = delete_album_rows(safe_album)
+        progress(deleted_photos=result["photos"])
+        app.logger.info(f"✅ Deleted {result['photos']} photo records for album '{safe_album}'")
+        phase = "album"
+
+    if phase == "album":
+        progress(phase="album")
+        if use_supabase and supabase:
+            supabase.table("album").delete().eq("name", safe_album).execute()
         else:
-            # === fallback: 本地 SQLite 模式 ===
-            photos = Photo.query.filter_by(album=safe_album).all()
-            for p in photos:
-                db.session.delete(p)
-            deleted_photos = len(photos)
+            Album.query.filter(local_album_filter(Album.name, safe_album)).delete(synchronize_session=False)
             db.session.commit()
 
-            album_obj = Album.query.filter_by(name=safe_album).first()
-            if album_obj:
-                db.session.delete(album_obj)
-                db.session.commit()
-            app.logger.info(f"✅ Local album '{safe_album}' deleted ({deleted_photos} photos)")
+    progress(phase="done", status="done")
+    return result
 
-        flash(f"✅ Album '{safe_album}' deleted ({deleted_photos} photos, {deleted_files} files)", "success")
+def _album_delete_worker(job_id, safe_album):
+    with app.app_context():
+        try:
+            run_album_delete(safe_album, job_id)
+            app.logger.info(f"Album '{safe_album}' fully deleted (job {job_id}).")
+        except Exception as e:
+            app.logger.exception(f"delete_album job {job_id} failed")
+            job_store.update(job_id, status="failed", error=str(e))
+
+@app.route("/delete_album/<album_name>", methods=["POST"])
+@login_required
+def delete_album(album_name):
+    # 本地相册列表显示的是原名（可能带空格），文件夹 / Supabase 用的是 safe 名
+    safe_album = album_name.strip().replace(" ", "_")
+    try:
+        job = job_store.find_unfinished("delete_album", album=safe_album)
+        photo_count = count_album_photos(safe_album) if job is None else job.get("photos", 0)
+
+        if job is not None or photo_count > DELETE_ALBUM_ASYNC_THRESHOLD:
+            if job is None:
+                job = job_store.create("delete_album", album=safe_album, photos=photo_count)
+                start_background(_album_delete_worker, job["id"], safe_album)
+            elif job_store.can_resume(job):
+                job_store.update(job["id"], status="pending", error=None)
+                start_background(_album_delete_worker, job["id"], safe_album)
+            flash(f"⏳ Album '{safe_album}' ({photo_count} photos) is being deleted in the background. "
+                  f"Progress: {url_for('job_status', job_id=job['id'])}", "info")
+            return redirect(url_for("albums"))
+
+        result = run_album_delete(safe_album)
+        flash(f"✅ Album '{safe_album}' deleted ({result['photos']} photos, {result['files']} files)", "success")
         app.logger.info(f"Album '{safe_album}' fully deleted.")
         return redirect(url_for("albums"))
 
@@ -634,52 +1927,94 @@ def delete_album(album_name):
         flash(f"❌ Failed to delete album '{safe_album}': {e}", "danger")
         return redirect(url_for("albums"))
 
+@app.route("/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(dict(job, stale=job_store.is_stale(job)))
+
+@app.route("/jobs/<job_id>/resume", methods=["POST"])
+@login_required
+def resume_job(job_id):
+    job = job_store.get(job_id)
+    if not job or job.get("kind") != "delete_album":
+        return jsonify({"error": "not found"}), 404
+    if not job_store.can_resume(job):
+        return jsonify({"error": f"job is {job['status']}"}), 409
+    job_store.update(job_id, status="pending", error=None)
+    start_background(_album_delete_worker, job_id, job["album"])
+    return jsonify({"success": True, "job": job_id}), 202
+
 # --------------------------
 # Story 列表
 # --------------------------
+def fix_story_image_url(image_url):
+    """旧 Story 图片不在当前 Cloudinary 账号下 → 按文件名重建 story/<public_id> URL"""
+    if image_url and image_url.startswith("https://res.cloudinary.com/dpr0pl2tf/"):
+        return image_url
+    try:
+        filename = image_url.split("/")[-1] if image_url else str(uuid.uuid4())
+        public_id = filename.rsplit(".", 1)[0]
+        new_url, _ = cloudinary.utils.cloudinary_url(f"story/{public_id}")
+        return new_url
+    except Exception as e:
+        app.logger.warning("⚠️ 修复旧 Story 图片失败: %s -> %s", image_url, e)
+        return image_url
+
+def iter_stories(source):
+    """Story（created_at 倒序）逐条产出，图片 URL 已修正；source = "supabase" | "sqlite" """
+    if source == "supabase":
+        def rows():
+            for s in supabase_pages(lambda: supabase.table("story").select("*, image(*)")):
+                story = type("StoryObj", (), {})()
+                story.id = s.get("id")
+                story.text = s.get("text")
+                # ✅ 直接保留字符串格式
+                story.created_at = s.get("created_at")
+                story.images = []
+                for img in s.get("image", []):
+                    img_obj = type("StoryImageObj", (), {})()
+                    # 修复旧 Cloudinary 图片 URL
+                    img_obj.image_url = fix_story_image_url(img.get("image_url"))
+                    story.images.append(img_obj)
+                yield story
+    else:
+        # selectinload 支持 yield_per：每取一批 story，一次查出这批的图片（没有 N+1）
+        def rows():
+            with stream_session() as s:
+                query = s.query(Story).options(selectinload(Story.images)).order_by(Story.created_at.desc(), Story.id.desc())
+                for story in query.yield_per(STREAM_PAGE_SIZE):
+                    for img in story.images:
+                        # set_committed_value：不把对象标脏，下一批查询的 autoflush 不会写回数据库
+                        set_committed_value(img, "image_url", fix_story_image_url(img.image_url))
+                    yield story
+
+    count = 0
+    try:
+        for story in rows():
+            count += 1
+            yield story
+    except Exception:
+        if not count:
+            raise
+        app.logger.exception("story_list: reading stories failed mid-stream")
+
 @app.route("/story_list")
 def story_list():
-    stories = []
+    stories = None
 
     try:
-        if use_supabase and supabase:
-            response = supabase.table("story").select("*, image(*)").order("created_at", desc=True).execute()
-            if response.data:
-                for s in response.data:
-                    story = type("StoryObj", (), {})()
-                    story.id = s.get("id")
-                    story.text = s.get("text")
-                    # ✅ 直接保留字符串格式
-                    story.created_at = s.get("created_at")
-                    story.images = []
-                    for img in s.get("image", []):
-                        img_obj = type("StoryImageObj", (), {})()
-                        img_obj.image_url = img.get("image_url")
-                        story.images.append(img_obj)
-                    stories.append(story)
-        else:
-            stories = Story.query.order_by(Story.created_at.desc()).all()
+        stories = peek(iter_stories("supabase" if use_supabase and supabase else "sqlite"))
     except Exception as e:
         app.logger.warning(f"⚠️ 获取 Story 列表失败: {e}")
         try:
-            stories = Story.query.order_by(Story.created_at.desc()).all()
+            stories = peek(iter_stories("sqlite"))
         except Exception as e2:
             app.logger.error(f"⚠️ SQLite Story 查询失败: {e2}")
-            stories = []
 
-    # 修复旧 Cloudinary 图片 URL
-    for story in stories:
-        for img in story.images:
-            if not img.image_url or not img.image_url.startswith("https://res.cloudinary.com/dpr0pl2tf/"):
-                try:
-                    filename = img.image_url.split("/")[-1] if img.image_url else str(uuid.uuid4())
-                    public_id = filename.rsplit(".", 1)[0]
-                    new_url, _ = cloudinary.utils.cloudinary_url(f"story/{public_id}")
-                    img.image_url = new_url
-                except Exception as e:
-                    print(f"⚠️ 修复旧 Story 图片失败: {img.image_url} -> {e}")
-
-    return render_template("story_list.html", stories=stories, logged_in=session.get("logged_in", False))
+    return render_page("story_list.html", stories=stories, logged_in=session.get("logged_in", False))
 
 # --------------------------
 # Story 详情
@@ -739,23 +2074,18 @@ def upload_story():
         if use_supabase and supabase:
             # 上传到 Supabase
             try:
-                # 插入 Story
+                # 先传图（可能 503），再插 Story：忙的时候不会留下一个没有图片的 Story
+                uploaded_images, failed = upload_story_images(files)
                 res = supabase.table("story").insert({"text": story_text.strip()}).execute()
                 story_id = res.data[0]["id"]
-                uploaded_images = []
-
-                for file in files:
-                    if file and file.filename:
-                        img_url = upload_to_cloudinary(file)  # ⚡ 抽成函数
-                        if img_url:
-                            supabase.table("image").insert({
-                                "story_id": story_id,
-                                "image_url": img_url
-                            }).execute()
-                            uploaded_images.append(img_url)
+                insert_story_images(story_id, uploaded_images)
+                if failed:
+                    flash(f"{failed} image(s) failed to upload.", "warning")
                 flash("Story uploaded successfully!", "success")
                 return redirect(url_for("story_list"))
 
+            except Overloaded:
+                raise
             except Exception as e:
                 app.logger.exception("Supabase upload_story failed, fallback to SQLite: %s", e)
                 # fallback SQLite
@@ -765,11 +2095,13 @@ def upload_story():
         db.session.add(new_story)
         db.session.flush()
         for file in files:
-            if file and file.filename:
-                img_url = upload_to_cloudinary(file)
-                if img_url:
-                    db.session.add(StoryImage(image_url=img_url, story=new_story))
+            if file:
+                file.stream.seek(0)  # Supabase 分支失败回退时可能已读过
+        uploaded_images, failed = upload_story_images(files)
+        insert_story_images(new_story.id, uploaded_images, story=new_story)
         db.session.commit()
+        if failed:
+            flash(f"{failed} image(s) failed to upload.", "warning")
         flash("Story uploaded successfully!", "success")
         return redirect(url_for("story_list"))
 
@@ -809,6 +2141,9 @@ def edit_story(story_id):
 
         if use_supabase and supabase:
             try:
+                # 先传新图（可能 503），再改文字 / 删旧图：忙的时候什么都不改
+                uploaded_images, failed = upload_story_images(request.files.getlist("story_images"))
+
                 supabase.table("story").update({"text": text.strip()}).eq("id", story_id).execute()
 
                 # 删除选中的旧图
@@ -817,15 +2152,13 @@ def edit_story(story_id):
                     for img_id in delete_image_ids.split(","):
                         supabase.table("image").delete().eq("id", int(img_id)).execute()
 
-                # 上传新图
-                files = request.files.getlist("story_images")
-                for file in files:
-                    if file and file.filename:
-                        img_url = upload_to_cloudinary(file)
-                        if img_url:
-                            supabase.table("image").insert({"story_id": story_id, "image_url": img_url}).execute()
+                insert_story_images(story_id, uploaded_images)
+                if failed:
+                    flash(f"{failed} image(s) failed to upload.", "warning")
                 flash("Story updated", "success")
                 return redirect(url_for("story_detail", story_id=story_id))
+            except Overloaded:
+                raise
             except Exception as e:
                 app.logger.exception("Supabase edit_story failed, fallback to SQLite: %s", e)
                 # fallback SQLite
@@ -841,11 +2174,13 @@ def edit_story(story_id):
                     db.session.delete(img)
         files = request.files.getlist("story_images")
         for file in files:
-            if file and file.filename:
-                img_url = upload_to_cloudinary(file)
-                if img_url:
-                    db.session.add(StoryImage(image_url=img_url, story=story_obj))
+            if file:
+                file.stream.seek(0)  # Supabase 分支失败回退时可能已读过
+        uploaded_images, failed = upload_story_images(files)
+        insert_story_images(story_id, uploaded_images, story=story_obj)
         db.session.commit()
+        if failed:
+            flash(f"{failed} image(s) failed to upload.", "warning")
         flash("Story updated", "success")
         return redirect(url_for("story_detail", story_id=story_id))
 
@@ -891,6 +2226,97 @@ def get_albums():
         app.logger.warning(f"⚠️ 获取相册列表失败: {e}")
         return []
 
+# --------------------------
+# Upload helpers（/upload、/upload_private 与断点续传 finalize 共用）
+# --------------------------
+def photo_meta_row(meta):
+    """probe 结果 → 可以直接并进 photo 行的字段（Supabase 未迁移时为空）"""
+    if not meta or (use_supabase and supabase and not SUPABASE_PHOTO_META):
+        return {}
+    return {k: meta.get(k) for k in PHOTO_META_FIELDS}
+
+@decode_limited
+@timed("pillow")
+def compute_dhash(file_bytes):
+    return dhash_bytes(file_bytes)
+
+def photo_hash_row(file_bytes):
+    """上传时算 dHash（近似重复查找用）；Supabase 还没加 dhash 列时为空"""
+    if use_supabase and supabase and not SUPABASE_PHOTO_DHASH:
+        return {}
+    value = compute_dhash(file_bytes)
+    return {"dhash": to_hex(value)} if value is not None else {}
+
+def ensure_album(safe_album, drive_folder_id=""):
+    """检查 album 是否存在，不存在则创建；有新的 drive_folder_id 时更新"""
+    if not (use_supabase and SUPABASE_SERVICE_ROLE_KEY):
+        return
+    try:
+        existing = supabase.table("album").select("*").eq("name", safe_album).execute()
+        if not existing.data:
+            # 新建时带上 drive_folder_id
+            supabase.table("album").insert({
+                "name": safe_album,
+                "drive_folder_id": drive_folder_id if drive_folder_id else None
+            }).execute()
+        elif drive_folder_id:
+            # 如果已有记录但用户输入了新的 drive_folder_id，则更新
+            supabase.table("album").update({
+                "drive_folder_id": drive_folder_id
+            }).eq("name", safe_album).execute()
+    except Exception as e:
+        app.logger.warning(f"创建/检查 album 失败: {e}")
+
+def supabase_public_url(path):
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{SUPABASE_BUCKET}/{quote(path, safe='')}"
+
+def put_photo_object(key, file_bytes, mimetype=None):
+    """写主存储；远程后端失败时退回本地 static/uploads，返回 public url"""
+    try:
+        return photo_storage.put(key, file_bytes, mimetype)
+    except Exception as e:
+        if photo_storage is local_storage:
+            raise
+        app.logger.exception(f"{photo_storage.name} 上传失败，尝试本地保存: {e}")
+        return local_storage.put(key, file_bytes, mimetype)
+
+def store_album_photo(album_name, original_name, file_bytes, mimetype=None, is_private=False):
+    """
+    /upload 的单文件逻辑：存到 Supabase Storage（失败则本地），再写 photo 记录。
+    本地 DB 只 add 不 commit，由调用方统一提交。返回 public url。
+    """
+    safe_album = album_name.replace(" ", "_")
+    filename = f"{uuid.uuid4().hex}_{secure_filename(original_name)}"
+    count_upload("private" if is_private else "public", len(file_bytes))
+    meta = dict(photo_meta_row(probe_bytes(file_bytes)), **photo_hash_row(file_bytes))
+
+    public_url = put_photo_object(f"{safe_album}/{filename}", file_bytes, mimetype)
+    try:
+        if use_supabase and SUPABASE_SERVICE_ROLE_KEY:
+            supabase.table("photo").insert({
+                "album": safe_album,
+                "url": public_url,
+                "is_private": is_private,
+                **meta,
+            }).execute()
+        else:
+            db.session.add(Photo(album=album_name, url=public_url, is_private=is_private, **meta))
+    except Exception as e:
+        app.logger.warning(f"写 photo 记录失败: {e}")
+    return public_url
+
+def store_private_photo(album, original_name, raw_bytes):
+    """/upload_private 的单文件逻辑：压缩 → 存储 → add Photo（调用方 commit）。返回 public url"""
+    count_upload("private", len(raw_bytes))
+    buf = compress_image_bytes(raw_bytes)   # BytesIO
+    file_bytes = buf.getvalue()             # ✅ 转成 bytes
+    filename = safe_filename(original_name)
+    meta = dict(photo_meta_row(probe_bytes(file_bytes)), **photo_hash_row(file_bytes))
+
+    public_url = put_photo_object(f"private/{album}/{filename}", file_bytes, "image/jpeg")
+    db.session.add(Photo(album=album, url=public_url, is_private=True, **meta))
+    return public_url
+
 # --------------------------
 # Upload photo
 # --------------------------
@@ -901,8 +2327,7 @@ def upload():
             album_names = []
             try:
                 if use_supabase and SUPABASE_SERVICE_ROLE_KEY:
-                    supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-                    res = supabase_admin.table("album").select("name").order("name", desc=False).execute()
+                    res = supabase.table("album").select("name").order("name", desc=False).execute()
                     album_names = [a["name"] for a in (res.data or [])]
                 else:
                     rows = db.session.query(Photo.album).distinct().all()
@@ -924,91 +2349,28 @@ def upload():
         if not files:
             return jsonify({"success": False, "error": "no files"}), 400
 
+        # 先把每个文件都校验一遍（只读文件头），有一个不合格就整批拒绝，不会传一半
+        files = [f for f in files if f and f.filename]
+        for f in files:
+            validate_upload(f)
+
         uploaded_urls = []
         safe_album = album_name.replace(" ", "_")
+        ensure_album(safe_album, drive_folder_id)
 
-        if use_supabase and SUPABASE_SERVICE_ROLE_KEY:
-            supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-            bucket = supabase_admin.storage.from_(SUPABASE_BUCKET)
-
-            # --- 检查 album 是否存在，不存在则创建 ---
-            try:
-                existing = supabase_admin.table("album").select("*").eq("name", safe_album).execute()
-                if not existing.data:
-                    # 新建时带上 drive_folder_id
-                    supabase_admin.table("album").insert({
-                        "name": safe_album,
-                        "drive_folder_id": drive_folder_id if drive_folder_id else None
-                    }).execute()
-                else:
-                    # 如果已有记录但用户输入了新的 drive_folder_id，则更新
-                    if drive_folder_id:
-                        supabase_admin.table("album").update({
-                            "drive_folder_id": drive_folder_id
-                        }).eq("name", safe_album).execute()
-            except Exception as e:
-                app.logger.warning(f"创建/检查 album 失败: {e}")
-
-            # --- 上传每个文件到 Supabase Storage ---
-            for f in files:
-                if not f or not f.filename:
-                    continue
-
-                filename = f"{uuid.uuid4().hex}_{secure_filename(f.filename)}"
-                path = f"{safe_album}/{filename}"
-
-                try:
-                    file_bytes = f.read()
-                    bucket.upload(
-                        path,
-                        file_bytes,
-                        file_options={"content-type": f.mimetype or "application/octet-stream", "upsert": "true"}
-                    )
-                    public_url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{SUPABASE_BUCKET}/{quote(path, safe='')}"
-
-                    supabase_admin.table("photo").insert({
-                        "album": safe_album,
-                        "url": public_url,
-                        "is_private": is_private
-                    }).execute()
-
-                    uploaded_urls.append(public_url)
-
-                except Exception as e:
-                    app.logger.exception(f"Supabase 上传失败，尝试本地保存: {e}")
-                    local_dir = os.path.join("static", "uploads", safe_album)
-                    os.makedirs(local_dir, exist_ok=True)
-                    local_path = os.path.join(local_dir, filename)
-                    with open(local_path, "wb") as out:
-                        out.write(file_bytes)
-                    local_url = url_for("static", filename=f"uploads/{safe_album}/{filename}", _external=True)
-                    uploaded_urls.append(local_url)
-
-        else:
-            # --- 本地保存模式 ---
-            os.makedirs(os.path.join("static", "uploads", safe_album), exist_ok=True)
-            for f in files:
-                if not f or not f.filename:
-                    continue
-                filename = f"{uuid.uuid4().hex}_{secure_filename(f.filename)}"
-                local_path = os.path.join("static", "uploads", safe_album, filename)
-                f.save(local_path)
-                public_url = url_for("static", filename=f"uploads/{safe_album}/{filename}", _external=True)
-
-                try:
-                    new_photo = Photo(album=album_name, url=public_url, is_private=is_private)
-                    db.session.add(new_photo)
-                except Exception as e:
-                    app.logger.warning(f"写本地 DB 失败: {e}")
+        for f in files:
+            uploaded_urls.append(store_album_photo(album_name, f.filename, f.read(), f.mimetype, is_private))
 
-            try:
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
 
         session["last_album"] = safe_album
         return jsonify({"success": True, "uploads": uploaded_urls})
 
+    except (Overloaded, RejectedUpload, RequestEntityTooLarge):
+        raise
     except Exception as e:
         app.logger.exception("Upload failed")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -1030,46 +2392,441 @@ def upload_private():
         if not files:
             return jsonify({"success": False, "error": "no files"}), 400
 
-        uploaded_urls = []
+        files = [f for f in files if f and f.filename]
         for f in files:
-            if not f or not f.filename:
-                continue
-            raw = f.read()
-            buf = compress_image_bytes(raw)   # BytesIO
-            file_bytes = buf.getvalue()       # ✅ 转成 bytes
-            filename = safe_filename(f.filename)
-
-            public_url = None
-            if use_supabase and supabase:
-                try:
-                    path = f"private/{album}/{filename}"
-                    res = supabase.storage.from_(SUPABASE_BUCKET).upload(path, file_bytes, {"upsert": True})
-                    pub = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(path)
-                    if isinstance(pub, dict):
-                        public_url = pub.get("publicURL") or pub.get("public_url") or pub.get("publicUrl")
-                    elif isinstance(pub, str):
-                        public_url = pub
-                except Exception as e:
-                    app.logger.exception("Supabase private upload failed, fallback to local: %s", e)
-                    public_url = None
+            validate_upload(f)
 
-            if not public_url:
-                local_path = os.path.join(LOCAL_UPLOAD_DIR, filename)
-                with open(local_path, "wb") as out:
-                    out.write(file_bytes)
-                public_url = url_for('static', filename=f"uploads/{filename}", _external=True)
-
-            new_photo = Photo(album=album, url=public_url, is_private=True)
-            db.session.add(new_photo)
+        uploaded_urls = []
+        for f in files:
+            uploaded_urls.append(store_private_photo(album, f.filename, f.read()))
             db.session.commit()
-            uploaded_urls.append(public_url)
 
         return jsonify({"success": True, "urls": uploaded_urls, "album": album})
 
+    except (Overloaded, RejectedUpload, RequestEntityTooLarge):
+        raise
     except Exception as e:
         app.logger.exception("upload_private failed")
         return jsonify({"success": False, "error": str(e)}), 500
-        
+
+# --------------------------
+# Resumable chunked upload（断点续传）
+#   POST   /uploads                 -> 创建，返回 upload_id
+#   HEAD   /uploads/<id>            -> Upload-Offset（断线后查询已收到多少字节）
+#   PATCH  /uploads/<id>            -> 追加分片（Header: Upload-Offset）
+#   POST   /uploads/<id>/finalize   -> 组装完成，交给 store_album_photo / store_private_photo
+#   DELETE /uploads/<id>            -> 放弃
+# --------------------------
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join(tempfile.gettempdir(), "xialens_uploads"))
+RESUMABLE_MAX_BYTES = int(os.getenv("RESUMABLE_MAX_BYTES", str(200 * 1024 * 1024)))
+RESUMABLE_CHUNK_BYTES = int(os.getenv("RESUMABLE_CHUNK_BYTES", str(1024 * 1024)))
+upload_sessions = UploadSessionStore(UPLOAD_TMP_DIR, RESUMABLE_MAX_BYTES)
+
+def _offset_headers(info):
+    return {
+        "Upload-Offset": str(info["offset"]),
+        "Upload-Length": str(info["length"]),
+        "Cache-Control": "no-store",
+    }
+
+@app.route("/uploads", methods=["POST"])
+def resumable_create():
+    data = request.get_json(silent=True) or request.form.to_dict()
+    target = data.get("target", "public")
+    if target not in ("public", "private"):
+        return jsonify({"success": False, "error": "bad target"}), 400
+    if target == "private" and not session.get("logged_in"):
+        return jsonify({"success": False, "error": "login required"}), 401
+
+    album = (data.get("album") or data.get("new_album") or "").strip()
+    filename = (data.get("filename") or "").strip()
+    if not album or not filename:
+        return jsonify({"success": False, "error": "album and filename required"}), 400
+
+    fields = {
+        "target": target,
+        "album": album,
+        "filename": filename,
+        "mimetype": data.get("mimetype") or "application/octet-stream",
+        "drive_folder_id": (data.get("drive_folder_id") or "").strip(),
+        "is_private": str(data.get("is_private", "false")).lower() == "true",
+    }
+    try:
+        length = int(data.get("length") or 0)
+        if length > 0:
+            upload_policy.check_size(length)  # 声明的大小就超限：一个分片都不用传
+        upload_id = upload_sessions.create(length, fields)
+    except UploadTooLarge:
+        return jsonify({"success": False, "error": "file too large"}), 413
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "length required"}), 400
+
+    # 顺手清理过期的临时文件
+    try:
+        upload_sessions.purge_expired()
+    except Exception as e:
+        app.logger.debug(f"purge_expired failed: {e}")
+
+    resp = jsonify({"success": True, "upload_id": upload_id, "offset": 0, "chunk_size": RESUMABLE_CHUNK_BYTES})
+    resp.status_code = 201
+    resp.headers["Location"] = url_for("resumable_upload", upload_id=upload_id)
+    return resp
+
+@app.route("/uploads/<upload_id>", methods=["HEAD", "GET", "PATCH", "DELETE"])
+def resumable_upload(upload_id):
+    try:
+        info = upload_sessions.info(upload_id)
+    except UploadNotFound:
+        return jsonify({"success": False, "error": "unknown upload"}), 404
+    if info["fields"]["target"] == "private" and not session.get("logged_in"):
+        return jsonify({"success": False, "error": "login required"}), 401
+
+    if request.method == "DELETE":
+        upload_sessions.discard(upload_id)
+        return "", 204
+
+    if request.method in ("HEAD", "GET"):
+        return jsonify({"success": True, "offset": info["offset"], "length": info["length"]}), 200, _offset_headers(info)
+
+    # ---------- PATCH ----------
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None:
+        return jsonify({"success": False, "error": "Upload-Offset header required"}), 400
+    try:
+        new_offset = upload_sessions.append(upload_id, offset, request.stream, request.content_length)
+    except OffsetMismatch as e:
+        info["offset"] = e.expected
+        return jsonify({"success": False, "error": "offset mismatch", "offset": e.expected}), 409, _offset_headers(info)
+    except UploadTooLarge:
+        return jsonify({"success": False, "error": "chunk exceeds declared length"}), 413
+
+    info["offset"] = new_offset
+    return "", 204, _offset_headers(info)
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def resumable_finalize(upload_id):
+    try:
+        info = upload_sessions.info(upload_id)
+        fields = info["fields"]
+        if fields["target"] == "private" and not session.get("logged_in"):
+            return jsonify({"success": False, "error": "login required"}), 401
+        path = upload_sessions.assembled_path(upload_id)
+    except UploadNotFound:
+        return jsonify({"success": False, "error": "unknown upload"}), 404
+    except OffsetMismatch as e:
+        return jsonify({"success": False, "error": "upload incomplete", "offset": e.expected}), 409
+
+    try:
+        upload_policy.inspect_path(path)
+    except RejectedUpload as e:
+        upload_sessions.discard(upload_id)
+        e.filename = fields["filename"]
+        raise
+
+    try:
+        with open(path, "rb") as fh:
+            file_bytes = fh.read()
+
+        album = fields["album"]
+        if fields["target"] == "private":
+            url = store_private_photo(album, fields["filename"], file_bytes)
+            db.session.commit()
+            session["last_private_album"] = album
+        else:
+            safe_album = album.replace(" ", "_")
+            ensure_album(safe_album, fields["drive_folder_id"])
+            url = store_album_photo(album, fields["filename"], file_bytes, fields["mimetype"], fields["is_private"])
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+            session["last_album"] = safe_album
+
+        upload_sessions.discard(upload_id)
+        return jsonify({"success": True, "url": url, "album": album})
+    except (Overloaded, RejectedUpload, RequestEntityTooLarge):
+        raise
+    except Exception as e:
+        app.logger.exception("resumable finalize failed")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# --------------------------
+# Direct-to-storage signed uploads（浏览器直传存储，不经过 Flask worker）
+#   POST /sign_upload          -> 返回短时有效的上传参数 + completion_token
+#   PUT  /direct_upload/<tok>  -> 本地存储模式下的等价直传地址
+#   POST /upload_complete      -> 浏览器传完后回调，写 Photo / StoryImage 记录
+# --------------------------
+DIRECT_UPLOAD_TTL = int(os.getenv("DIRECT_UPLOAD_TTL", "600"))  # seconds
+direct_upload_signer = URLSafeTimedSerializer(app.secret_key, salt="direct-upload")
+
+def record_photo(album, url, is_private=False, meta=None):
+    """写一条 photo 记录（Supabase 表或本地 DB）"""
+    meta = photo_meta_row(meta)
+    if use_supabase and supabase:
+        supabase.table("photo").insert({"album": album, "url": url, "is_private": is_private, **meta}).execute()
+    else:
+        db.session.add(Photo(album=album, url=url, is_private=is_private, **meta))
+        db.session.commit()
+
+def record_story_image(story_id, image_url):
+    """写一条 story 图片记录（Supabase image 表或本地 story_image）"""
+    if use_supabase and supabase:
+        supabase.table("image").insert({"story_id": story_id, "image_url": image_url}).execute()
+    else:
+        db.session.add(StoryImage(story_id=story_id, image_url=image_url))
+        db.session.commit()
+
+# completion token 在 DIRECT_UPLOAD_TTL 内可以重放（浏览器重试）：同一个 url 已经有行就不再插
+def photo_url_recorded(url):
+    if use_supabase and supabase:
+        return bool(supabase.table("photo").select("id").eq("url", url).limit(1).execute().data)
+    return db.session.query(Photo.id).filter_by(url=url).first() is not None
+
+def story_image_recorded(story_id, image_url):
+    if use_supabase and supabase:
+        return bool(supabase.table("image").select("id").eq("story_id", story_id)
+                    .eq("image_url", image_url).limit(1).execute().data)
+    return db.session.query(StoryImage.id).filter_by(story_id=story_id, image_url=image_url).first() is not None
+
+def inspect_direct_upload(claims):
+    """
+    浏览器传完之后检查对象：存在、并过一遍 upload_policy（大小 / 魔数 / 文件头），返回 probe 元数据。
+    对象不存在返回 None；不合格的对象删掉再抛 RejectedUpload
+    """
+    if not (use_supabase and supabase):
+        local_path = os.path.join(LOCAL_UPLOAD_DIR, claims["path"])
+        if not os.path.isfile(local_path):
+            return None
+        return probe_local(local_path)  # direct_upload_local 落盘时已经检查过
+    # Supabase 直传的字节不经过 Flask：用 Range 只读文件头（和 backfill-photo-meta 一样）
+    try:
+        data, total = fetch_header(claims["url"])
+    except HTTPError as e:
+        if e.code in (400, 404):  # Storage 对不存在的对象回 400 Object not found
+            return None
+        raise
+    try:
+        if total is not None:
+            upload_policy.check_size(total)
+        upload_policy.check_head(data[:SNIFF_BYTES])
+        upload_policy.check_header(io.BytesIO(data))
+    except RejectedUpload:
+        supabase.storage.from_(SUPABASE_BUCKET).remove([claims["path"]])
+        raise
+    meta = probe_image(data) or {}
+    if meta:
+        meta["byte_size"] = total
+    return meta
+
+@app.route("/sign_upload", methods=["POST"])
+def sign_upload():
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "login required"}), 401
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    kind = data.get("kind", "photo")
+    filename = (data.get("filename") or "").strip()
+    if not filename:
+        return jsonify({"success": False, "error": "filename required"}), 400
+
+    # ---------- Story 图片 -> Cloudinary signed upload ----------
+    if kind == "story":
+        try:
+            story_id = int(data.get("story_id"))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "story_id required"}), 400
+        cfg = cloudinary.config()
+        params = {
+            "folder": "story",
+            "public_id": uuid.uuid4().hex,
+            "timestamp": int(time.time()),
+            "eager": cloudinary.utils.build_eager(STORY_EAGER),
+        }
+        params["signature"] = api_sign_request(params, cfg.api_secret)
+        params["api_key"] = cfg.api_key
+        token = direct_upload_signer.dumps({
+            "kind": "story",
+            "story_id": story_id,
+            "public_id": f"story/{params['public_id']}",
+        })
+        return jsonify({
+            "success": True,
+            "provider": "cloudinary",
+            "method": "POST",
+            "upload_url": f"https://api.cloudinary.com/v1_1/{cfg.cloud_name}/image/upload",
+            "fields": params,
+            "completion_token": token,
+            "expires_in": DIRECT_UPLOAD_TTL,
+        })
+
+    if kind != "photo":
+        return jsonify({"success": False, "error": "bad kind"}), 400
+
+    # ---------- 相册照片 -> Supabase signed upload URL / 本地 ----------
+    album_name = (data.get("album") or data.get("new_album") or "").strip()
+    if not album_name:
+        return jsonify({"success": False, "error": "album name required"}), 400
+    is_private = str(data.get("is_private", "false")).lower() == "true"
+    # Supabase 直传的字节不经过这里，只能按浏览器报的类型 / 大小先挡一下
+    content_type = data.get("content_type")
+    if content_type and content_type not in upload_policy.mime_types:
+        raise RejectedUpload(f"content type {content_type} not allowed")
+    if data.get("size"):
+        try:
+            upload_policy.check_size(int(data["size"]))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "bad size"}), 400
+    safe_album = album_name.replace(" ", "_")
+    stored_name = f"{uuid.uuid4().hex}_{secure_filename(filename)}"
+    claims = {"kind": "photo", "album": safe_album, "is_private": is_private}
+    # 和 store_private_photo 一样：私密照片放 private/<album>/，不进公开相册的列表 / 删除 / 同步
+    rel = f"private/{safe_album}/{stored_name}" if is_private else f"{safe_album}/{stored_name}"
+
+    if use_supabase and supabase:
+        path = rel
+        try:
+            signed = supabase.storage.from_(SUPABASE_BUCKET).create_signed_upload_url(path)
+        except Exception as e:
+            app.logger.warning(f"⚠️ create_signed_upload_url failed: {e}")
+            return jsonify({"success": False, "error": "signing failed"}), 502
+        ensure_album(safe_album, (data.get("drive_folder_id") or "").strip())
+        claims.update({"path": path, "url": supabase_public_url(path)})
+        return jsonify({
+            "success": True,
+            "provider": "supabase",
+            "method": "PUT",
+            "upload_url": signed.get("signed_url") or signed.get("signedUrl"),
+            "headers": {"Content-Type": data.get("content_type") or "application/octet-stream"},
+            "completion_token": direct_upload_signer.dumps(claims),
+            "expires_in": DIRECT_UPLOAD_TTL,
+        })
+
+    claims.update({"path": rel, "url": url_for("static", filename=f"uploads/{rel}", _external=True)})
+    token = direct_upload_signer.dumps(claims)
+    return jsonify({
+        "success": True,
+        "provider": "local",
+        "method": "PUT",
+        "upload_url": url_for("direct_upload_local", token=token, _external=True),
+        "headers": {"Content-Type": data.get("content_type") or "application/octet-stream"},
+        "completion_token": token,
+        "expires_in": DIRECT_UPLOAD_TTL,
+    })
+
+def _load_direct_upload_token(token):
+    try:
+        return direct_upload_signer.loads(token, max_age=DIRECT_UPLOAD_TTL)
+    except (BadSignature, SignatureExpired):
+        return None
+
+@app.route("/direct_upload/<token>", methods=["PUT"])
+def direct_upload_local(token):
+    claims = _load_direct_upload_token(token)
+    # 和 sign_upload 同一个判断：Supabase 配了但客户端没起来时，sign_upload 发的就是本地地址
+    if not claims or claims.get("kind") != "photo" or (use_supabase and supabase):
+        return jsonify({"success": False, "error": "invalid or expired upload token"}), 403
+    if (request.content_length or 0) > RESUMABLE_MAX_BYTES:
+        return jsonify({"success": False, "error": "file too large"}), 413
+    if request.content_length:
+        upload_policy.check_size(request.content_length)
+
+    local_path = os.path.realpath(os.path.join(LOCAL_UPLOAD_DIR, claims["path"]))
+    if not local_path.startswith(os.path.realpath(LOCAL_UPLOAD_DIR) + os.sep):
+        return jsonify({"success": False, "error": "bad path"}), 400
+    head = request.stream.read(SNIFF_BYTES)
+    upload_policy.check_head(head)  # 魔数不对：一个字节都不落盘
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, "wb") as out:
+        out.write(head)
+        shutil.copyfileobj(request.stream, out, 64 * 1024)
+        nbytes = out.tell()
+    try:
+        upload_policy.inspect_path(local_path)
+    except RejectedUpload:
+        os.remove(local_path)
+        raise
+    count_upload("private" if claims.get("is_private") else "public", nbytes)
+    return jsonify({"success": True})
+
+@app.route("/upload_complete", methods=["POST"])
+def upload_complete():
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "login required"}), 401
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    claims = _load_direct_upload_token(data.get("completion_token") or "")
+    if not claims:
+        return jsonify({"success": False, "error": "invalid or expired completion token"}), 403
+
+    try:
+        if claims["kind"] == "story":
+            # 用 Cloudinary 返回的 signature 校验上传结果确实来自 Cloudinary
+            public_id = data.get("public_id")
+            version = data.get("version")
+            if public_id != claims["public_id"] or not cloudinary.utils.verify_api_response_signature(
+                    public_id, version, data.get("signature")):
+                return jsonify({"success": False, "error": "cloudinary signature mismatch"}), 400
+            # 签名只覆盖 public_id + version：url 由这两个拼出来，不用客户端给的 secure_url
+            image_url = cloudinary.utils.cloudinary_url(public_id, version=version, secure=True)[0]
+            if not story_image_recorded(claims["story_id"], image_url):
+                record_story_image(claims["story_id"], image_url)
+            return jsonify({"success": True, "url": image_url})
+
+        if claims["kind"] == "photo":
+            if not photo_url_recorded(claims["url"]):
+                meta = inspect_direct_upload(claims)
+                if meta is None:
+                    return jsonify({"success": False, "error": "object not uploaded"}), 409
+                record_photo(claims["album"], claims["url"], claims["is_private"], meta)
+            return jsonify({"success": True, "url": claims["url"], "album": claims["album"]})
+    except RejectedUpload:
+        raise
+    except Exception as e:
+        app.logger.exception("upload_complete failed")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    return jsonify({"success": False, "error": "bad token"}), 400
+
+# --------------------------
+# /metrics
+# --------------------------
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/storage")
+@login_required
+def storage_stats():
+    """当前 worker 的存储后端 + 磁盘缓存命中率"""
+    return jsonify({"backend": photo_storage.name, "caches": disk_cache_stats()})
+
+# --------------------------
+# 已保存的 profiles（管理员）
+# --------------------------
+@app.route("/admin/profiles")
+@login_required
+def list_profiles():
+    return jsonify({
+        "profiles": [
+            dict(e, url=url_for("download_profile", name=e["name"])) for e in profile_store.list()
+        ],
+        "sample_rate": PROFILE_SAMPLE_RATE,
+    })
+
+
+@app.route("/admin/profiles/<name>")
+@login_required
+def download_profile(name):
+    path = profile_store.path(name)
+    if not path:
+        abort(404)
+    with open(path) as fh:
+        body = fh.read()
+    return Response(body, mimetype="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
 # --------------------------
 # Login / logout
 # --------------------------
@@ -1186,6 +2943,566 @@ def save_photo():
         app.logger.exception("save_photo failed")
         return jsonify({"success": False, "error": str(e)}), 500
 # --------------------------
+# Storage ↔ DB 对账：sync_all_to_db / flask --app main sync-storage [--full] [--dry-run]
+# 列出 Supabase bucket + static/uploads，补齐缺失的 photo / album 行。
+# 每个前缀（相册文件夹）处理完就推进 checkpoint，中断后重跑只看新对象。
+# --------------------------
+SYNC_CHECKPOINT_PATH = os.getenv("SYNC_CHECKPOINT_PATH", os.path.join(tempfile.gettempdir(), "xialens_sync_checkpoint.json"))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "8"))
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+SYNC_PAGE_SIZE = 1000  # PostgREST 默认每次最多返回 1000 行
+# 本地文件生成 url 用；不设则写相对路径 /static/uploads/...
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+def _album_for_key(key):
+    """storage key → (album, is_private)；根目录下的散文件无法归属，返回 None"""
+    parts = key.split("/")
+    if parts[0] == "private":
+        return (parts[1], True) if len(parts) >= 3 else None
+    return (parts[0], False) if len(parts) >= 2 else None
+
+def existing_photo_keys(album):
+    """该相册已有 photo 行对应的 storage key（本地模式 album 列可能带空格）"""
+    names = list({album, album.replace("_", " ")})
+    if use_supabase and supabase:
+        # 按 id 分页：不分页时 PostgREST 只回前 1000 行，大相册其余的 key 会被当成缺行重复插入
+        urls, last = [], 0
+        while True:
+            rows = (supabase.table("photo").select("id,url").in_("album", names)
+                    .gt("id", last).order("id").limit(SYNC_PAGE_SIZE).execute().data or [])
+            urls.extend(r.get("url") for r in rows)
+            if len(rows) < SYNC_PAGE_SIZE:
+                break
+            last = rows[-1]["id"]
+    else:
+        urls = [u for (u,) in db.session.query(Photo.url).filter(Photo.album.in_(names))]
+    return {storage_key(u, SUPABASE_BUCKET) for u in urls if u}
+
+def insert_photo_rows(rows):
+    for batch in _chunks(rows, SYNC_BATCH_SIZE):
+        if use_supabase and supabase:
+            supabase.table("photo").insert(batch).execute()
+        else:
+            db.session.execute(db.insert(Photo), batch)
+            db.session.commit()
+
+def repair_album_rows(names):
+    """公开相册在 album 表里缺行的补上，返回补了几个"""
+    names = sorted(set(names))
+    missing = []
+    for batch in _chunks(names, SYNC_BATCH_SIZE):
+        if use_supabase and supabase:
+            have = {r["name"] for r in supabase.table("album").select("name").in_("name", batch).execute().data or []}
+        else:
+            have = {n for (n,) in db.session.query(Album.name).filter(Album.name.in_(batch))}
+        missing.extend(n for n in batch if n not in have)
+    for batch in _chunks(missing, SYNC_BATCH_SIZE):
+        if use_supabase and supabase:
+            supabase.table("album").insert([{"name": n} for n in batch]).execute()
+        else:
+            db.session.execute(db.insert(Album), [{"name": n} for n in batch])
+            db.session.commit()
+    return len(missing)
+
+def _local_photo_url(rel):
+    return f"{PUBLIC_BASE_URL}/static/uploads/{quote(rel)}"
+
+def sync_all_to_db(full=False, dry_run=False, checkpoint_path=None):
+    """
+    Reconcile storage with the photo / album tables. full=True ignores the
+    checkpoint (use after wiping the DB); dry_run only counts.
+    """
+    checkpoint = SyncCheckpoint(checkpoint_path or SYNC_CHECKPOINT_PATH)
+    if full:
+        checkpoint.reset()
+
+    walkers = [("local", "local", walk_local(LOCAL_UPLOAD_DIR, checkpoint, workers=SYNC_WORKERS))]
+    if use_supabase and supabase:
+        bucket = supabase.storage.from_(SUPABASE_BUCKET)
+        walkers.insert(0, ("supabase", "supabase", walk_supabase(bucket, checkpoint, workers=SYNC_WORKERS)))
+
+    result = {"full": full, "dry_run": dry_run, "prefixes": 0, "scanned": 0,
+              "inserted_photos": 0, "inserted_albums": 0, "unassigned": 0}
+    public_albums = set()
+    known = {}  # album -> existing keys，同一相册的 public / private 前缀共用一次查询
+
+    for source, kind, walker in walkers:
+        for prefix, files in walker:
+            result["prefixes"] += 1
+            result["scanned"] += len(files)
+            rows = []
+            for f in files:
+                owner = _album_for_key(f["key"])
+                if owner is None:
+                    result["unassigned"] += 1
+                    continue
+                album, is_private = owner
+                if album not in known:
+                    known[album] = existing_photo_keys(album)
+                if (kind, f["key"]) in known[album]:
+                    continue
+                url = supabase_public_url(f["key"]) if kind == "supabase" else _local_photo_url(f["key"])
+                rows.append({"album": album, "url": url, "is_private": is_private})
+                known[album].add((kind, f["key"]))
+                if not is_private:
+                    public_albums.add(album)
+
+            if rows and not dry_run:
+                insert_photo_rows(rows)
+            result["inserted_photos"] += len(rows)
+            if not dry_run:
+                checkpoint.advance(source, prefix, newest(files))
+                checkpoint.save()
+            if rows:
+                app.logger.info("🔄 sync %s:%s +%d photos", source, prefix or "/", len(rows))
+
+    if public_albums and not dry_run:
+        result["inserted_albums"] = repair_album_rows(public_albums)
+    return result
+
+@app.cli.command("sync-storage")
+@click.option("--full", is_flag=True, help="ignore the checkpoint and rescan everything")
+@click.option("--dry-run", is_flag=True, help="only report what would be inserted")
+def sync_storage_command(full, dry_run):
+    print(json.dumps(sync_all_to_db(full=full, dry_run=dry_run), ensure_ascii=False))
+
+# --------------------------
+# GC：flask --app main gc-orphans [--dry-run] [--min-age-hours 24] [--max-deletes 1000] [--rate 5]
+# 孤儿对象 = Storage / static/uploads / Cloudinary story/ 里没有任何行引用的文件
+# 悬空行   = 指向已不存在对象的 photo 行、story 已删除的 image / story_image 行
+# --------------------------
+GC_SAMPLE = 20
+GC_BATCH_SIZE = 100
+
+def iter_photo_rows(page_size=1000):
+    """所有 photo 的 (id, url, created_at)，按 id keyset 分页读取"""
+    last = 0
+    while True:
+        if use_supabase and supabase:
+            rows = (supabase.table("photo").select("id,url,created_at")
+                    .gt("id", last).order("id").limit(page_size).execute().data or [])
+        else:
+            rows = [{"id": i, "url": u, "created_at": c} for i, u, c in
+                    db.session.query(Photo.id, Photo.url, Photo.created_at)
+                    .filter(Photo.id > last).order_by(Photo.id).limit(page_size)]
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1]["id"]
+
+def iter_story_image_rows(page_size=1000):
+    last = 0
+    while True:
+        if use_supabase and supabase:
+            rows = (supabase.table("image").select("id,story_id,image_url")
+                    .gt("id", last).order("id").limit(page_size).execute().data or [])
+        else:
+            rows = [{"id": i, "story_id": s, "image_url": u} for i, s, u in
+                    db.session.query(StoryImage.id, StoryImage.story_id, StoryImage.image_url)
+                    .filter(StoryImage.id > last).order_by(StoryImage.id).limit(page_size)]
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1]["id"]
+
+def all_story_ids():
+    if use_supabase and supabase:
+        ids, last = set(), 0
+        while True:
+            rows = supabase.table("story").select("id").gt("id", last).order("id").limit(1000).execute().data or []
+            if not rows:
+                return ids
+            ids.update(r["id"] for r in rows)
+            last = rows[-1]["id"]
+    return {i for (i,) in db.session.query(Story.id)}
+
+def read_photo_rows(ids):
+    """按 id 重新读 photo 行（删之前确认用）"""
+    rows = []
+    for batch in batched(list(ids), GC_BATCH_SIZE):
+        if use_supabase and supabase:
+            rows += supabase.table("photo").select("id,url,created_at").in_("id", batch).execute().data or []
+        else:
+            rows += [{"id": i, "url": u, "created_at": c} for i, u, c in
+                     db.session.query(Photo.id, Photo.url, Photo.created_at).filter(Photo.id.in_(batch))]
+    return rows
+
+def gc_object_backends():
+    """storage_key 的 kind → 能直接问“这个 key 还在不在”的后端（不经过读缓存）"""
+    backends = {"local": local_storage}
+    if use_supabase and supabase:
+        backends["supabase"] = SupabaseStorage(supabase, SUPABASE_BUCKET, SUPABASE_URL, list_page=STORAGE_LIST_PAGE)
+    return backends
+
+def confirm_dangling_photos(ids, cutoff, limiter):
+    """
+    列表扫描不是快照（并发上传会让 offset 分页漏项，relocate 可能在两次扫描之间把对象挪走），
+    所以删行之前逐行重读：行太新、url 已经变了、对象其实还在的，都不删
+    """
+    backends = gc_object_backends()
+    confirmed = []
+    for row in read_photo_rows(ids):
+        if not older_than(row.get("created_at"), cutoff):
+            continue
+        key = storage_key(row.get("url"), SUPABASE_BUCKET)
+        backend = backends.get(key[0]) if key else None
+        if backend is None:
+            continue
+        if backend is not local_storage:
+            limiter.wait()
+        if not backend.exists(key[1]):
+            confirmed.append(row["id"])
+    return sorted(confirmed)
+
+def delete_rows_by_id(table, model, ids, limiter):
+    for batch in batched(ids, GC_BATCH_SIZE):
+        limiter.wait()
+        if use_supabase and supabase:
+            supabase.table(table).delete(returning="minimal").in_("id", batch).execute()
+        else:
+            model.query.filter(model.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def gc_orphans(dry_run=True, min_age_hours=24.0, max_deletes=1000, rate=5.0):
+    cutoff = time.time() - min_age_hours * 3600
+    limiter = RateLimiter(rate)
+    report = {"dry_run": dry_run, "min_age_hours": min_age_hours, "errors": []}
+
+    # --- photo 行 ↔ Supabase / 本地文件 ---
+    # 太新的行不算悬空（对象可能还在上传 / 刚被挪走）
+    referenced, young = {}, set()
+    for row in iter_photo_rows():
+        key = storage_key(row.get("url"), SUPABASE_BUCKET)
+        if key:
+            referenced.setdefault(key, []).append(row["id"])
+            if not older_than(row.get("created_at"), cutoff):
+                young.add(row["id"])
+
+    objects = {}
+    listed = {"local"}
+    for prefix, files in walk_local(LOCAL_UPLOAD_DIR, workers=SYNC_WORKERS):
+        for f in files:
+            objects[("local", f["key"])] = f["updated"]
+    if use_supabase and supabase:
+        listed.add("supabase")
+        for prefix, files in walk_supabase(supabase.storage.from_(SUPABASE_BUCKET), workers=SYNC_WORKERS):
+            for f in files:
+                objects[("supabase", f["key"])] = f["updated"]
+
+    # 列完对象再读一遍行：扫描期间 relocate / 新上传写进去的 url 也算引用，对象不会被当成孤儿
+    for row in iter_photo_rows():
+        key = storage_key(row.get("url"), SUPABASE_BUCKET)
+        if key and key not in referenced:
+            referenced[key] = []
+
+    orphan_objects = sorted(k for k, ts in objects.items() if k not in referenced and older_than(ts, cutoff))
+    dangling_photos = sorted(i for k, ids in referenced.items() if k[0] in listed and k not in objects
+                             for i in ids if i not in young)
+
+    # --- Story 图片行 ↔ Cloudinary story/ ---
+    story_ids = all_story_ids()
+    story_refs, dangling_images = set(), []
+    for row in iter_story_image_rows():
+        if row.get("story_id") not in story_ids:
+            dangling_images.append(row["id"])
+            continue
+        pid = cloudinary_public_id(fix_story_image_url(row.get("image_url")))
+        if pid:
+            story_refs.add(pid)
+
+    orphan_assets = []
+    try:
+        for res in iter_cloudinary_resources(cloudinary.api, "story/", limiter=limiter):
+            if res["public_id"] not in story_refs and older_than(res.get("created_at"), cutoff):
+                orphan_assets.append(res["public_id"])
+    except Exception as e:
+        report["errors"].append(f"cloudinary listing failed: {e}")
+
+    for name, items in (("orphan_objects", orphan_objects), ("dangling_photo_rows", dangling_photos),
+                        ("orphan_cloudinary_assets", orphan_assets), ("dangling_story_image_rows", dangling_images)):
+        report[name] = {"count": len(items), "sample": [k[1] if isinstance(k, tuple) else k for k in items[:GC_SAMPLE]]}
+    report["objects_scanned"] = len(objects)
+    if dry_run:
+        return report
+
+    # --- 回收（按批、限速，总量不超过 max_deletes）---
+    budget = max_deletes
+    deleted = {"objects": 0, "photo_rows": 0, "cloudinary_assets": 0, "story_image_rows": 0}
+
+    supabase_paths = [k[1] for k in orphan_objects if k[0] == "supabase"][:budget]
+    for batch in batched(supabase_paths, GC_BATCH_SIZE):
+        limiter.wait()
+        supabase.storage.from_(SUPABASE_BUCKET).remove(batch)
+        deleted["objects"] += len(batch)
+    budget -= len(supabase_paths)
+
+    for kind, key in orphan_objects:
+        if kind != "local" or budget <= 0:
+            continue
+        try:
+            os.remove(os.path.join(LOCAL_UPLOAD_DIR, key))
+            deleted["objects"] += 1
+            budget -= 1
+        except OSError as e:
+            report["errors"].append(f"remove {key}: {e}")
+
+    assets = orphan_assets[:max(budget, 0)]
+    for batch in batched(assets, CLOUDINARY_DELETE_BATCH):
+        limiter.wait()
+        try:
+            cloudinary.api.delete_resources(batch)
+            deleted["cloudinary_assets"] += len(batch)
+        except Exception as e:
+            report["errors"].append(f"cloudinary delete failed: {e}")
+            break
+    budget -= len(assets)
+
+    candidates = dangling_photos[:max(budget, 0)]
+    photo_ids = confirm_dangling_photos(candidates, cutoff, limiter)
+    delete_rows_by_id("photo", Photo, photo_ids, limiter)
+    deleted["photo_rows"] = len(photo_ids)
+    report["photo_rows_not_confirmed"] = len(candidates) - len(photo_ids)
+    budget -= len(photo_ids)
+
+    image_ids = dangling_images[:max(budget, 0)]
+    delete_rows_by_id("image", StoryImage, image_ids, limiter)
+    deleted["story_image_rows"] = len(image_ids)
+
+    report["deleted"] = deleted
+    report["remaining"] = (len(orphan_objects) + len(orphan_assets) + len(dangling_photos)
+                           + len(dangling_images) - sum(deleted.values()) - report["photo_rows_not_confirmed"])
+    return report
+
+@app.cli.command("prune-changes")
+@click.option("--days", type=int, default=CHANGE_LOG_RETENTION_DAYS, show_default=True,
+              help="Keep change_log rows newer than this many days.")
+def prune_changes_command(days):
+    """删掉过期的 change_log 流水（游标更早的客户端会收到 410 并重新全量加载）"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    removed = prune_change_log(cutoff)
+    click.echo(f"🧹 removed {removed} change_log rows older than {days} days")
+
+@app.cli.command("gc-orphans")
+@click.option("--dry-run", is_flag=True, help="only report, delete nothing")
+@click.option("--min-age-hours", default=24.0, show_default=True, help="never touch objects or rows newer than this")
+@click.option("--max-deletes", default=1000, show_default=True, help="cap per pass; re-run to continue")
+@click.option("--rate", default=5.0, show_default=True, help="max storage / API batch calls per second")
+def gc_orphans_command(dry_run, min_age_hours, max_deletes, rate):
+    report = gc_orphans(dry_run=dry_run, min_age_hours=min_age_hours, max_deletes=max_deletes, rate=rate)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+# --------------------------
+# Backfill：flask --app main backfill-photo-meta [--batch 200] [--workers 8] [--limit 0]
+# 只读文件头（本地读前 64KB，远程用 HTTP Range），不会下载整张图
+# --------------------------
+def _probe_photo_url(url):
+    try:
+        return probe_url(url, app.static_folder)
+    except Exception as e:
+        app.logger.warning("⚠️ probe failed %s: %s", url, e)
+        return {}
+
+@app.cli.command("backfill-photo-meta")
+@click.option("--batch", default=200, show_default=True, help="rows per page")
+@click.option("--workers", default=8, show_default=True, help="concurrent header reads")
+@click.option("--limit", default=0, show_default=True, help="stop after N rows (0 = all)")
+def backfill_photo_meta(batch, workers, limit):
+    if use_supabase and supabase and not SUPABASE_PHOTO_META:
+        raise click.ClickException("Supabase photo table has no width/height/... columns: run the SQL in migrations 5b7e2c9d41a3 first")
+
+    last, updated, failed = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while not limit or updated + failed < limit:
+            if use_supabase and supabase:
+                rows = (supabase.table("photo").select("id,url").is_("width", "null")
+                        .gt("id", last).order("id").limit(batch).execute().data or [])
+            else:
+                rows = [{"id": i, "url": u} for i, u in
+                        db.session.query(Photo.id, Photo.url)
+                        .filter(Photo.width.is_(None), Photo.id > last).order_by(Photo.id).limit(batch)]
+            if not rows:
+                break
+            last = rows[-1]["id"]
+
+            metas = pool.map(_probe_photo_url, [r["url"] for r in rows])
+            updates = [dict(photo_meta_row(m), id=r["id"]) for r, m in zip(rows, metas) if m]
+            failed += len(rows) - len(updates)
+            if updates:
+                if use_supabase and supabase:
+                    def _update(row):
+                        fields = {k: v for k, v in row.items() if k != "id"}
+                        supabase.table("photo").update(fields).eq("id", row["id"]).execute()
+                    list(pool.map(_update, updates))
+                else:
+                    db.session.execute(db.update(Photo), updates)  # 按主键批量 UPDATE
+                    db.session.commit()
+            updated += len(updates)
+            print(f"… id<={last} updated={updated} failed={failed}")
+
+    print(json.dumps({"updated": updated, "failed": failed}))
+
+# --------------------------
+# 近似重复（perceptual_hash.py）：上传时算 dHash 存进 photo.dhash，旧照片用
+#   flask --app main backfill-photo-dhash [--batch 200] [--workers 4] [--limit 0]
+# 补齐（要解码整张图，读 storage 读缓存；JPEG 用 draft 缩小解码）。
+# /admin/duplicates?threshold=5&limit=50 列出跨相册的近似重复簇（含私密照片）。
+# 每个 worker 内存里一份索引：第一次全量建（30 万张约 1-2 秒），之后按 change_log 增量更新
+# --------------------------
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "7"))  # 索引里保留的最大汉明距离；<=7 时探测最少
+DUPLICATE_THRESHOLD = int(os.getenv("DUPLICATE_THRESHOLD", "5"))        # 默认阈值：64 位里最多差几位算同一张
+DUPLICATE_PAGE = 1000  # PostgREST 默认每次最多返回 1000 行
+
+near_duplicates = NearDuplicateIndex(max_distance=DUPLICATE_MAX_DISTANCE)
+_near_duplicates_lock = threading.Lock()
+_near_duplicates_cursor = None  # 已经应用到索引的 change_log 游标 [txid, id]；None = 还没建
+
+def load_photo_hashes():
+    """[(id, hash), ...] 所有有 dhash 的照片（按 id 分页读）"""
+    if use_supabase and supabase:
+        items, last = [], 0
+        while True:
+            rows = (supabase.table("photo").select("id,dhash").not_.is_("dhash", "null")
+                    .gt("id", last).order("id").limit(DUPLICATE_PAGE).execute().data or [])
+            items.extend((r["id"], from_hex(r.get("dhash"))) for r in rows)
+            if len(rows) < DUPLICATE_PAGE:
+                return items
+            last = rows[-1]["id"]
+    return [(i, from_hex(h)) for i, h in db.session.query(Photo.id, Photo.dhash).filter(Photo.dhash.isnot(None))]
+
+def photo_hashes_for(ids):
+    """{id: hash}；已删除或还没有 dhash 的 id 不在结果里"""
+    found = {}
+    for batch in _chunks(ids, SYNC_BATCH_SIZE):
+        if use_supabase and supabase:
+            rows = [(r["id"], r.get("dhash")) for r in
+                    supabase.table("photo").select("id,dhash").in_("id", batch).execute().data or []]
+        else:
+            rows = db.session.query(Photo.id, Photo.dhash).filter(Photo.id.in_(batch))
+        found.update((i, from_hex(h)) for i, h in rows if h)
+    return found
+
+def _apply_photo_changes():
+    """把游标之后的 photo 变更应用到索引；游标早于已清理的流水时返回 False（需要全量重建）"""
+    global _near_duplicates_cursor
+    pruned, _ = change_log_bounds()
+    since = _near_duplicates_cursor
+    if cursor_expired(pruned, since):
+        return False
+    while True:
+        rows = read_change_log(since, DUPLICATE_PAGE, include_private=True)
+        page = rows[:DUPLICATE_PAGE]
+        ids = sorted({r["entity_id"] for r in page if r["entity"] == "photo"})
+        if ids:
+            hashes = photo_hashes_for(ids)
+            near_duplicates.update([(i, hashes.get(i)) for i in ids])
+        if page:
+            since = feed_cursor(page[-1])
+        if len(rows) <= DUPLICATE_PAGE:
+            break
+    _near_duplicates_cursor = since
+    return True
+
+def refresh_near_duplicates():
+    global _near_duplicates_cursor
+    with _near_duplicates_lock:
+        if _near_duplicates_cursor is not None:
+            try:
+                if _apply_photo_changes():
+                    return
+            except Exception as e:
+                app.logger.warning(f"⚠️ 增量更新近似重复索引失败，全量重建: {e}")
+        # 先取游标再读全表：读表期间的变更之后会再重放一次（update 是幂等的）
+        try:
+            _, head = change_log_bounds()
+        except Exception as e:
+            app.logger.warning(f"⚠️ change_log 不可用，近似重复索引每次全量重建: {e}")
+            head = None
+        started = time.perf_counter()
+        near_duplicates.rebuild(load_photo_hashes())
+        _near_duplicates_cursor = head
+        app.logger.info("🧬 near-duplicate index: %d photos, %d pairs in %.2fs",
+                        len(near_duplicates), len(near_duplicates.edges), time.perf_counter() - started)
+
+@app.route("/admin/duplicates")
+@login_required
+def near_duplicate_clusters():
+    threshold = max(0, min(request.args.get("threshold", DUPLICATE_THRESHOLD, type=int), DUPLICATE_MAX_DISTANCE))
+    limit = parse_limit(request.args.get("limit"))
+    offset = max(0, request.args.get("offset", 0, type=int))
+
+    started = time.perf_counter()
+    refresh_near_duplicates()
+    clusters = near_duplicates.clusters(threshold)
+    page = clusters[offset:offset + limit]
+    rows = {r["id"]: r for r in fetch_photo_rows([i for cluster in page for i in cluster])}
+
+    items = []
+    for cluster in page:
+        photos = [rows[i] for i in cluster if i in rows]
+        if len(photos) < 2:
+            continue  # 刚被删掉（索引下次刷新时会去掉）
+        anchor = from_hex(photos[0].get("dhash"))
+        for p in photos:
+            h = from_hex(p.get("dhash"))
+            p["distance"] = bin(anchor ^ h).count("1") if anchor is not None and h is not None else None
+        items.append({"size": len(photos), "photos": photos})
+
+    return jsonify({
+        "threshold": threshold,
+        "indexed": len(near_duplicates),
+        "total_clusters": len(clusters),
+        "offset": offset,
+        "clusters": items,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+
+def _hash_photo_url(url):
+    try:
+        return dhash_bytes(read_photo_bytes(url))
+    except Exception as e:
+        app.logger.warning("⚠️ dhash failed %s: %s", url, e)
+        return None
+
+@app.cli.command("backfill-photo-dhash")
+@click.option("--batch", default=200, show_default=True, help="rows per page")
+@click.option("--workers", default=4, show_default=True, help="concurrent downloads / decodes")
+@click.option("--limit", default=0, show_default=True, help="stop after N rows (0 = all)")
+def backfill_photo_dhash(batch, workers, limit):
+    if use_supabase and supabase and not SUPABASE_PHOTO_DHASH:
+        raise click.ClickException("Supabase photo table has no dhash column: run the SQL in migrations 3e91c5a7d204 first")
+
+    last, updated, failed = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while not limit or updated + failed < limit:
+            if use_supabase and supabase:
+                rows = (supabase.table("photo").select("id,url").is_("dhash", "null")
+                        .gt("id", last).order("id").limit(batch).execute().data or [])
+            else:
+                rows = [{"id": i, "url": u} for i, u in
+                        db.session.query(Photo.id, Photo.url)
+                        .filter(Photo.dhash.is_(None), Photo.id > last).order_by(Photo.id).limit(batch)]
+            if not rows:
+                break
+            last = rows[-1]["id"]
+
+            hashes = pool.map(_hash_photo_url, [r["url"] for r in rows])
+            updates = [{"id": r["id"], "dhash": to_hex(h)} for r, h in zip(rows, hashes) if h is not None]
+            failed += len(rows) - len(updates)
+            if updates:
+                if use_supabase and supabase:
+                    def _update(row):
+                        supabase.table("photo").update({"dhash": row["dhash"]}).eq("id", row["id"]).execute()
+                    list(pool.map(_update, updates))
+                else:
+                    db.session.execute(db.update(Photo), updates)  # 按主键批量 UPDATE
+                    db.session.commit()
+            updated += len(updates)
+            print(f"… id<={last} updated={updated} failed={failed}")
+
+    print(json.dumps({"updated": updated, "failed": failed}))
+
+# --------------------------
 # 启动
 # --------------------------
 if __name__ == "__main__":
@@ -0,0 +1,307 @@
+# metrics.py —— Prometheus 文本格式指标（多 gunicorn worker 汇总）
+"""
+Minimal Prometheus metrics without extra dependencies.
+
+Every worker process keeps its own counters / histograms / gauges in memory
+and periodically snapshots them to `METRICS_DIR/metrics_<pid>_<start>.json`
+(the start time keeps a recycled pid from overwriting an old worker's file).
+The `/metrics` handler merges all snapshots:
+
+- counters and histograms are summed over live workers plus
+  `metrics_dead.json`: when a worker is found dead (pid gone, or a newer
+  file for the same pid), its counters are folded into that file and its
+  own file is deleted, so totals never go backwards and the directory only
+  holds one file per live worker;
+- gauges are summed over live workers only.
+"""
+import os
+import json
+import time
+import atexit
+import threading
+
+try:
+    import fcntl  # POSIX only; elsewhere concurrent folds are not serialized
+except ImportError:
+    fcntl = None
+
+DEAD_FILE = "metrics_dead.json"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v)) if abs(v) < 1e15 else repr(v)
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+def _read_json(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as fh:
+        json.dump(data, fh, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+# --------------------------
+# Metric types
+# --------------------------
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {"|".join(k): v if not isinstance(v, list) else list(v)
+                    for k, v in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            # [bucket counts..., +Inf count, sum]
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[len(self.buckets)] += 1
+            row[-1] += value
+
+
+# --------------------------
+# Registry
+# --------------------------
+class Registry:
+    def __init__(self, directory, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._collectors = []
+        self._last_flush = 0.0
+        self._flush_lock = threading.Lock()
+        self._started = time.time_ns() // 1000
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, fn):
+        """fn() is called right before each snapshot (e.g. to refresh pool gauges)."""
+        self._collectors.append(fn)
+
+    # ---------- per-process snapshot ----------
+    def _path(self):
+        return os.path.join(self.directory, f"metrics_{os.getpid()}_{self._started}.json")
+
+    def flush(self, force=True):
+        now = time.time()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            self._last_flush = now
+            for fn in self._collectors:
+                try:
+                    fn()
+                except Exception:
+                    pass
+            data = {name: m.snapshot() for name, m in self._metrics.items()}
+            _write_json(self._path(), data)
+        except OSError:
+            pass
+        finally:
+            self._flush_lock.release()
+
+    def maybe_flush(self):
+        self.flush(force=False)
+
+    # ---------- aggregate over workers ----------
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def _worker_files(self):
+        """{filename: (pid, started)} for every per-worker snapshot."""
+        files = {}
+        for fname in os.listdir(self.directory):
+            if not (fname.startswith("metrics_") and fname.endswith(".json")):
+                continue
+            pid, _, started = fname[len("metrics_"):-len(".json")].partition("_")
+            try:
+                files[fname] = (int(pid), int(started or 0))
+            except ValueError:
+                continue
+        return files
+
+    def _dead(self, files):
+        newest = {}
+        for pid, started in files.values():
+            newest[pid] = max(newest.get(pid, started), started)
+        return [fname for fname, (pid, started) in files.items()
+                if started < newest[pid] or not self._alive(pid)]
+
+    def _merge(self, merged, data, gauges=True):
+        for name, values in data.items():
+            metric = self._metrics.get(name)
+            if metric is None or (metric.kind == "gauge" and not gauges):
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in values.items():
+                if isinstance(value, list):
+                    row = target.get(key)
+                    if row is None or len(row) != len(value):
+                        target[key] = list(value)
+                    else:
+                        for i, v in enumerate(value):
+                            row[i] += v
+                else:
+                    target[key] = target.get(key, 0.0) + value
+
+    def mark_dead(self, fnames):
+        """Fold dead workers' counters / histograms into metrics_dead.json and delete their files."""
+        if not fnames:
+            return
+        with open(os.path.join(self.directory, ".dead.lock"), "a") as lock_fh:
+            if fcntl:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX)  # 两个 worker 同时 collect 时别把同一个文件折叠两次
+            dead_path = os.path.join(self.directory, DEAD_FILE)
+            dead = _read_json(dead_path) or {}
+            folded = []
+            for fname in fnames:
+                data = _read_json(os.path.join(self.directory, fname))
+                if data is not None:
+                    self._merge(dead, data, gauges=False)
+                    folded.append(fname)
+            if folded:
+                _write_json(dead_path, dead)
+            for fname in folded:
+                try:
+                    os.remove(os.path.join(self.directory, fname))
+                except OSError:
+                    pass
+
+    def collect(self):
+        """Merge every worker snapshot. Returns {metric_name: {label_key: value}}."""
+        self.flush()
+        try:
+            self.mark_dead(self._dead(self._worker_files()))
+        except OSError:
+            pass
+        merged = {name: {} for name in self._metrics}
+        fnames = list(self._worker_files()) + [DEAD_FILE]
+        for fname in fnames:
+            data = _read_json(os.path.join(self.directory, fname))
+            if data is not None:
+                self._merge(merged, data)
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (0.0.4)."""
+        merged = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key in sorted(merged.get(name, {})):
+                value = merged[name][key]
+                label_values = key.split("|") if metric.labelnames else []
+                pairs = list(zip(metric.labelnames, label_values))
+                if metric.kind == "histogram":
+                    # bucket counts are already cumulative (see Histogram.observe)
+                    for i, bound in enumerate(metric.buckets):
+                        lines.append(f"{name}_bucket{_fmt_labels(pairs + [('le', _fmt_value(float(bound)))])} {_fmt_value(value[i])}")
+                    count = value[len(metric.buckets)]
+                    lines.append(f"{name}_bucket{_fmt_labels(pairs + [('le', '+Inf')])} {_fmt_value(count)}")
+                    lines.append(f"{name}_sum{_fmt_labels(pairs)} {_fmt_value(value[-1])}")
+                    lines.append(f"{name}_count{_fmt_labels(pairs)} {_fmt_value(count)}")
+                else:
+                    lines.append(f"{name}{_fmt_labels(pairs)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def pool_stats(engine):
+    """checked_out / checked_in / size / overflow for a QueuePool-backed engine."""
+    pool = engine.pool
+    stats = {}
+    for attr in ("checkedout", "checkedin", "size", "overflow"):
+        fn = getattr(pool, attr, None)
+        if callable(fn):
+            try:
+                stats[attr] = fn()
+            except Exception:
+                continue
+    return stats
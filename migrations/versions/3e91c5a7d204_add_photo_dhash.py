@@ -0,0 +1,34 @@
+"""add photo dhash
+
+Revision ID: 3e91c5a7d204
+Revises: 8d3f0a6c2b71
+Create Date: 2026-10-19 19:41:27.690314
+
+Supabase (photo table) needs the same column:
+
+    alter table photo add column if not exists dhash varchar(16);
+
+The app checks for it once at startup (SUPABASE_PHOTO_DHASH=auto) and leaves it out
+until it exists; restart the workers after running the SQL.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e91c5a7d204'
+down_revision = '8d3f0a6c2b71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dhash', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    # 不用 batch：SQLite 的 batch 模式会重建 photo 表，把 change_log 触发器一起删掉
+    # （DROP COLUMN 需要 SQLite >= 3.35）
+    op.drop_column('photo', 'dhash')
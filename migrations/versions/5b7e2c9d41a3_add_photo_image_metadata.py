@@ -0,0 +1,46 @@
+"""add photo image metadata
+
+Revision ID: 5b7e2c9d41a3
+Revises: 0152c79cff0c
+Create Date: 2026-10-19 10:12:41.204117
+
+Supabase (photo table) needs the same columns:
+
+    alter table photo
+      add column if not exists width integer,
+      add column if not exists height integer,
+      add column if not exists byte_size bigint,
+      add column if not exists mime_type varchar(64),
+      add column if not exists orientation smallint;
+
+The app checks for them once at startup (SUPABASE_PHOTO_META=auto) and leaves them out
+until they exist; restart the workers after running the SQL.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c9d41a3'
+down_revision = '0152c79cff0c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('byte_size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('mime_type', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('orientation', sa.SmallInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_column('orientation')
+        batch_op.drop_column('mime_type')
+        batch_op.drop_column('byte_size')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
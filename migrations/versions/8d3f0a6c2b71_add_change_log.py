@@ -0,0 +1,136 @@
+"""add change_log table and triggers
+
+Revision ID: 8d3f0a6c2b71
+Revises: 5b7e2c9d41a3
+Create Date: 2026-10-19 19:24:05.518230
+
+On a Postgres DATABASE_URL upgrade() runs POSTGRES_TABLE, POSTGRES_FUNCTION
+and postgres_triggers() below. Supabase needs exactly the same SQL, except
+that story images live in "image" there: paste POSTGRES_TABLE,
+POSTGRES_FUNCTION and postgres_triggers("image") into the SQL editor.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f0a6c2b71'
+down_revision = '5b7e2c9d41a3'
+branch_labels = None
+depends_on = None
+
+EVENTS = (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete"))
+
+
+def _sqlite_triggers():
+    for event, row, kind in EVENTS:
+        yield f"""
+CREATE TRIGGER IF NOT EXISTS change_log_photo_{event} AFTER {event} ON photo
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('photo', {row}.id, '{kind}', {row}.album, COALESCE({row}.is_private, 0), CURRENT_TIMESTAMP);
+END"""
+        yield f"""
+CREATE TRIGGER IF NOT EXISTS change_log_story_{event} AFTER {event} ON story
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('story', {row}.id, '{kind}', NULL, 0, CURRENT_TIMESTAMP);
+END"""
+        yield f"""
+CREATE TRIGGER IF NOT EXISTS change_log_story_image_{event} AFTER {event} ON story_image
+WHEN EXISTS (SELECT 1 FROM story WHERE id = {row}.story_id)
+BEGIN
+  INSERT INTO change_log (entity, entity_id, op, album, is_private, created_at)
+  VALUES ('story', {row}.story_id, 'upsert', NULL, 0, CURRENT_TIMESTAMP);
+END"""
+
+
+POSTGRES_TABLE = """
+create table if not exists change_log (
+  id bigint generated always as identity primary key,
+  entity varchar(16) not null,
+  entity_id integer not null,
+  op varchar(8) not null,
+  album varchar(255),
+  is_private boolean not null default false,
+  created_at timestamp not null default (now() at time zone 'utc')
+);
+create index if not exists ix_change_log_created_at on change_log (created_at)
+"""
+
+POSTGRES_FUNCTION = """
+create or replace function log_change() returns trigger language plpgsql as $$
+begin
+  if TG_TABLE_NAME = 'photo' then
+    if TG_OP = 'DELETE' then
+      insert into change_log (entity, entity_id, op, album, is_private, created_at)
+      values ('photo', OLD.id, 'delete', OLD.album, coalesce(OLD.is_private, false), now() at time zone 'utc');
+    else
+      insert into change_log (entity, entity_id, op, album, is_private, created_at)
+      values ('photo', NEW.id, 'upsert', NEW.album, coalesce(NEW.is_private, false), now() at time zone 'utc');
+    end if;
+  elsif TG_TABLE_NAME = 'story' then
+    insert into change_log (entity, entity_id, op, is_private, created_at)
+    values ('story', case when TG_OP = 'DELETE' then OLD.id else NEW.id end,
+            case when TG_OP = 'DELETE' then 'delete' else 'upsert' end, false, now() at time zone 'utc');
+  else
+    if exists (select 1 from story where id = coalesce(NEW.story_id, OLD.story_id)) then
+      insert into change_log (entity, entity_id, op, is_private, created_at)
+      values ('story', coalesce(NEW.story_id, OLD.story_id), 'upsert', false, now() at time zone 'utc');
+    end if;
+  end if;
+  return null;
+end $$
+"""
+
+
+def postgres_triggers(image_table='story_image'):
+    for table in ('photo', 'story', image_table):
+        yield (f"create trigger change_log_{table} after insert or update or delete on {table} "
+               f"for each row execute function log_change()")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(POSTGRES_TABLE)
+        op.execute(POSTGRES_FUNCTION)
+        for statement in postgres_triggers():
+            op.execute(statement)
+        return
+
+    op.create_table(
+        'change_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(length=16), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(length=8), nullable=False),
+        sa.Column('album', sa.String(length=255), nullable=True),
+        sa.Column('is_private', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True,
+    )
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_change_log_created_at'), ['created_at'], unique=False)
+
+    if dialect == 'sqlite':
+        for statement in _sqlite_triggers():
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for table in ('photo', 'story', 'story_image'):
+            for event, _, _ in EVENTS:
+                op.execute(f"DROP TRIGGER IF EXISTS change_log_{table}_{event}")
+    elif dialect == 'postgresql':
+        for table in ('photo', 'story', 'story_image'):
+            op.execute(f"drop trigger if exists change_log_{table} on {table}")
+        op.execute("drop function if exists log_change()")
+
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_change_log_created_at'))
+
+    op.drop_table('change_log')
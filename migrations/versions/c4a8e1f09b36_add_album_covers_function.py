@@ -0,0 +1,50 @@
+"""add photo (album, id) index and album_covers function
+
+Revision ID: c4a8e1f09b36
+Revises: 3e91c5a7d204
+Create Date: 2026-10-20 10:12:44.108362
+
+album_covers(names) returns the newest public photo of each album in one
+index probe per album (/api/albums calls it once per page). Supabase needs
+the same index + function: run INDEX_SQL and ALBUM_COVERS_SQL below in the
+SQL editor (upgrade() runs exactly these on a Postgres DATABASE_URL). Until
+then the app falls back to one limit(1) query per album: it checks for the
+function once at startup (SUPABASE_ALBUM_COVERS_RPC=auto), so restart the
+workers after running the SQL.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e1f09b36'
+down_revision = '3e91c5a7d204'
+branch_labels = None
+depends_on = None
+
+INDEX_SQL = "create index if not exists ix_photo_album_id on photo (album, id)"
+
+ALBUM_COVERS_SQL = """
+create or replace function album_covers(names text[])
+returns table (album text, url text) language sql stable as $$
+  select a.name, p.url::text
+  from unnest(names) as a(name)
+  cross join lateral (
+    select photo.url from photo
+    where photo.album = a.name and photo.is_private = false
+    order by photo.id desc
+    limit 1
+  ) p
+$$
+"""
+
+
+def upgrade():
+    op.execute(INDEX_SQL)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(ALBUM_COVERS_SQL)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("drop function if exists album_covers(text[])")
+    op.execute("drop index if exists ix_photo_album_id")
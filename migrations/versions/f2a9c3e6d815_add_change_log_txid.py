@@ -0,0 +1,120 @@
+"""add change_log.txid and snapshot-watermark feed functions
+
+Revision ID: f2a9c3e6d815
+Revises: c4a8e1f09b36
+Create Date: 2026-10-20 11:03:18.552907
+
+change_log.id is assigned at insert time, not commit time, so a long
+transaction can commit ids below a cursor clients already have. On Postgres
+every row records the writing transaction (txid xid8, default
+pg_current_xact_id()); the feed only hands out rows whose transaction is
+older than pg_snapshot_xmin(pg_current_snapshot()) -- i.e. finished -- in
+(txid, id) order, so nothing can appear behind a cursor later.
+
+On a Postgres DATABASE_URL upgrade() runs POSTGRES_SQL below; Supabase needs
+exactly the same statements (paste POSTGRES_SQL into the SQL editor).
+SQLite has a single writer, ids are already in commit order there, and
+txid stays NULL.
+
+change_log_prune(cutoff) deletes every row before the last finished row
+older than cutoff, in (txid, id) order, and keeps that row as a marker
+(op = 'pruned'); change_log_bounds() reports the newest marker, and cursors
+behind it get 410 (change_feed.cursor_expired).
+
+UNVERIFIED: the test suite runs on SQLite only, and POSTGRES_SQL has not
+been executed against a Postgres server. Before relying on it, run it on a
+scratch database and exercise /api/changes and `flask prune-changes`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9c3e6d815'
+down_revision = 'c4a8e1f09b36'
+branch_labels = None
+depends_on = None
+
+POSTGRES_SQL = (
+    "alter table change_log add column if not exists txid xid8 not null default pg_current_xact_id()",
+    "create index if not exists ix_change_log_txid_id on change_log (txid, id)",
+    """
+create or replace function change_log_page(since_txid bigint, since_id bigint, lim integer, include_private boolean)
+returns table (id bigint, entity varchar, entity_id integer, op varchar, album varchar,
+               is_private boolean, txid bigint)
+language sql stable as $$
+  select c.id::bigint, c.entity, c.entity_id, c.op, c.album, c.is_private, c.txid::text::bigint
+  from change_log c
+  where c.txid < pg_snapshot_xmin(pg_current_snapshot())
+    and (c.txid, c.id) > (since_txid::text::xid8, since_id)
+    and (include_private or not c.is_private)
+  order by c.txid, c.id
+  limit lim
+$$
+""",
+    "create index if not exists ix_change_log_pruned on change_log (txid, id) where op = 'pruned'",
+    "drop function if exists change_log_bounds()",
+    """
+create function change_log_bounds()
+returns table (pruned_txid bigint, pruned_id bigint, head_txid bigint, head_id bigint)
+language sql stable as $$
+  select p.txid::text::bigint, p.id::bigint, coalesce(h.txid::text::bigint, 0), coalesce(h.id::bigint, 0)
+  from (select 1) one
+  left join lateral (
+    select c.txid, c.id from change_log c
+    where c.op = 'pruned'
+    order by c.txid desc, c.id desc
+    limit 1
+  ) p on true
+  left join lateral (
+    select c.txid, c.id from change_log c
+    where c.txid < pg_snapshot_xmin(pg_current_snapshot())
+    order by c.txid desc, c.id desc
+    limit 1
+  ) h on true
+$$
+""",
+    """
+create or replace function change_log_prune(cutoff timestamp)
+returns bigint language plpgsql as $$
+declare
+  marker record;
+  removed bigint;
+begin
+  -- marker.txid < xmin: every transaction that could write a row before it has finished
+  select c.txid, c.id into marker from change_log c
+  where c.created_at < cutoff and c.txid < pg_snapshot_xmin(pg_current_snapshot())
+  order by c.txid desc, c.id desc
+  limit 1;
+  if not found then
+    return 0;
+  end if;
+  delete from change_log c where (c.txid, c.id) < (marker.txid, marker.id);
+  get diagnostics removed = row_count;
+  update change_log set op = 'pruned' where id = marker.id;
+  return removed;
+end
+$$
+""",
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for statement in POSTGRES_SQL:
+            op.execute(statement)
+        return
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('txid', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("drop function if exists change_log_prune(timestamp)")
+        op.execute("drop function if exists change_log_bounds()")
+        op.execute("drop index if exists ix_change_log_pruned")
+        op.execute("drop function if exists change_log_page(bigint, bigint, integer, boolean)")
+        op.execute("drop index if exists ix_change_log_txid_id")
+        op.execute("alter table change_log drop column if exists txid")
+        return
+    op.drop_column('change_log', 'txid')
@@ -0,0 +1,358 @@
+# perceptual_hash.py —— dHash 感知哈希 + 近似重复聚类（NumPy 多索引哈希，没装 NumPy 时用 BK-tree）
+"""
+Near-duplicate detection.
+
+`dhash()` reduces an image to 9x8 grey pixels and keeps one bit per
+horizontal gradient, giving a 64-bit hash that survives resizing,
+re-compression and WeChat-style re-exports; two photos are near duplicates
+when the Hamming distance of their hashes is <= threshold (a few bits).
+Decoding uses JPEG draft mode, so only a downscaled image is ever
+materialised.
+
+`HashIndex` answers "all pairs within threshold" without comparing every
+pair:
+
+- with NumPy, multi-index hashing: the hash is split into four 16-bit
+  blocks; two hashes within distance t share at least one block that
+  differs in <= t // 4 bits, so only rows whose block equals one of those
+  few probe keys (a bucket lookup on the sorted block) are compared, in
+  vectorised batches with packed uint64 XOR + popcount;
+- without NumPy, a BK-tree (metric tree over Hamming distance) does the
+  same search in pure Python -- fine for tens of thousands of photos.
+
+`NearDuplicateIndex` keeps the resulting pairs and updates them as photos
+come and go, so listing clusters never repeats the full search.
+"""
+import io
+from itertools import combinations
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    import numpy as np  # 可选依赖；几十万张照片时用向量化搜索
+except ImportError:
+    np = None
+
+HASH_BITS = 64
+BLOCKS = 4
+BLOCK_BITS = HASH_BITS // BLOCKS
+MAX_PAIRS_PER_BATCH = 4_000_000  # 一批最多比较这么多候选对（内存上限约 100MB）
+
+
+def dhash(img, size=8):
+    """64-bit difference hash of a PIL image (EXIF orientation applied)."""
+    img.draft("L", (size * 4, size * 4))  # JPEG 按 1/2…1/8 缩放解码，其余格式无效果
+    img = ImageOps.exif_transpose(img).convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def dhash_bytes(data):
+    """dHash of encoded image bytes, or None if Pillow cannot read them."""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return dhash(img)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+def to_hex(value):
+    return f"{value:016x}"
+
+
+def from_hex(text):
+    try:
+        return int(text, 16) if text else None
+    except ValueError:
+        return None
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# --------------------------
+# BK-tree（纯 Python 回退）
+# --------------------------
+class BKTree:
+    def __init__(self):
+        self.root = None  # [hash, [ids], {distance: child}]
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        """[(distance, item), ...] for every item within radius."""
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:  # 三角不等式剪枝
+                    stack.append(child)
+        return found
+
+
+# --------------------------
+# Index + clustering
+# --------------------------
+class _UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        parent = self.parent
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+    def groups(self):
+        out = {}
+        for x in self.parent:
+            out.setdefault(self.find(x), []).append(x)
+        return list(out.values())
+
+
+class HashIndex:
+    """Immutable index over (item id, 64-bit hash) pairs."""
+
+    def __init__(self, items, use_numpy=None):
+        self.ids = [i for i, h in items if h is not None]
+        self.hashes = [h for _, h in items if h is not None]
+        self.use_numpy = (np is not None) if use_numpy is None else (use_numpy and np is not None)
+        self._tree = None
+        if self.use_numpy:
+            self._packed = np.array(self.hashes, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def pairs(self, threshold):
+        """Yield (id_a, id_b, distance) for every pair within threshold, each pair once."""
+        if self.use_numpy:
+            yield from self._pairs_numpy(threshold)
+        else:
+            yield from self._pairs_bktree(threshold)
+
+    def clusters(self, threshold):
+        """[[id, ...], ...] near-duplicate groups (size >= 2), largest first."""
+        uf = _UnionFind()
+        for a, b, _ in self.pairs(threshold):
+            uf.union(a, b)
+        groups = [sorted(g) for g in uf.groups()]
+        groups.sort(key=lambda g: (-len(g), g[0]))
+        return groups
+
+    # ---------- BK-tree ----------
+    def _pairs_bktree(self, threshold):
+        if self._tree is None:
+            self._tree = BKTree()
+            for pos, value in enumerate(self.hashes):
+                self._tree.add(value, pos)
+        for pos, value in enumerate(self.hashes):
+            for d, other in self._tree.search(value, threshold):
+                if other > pos:
+                    yield self.ids[pos], self.ids[other], d
+
+    # ---------- NumPy multi-index hashing ----------
+    def _blocks(self):
+        """Per block: (keys, rows sorted by key, bucket start table), built once."""
+        if getattr(self, "_block_cache", None) is None:
+            self._block_cache = []
+            for block in range(BLOCKS):
+                keys = ((self._packed >> np.uint64(block * BLOCK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+                order = np.argsort(keys, kind="stable")
+                # 块只有 16 位：直接建 65536 个桶的起始下标表，探测就是两次数组取值
+                starts = np.zeros((1 << BLOCK_BITS) + 1, dtype=np.int64)
+                np.cumsum(np.bincount(keys, minlength=1 << BLOCK_BITS), out=starts[1:])
+                self._block_cache.append((keys, order, starts))
+        return self._block_cache
+
+    def _pairs_numpy(self, threshold):
+        hashes = self._packed
+        if len(hashes) < 2:
+            return
+        ids = np.array(self.ids, dtype=np.int64)
+        masks = _probe_masks(threshold // BLOCKS)
+        seen = set()
+        for keys, order, starts in self._blocks():
+            for mask in masks:
+                # 桶 k 和桶 k^mask 只从小的那边探测一次；同一个桶里只取 a < b
+                rows = np.nonzero((keys ^ mask) > keys)[0] if mask else np.arange(len(keys))
+                probe = keys[rows] ^ mask
+                for a, b in _expand(rows, starts[probe], starts[probe + 1], order):
+                    if not mask:
+                        keep = b > a
+                        a, b = a[keep], b[keep]
+                    dist = _popcount(hashes[a] ^ hashes[b])
+                    close = dist <= threshold
+                    for x, y, d in zip(ids[a[close]].tolist(), ids[b[close]].tolist(), dist[close].tolist()):
+                        pair = (x, y) if x < y else (y, x)
+                        if pair not in seen:  # 同一对可能在多个块里都命中
+                            seen.add(pair)
+                            yield pair[0], pair[1], d
+
+    def query(self, value, threshold):
+        """[(id, distance), ...] for every indexed hash within threshold of value."""
+        if not self.ids:
+            return []
+        if not self.use_numpy:
+            if self._tree is None:
+                self._tree = BKTree()
+                for pos, h in enumerate(self.hashes):
+                    self._tree.add(h, pos)
+            return [(self.ids[pos], d) for d, pos in self._tree.search(value, threshold)]
+        candidates = []
+        for block, (keys, order, starts) in enumerate(self._blocks()):
+            key = (value >> (block * BLOCK_BITS)) & 0xFFFF
+            for mask in _probe_masks(threshold // BLOCKS):
+                k = key ^ mask
+                candidates.append(order[starts[k]:starts[k + 1]])
+        pos = np.unique(np.concatenate(candidates))
+        dist = _popcount(self._packed[pos] ^ np.uint64(value))
+        close = dist <= threshold
+        return [(self.ids[p], d) for p, d in zip(pos[close].tolist(), dist[close].tolist())]
+
+
+class NearDuplicateIndex:
+    """
+    Near-duplicate pairs (distance <= max_distance) over a changing set of
+    photos. `rebuild()` runs the full pair search once; `update()` applies
+    inserts / hash changes / deletes by querying only the changed hashes
+    (against the last snapshot plus a small delta) and only rebuilds once the
+    delta grows past `rebuild_ratio` of the collection. `clusters()` is a
+    union-find over the stored pairs, so it costs O(pairs), not O(photos).
+    """
+
+    def __init__(self, max_distance=7, rebuild_ratio=0.1, use_numpy=None):
+        self.max_distance = max_distance
+        self.rebuild_ratio = rebuild_ratio
+        self.use_numpy = use_numpy
+        self.hashes = {}
+        self.edges = {}   # (id_a, id_b) a < b -> distance
+        self._adj = {}
+        self._snapshot = HashIndex([], use_numpy)
+        self._stale = set()  # 快照里的哈希已经过期（改了 / 删了）的 id
+        self._delta = {}     # 快照之后新增 / 改过的 id -> hash
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def rebuild(self, items):
+        self.hashes = {i: h for i, h in items if h is not None}
+        self._snapshot = HashIndex(list(self.hashes.items()), self.use_numpy)
+        self._stale, self._delta = set(), {}
+        self.edges, self._adj = {}, {}
+        for a, b, d in self._snapshot.pairs(self.max_distance):
+            self._link(a, b, d)
+
+    def update(self, items):
+        """items: (id, hash) pairs; hash None = photo deleted or not hashable."""
+        for item_id, value in items:
+            self._unlink(item_id)
+            self._stale.add(item_id)
+            self._delta.pop(item_id, None)
+            if value is None:
+                self.hashes.pop(item_id, None)
+                continue
+            self.hashes[item_id] = value
+            for other, d in self._snapshot.query(value, self.max_distance):
+                if other not in self._stale:
+                    self._link(item_id, other, d)
+            for other, h in self._delta.items():
+                d = hamming(value, h)
+                if d <= self.max_distance:
+                    self._link(item_id, other, d)
+            self._delta[item_id] = value
+        if len(self._stale) > self.rebuild_ratio * max(len(self.hashes), 1000):
+            self.rebuild(list(self.hashes.items()))
+
+    def clusters(self, threshold=None):
+        threshold = self.max_distance if threshold is None else min(threshold, self.max_distance)
+        uf = _UnionFind()
+        for (a, b), d in self.edges.items():
+            if d <= threshold:
+                uf.union(a, b)
+        groups = [sorted(g) for g in uf.groups()]
+        groups.sort(key=lambda g: (-len(g), g[0]))
+        return groups
+
+    def _link(self, a, b, d):
+        if a == b:
+            return
+        pair = (a, b) if a < b else (b, a)
+        self.edges[pair] = d
+        self._adj.setdefault(a, set()).add(b)
+        self._adj.setdefault(b, set()).add(a)
+
+    def _unlink(self, item_id):
+        for other in self._adj.pop(item_id, ()):
+            self.edges.pop((item_id, other) if item_id < other else (other, item_id), None)
+            self._adj.get(other, set()).discard(item_id)
+
+
+def _probe_masks(radius):
+    """All 16-bit masks with <= radius bits set (the block keys to probe)."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BLOCK_BITS), r):
+            m = 0
+            for bit in bits:
+                m |= 1 << bit
+            masks.append(m)
+    return masks
+
+
+def _expand(rows, lo, hi, order):
+    """(row, candidate) index arrays for rows[i] x order[lo[i]:hi[i]], in bounded batches."""
+    counts = hi - lo
+    cumulative = np.cumsum(counts)
+    start, n = 0, len(counts)
+    while start < n:
+        base = int(cumulative[start - 1]) if start else 0
+        stop = max(int(np.searchsorted(cumulative, base + MAX_PAIRS_PER_BATCH, side="right")), start + 1)
+        c = counts[start:stop]
+        total = int(cumulative[stop - 1]) - base
+        if total:
+            a = np.repeat(rows[start:stop], c)
+            b = order[np.repeat(lo[start:stop] - (np.cumsum(c) - c), c) + np.arange(total)]
+            yield a, b
+        start = stop
+
+
+if np is not None and hasattr(np, "bitwise_count"):
+    def _popcount(values):
+        return np.bitwise_count(values)
+elif np is not None:
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
@@ -0,0 +1,119 @@
+# profiler.py —— 单请求采样 profiler，输出 flame graph 可用的 folded stacks
+"""
+Wall-clock sampling profiler for one request thread.
+
+A helper thread snapshots the request thread's stack via
+`sys._current_frames()` every `interval` seconds and counts identical stacks.
+The result is the "folded" format (`frame;frame;frame count` per line) read
+by flamegraph.pl, speedscope and inferno. Because it samples from outside, time
+spent in C code (Pillow decode, socket reads) is attributed to the Python
+frame that called it.
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def _folded_stack(frame, max_depth=128):
+    parts = []
+    while frame is not None and len(parts) < max_depth:
+        parts.append(_frame_label(frame))
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        target = self.thread_id
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                self.samples[_folded_stack(frame)] += 1
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="xialens-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self.samples
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """Profiles on disk, pruned oldest-first to stay under max_files / max_bytes."""
+
+    SUFFIX = ".folded"
+
+    def __init__(self, directory, max_files=200, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append({"name": name, "bytes": st.st_size, "mtime": st.st_mtime})
+        entries.sort(key=lambda e: e["mtime"])
+        return entries
+
+    def save(self, name, text):
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name) + self.SUFFIX
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as fh:
+            fh.write(text)
+        self.prune()
+        return name
+
+    def prune(self):
+        entries = self._entries()
+        total = sum(e["bytes"] for e in entries)
+        while entries and (len(entries) > self.max_files or total > self.max_bytes):
+            oldest = entries.pop(0)
+            total -= oldest["bytes"]
+            try:
+                os.remove(os.path.join(self.directory, oldest["name"]))
+            except OSError:
+                pass
+
+    def list(self):
+        return list(reversed(self._entries()))
+
+    def path(self, name):
+        if not name.endswith(self.SUFFIX) or os.sep in name or name.startswith("."):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
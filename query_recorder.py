@@ -0,0 +1,143 @@
+# query_recorder.py —— 每个请求的 SQL / Supabase 查询计数 + N+1 检测（默认关闭）
+"""
+Opt-in per-request query recorder.
+
+Every SQLAlchemy statement (engine events) and every Supabase
+`table(...).execute()` (via the instrumentation wrapper) is reduced to a
+*shape* (literals and bind values replaced by `?`) and counted on `flask.g`.
+At the end of the request (for streamed responses: once the body has been
+fully generated, from the response's close callback):
+
+- more than `budget` statements for the endpoint, or
+- the same shape repeated `repeat_threshold` times or more (N+1)
+
+is reported. mode="warn" logs a warning, mode="raise" raises
+QueryBudgetExceeded so test clients fail loudly.
+"""
+import re
+import logging
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+import instrumentation
+
+logger = logging.getLogger("xialens.queries")
+
+MODES = ("off", "warn", "raise")
+
+_WS_RE = re.compile(r"\s+")
+_STR_RE = re.compile(r"'(?:[^']|'')*'")
+_NUM_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\([^)]+\)s|%s|:\w+|\$\d+|\?")
+_IN_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    """Normalize a SQL statement so N+1 repetitions collapse onto one shape."""
+    s = _WS_RE.sub(" ", statement.strip())
+    s = _STR_RE.sub("?", s)
+    s = _PARAM_RE.sub("?", s)
+    s = _NUM_RE.sub("?", s)
+    s = _IN_RE.sub("IN (?)", s)
+    return s
+
+
+class QueryRecorder:
+    def __init__(self, mode="off", budgets=None, default_budget=None, repeat_threshold=5):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.budgets = dict(budgets or {})
+        self.default_budget = default_budget
+        self.repeat_threshold = repeat_threshold
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    # ---------- capture ----------
+    def _current(self):
+        if not has_request_context():
+            return None
+        return getattr(g, "_query_shapes", None)
+
+    def add(self, kind, shape):
+        shapes = self._current()
+        if shapes is not None:
+            shapes.append(f"{kind}: {shape}")
+
+    def _on_sql(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled:
+            self.add("sql", statement_shape(statement))
+
+    def _on_supabase(self, shape):
+        if self.enabled:
+            self.add("supabase", shape)
+
+    # ---------- evaluation ----------
+    def violations(self, endpoint, shapes):
+        """Return a list of human-readable problems for one request."""
+        problems = []
+        budget = self.budgets.get(endpoint, self.default_budget)
+        if budget is not None and len(shapes) > budget:
+            problems.append(f"{len(shapes)} queries > budget {budget}")
+        for shape, n in Counter(shapes).most_common():
+            if n < self.repeat_threshold:
+                break
+            problems.append(f"repeated {n}x (possible N+1): {shape[:200]}")
+        return problems
+
+    def check(self, endpoint, shapes):
+        problems = self.violations(endpoint, shapes)
+        if not problems:
+            return
+        msg = f"query budget exceeded for {endpoint}: " + "; ".join(problems)
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(msg)
+        logger.warning(msg)
+
+    @contextmanager
+    def override(self, mode=None, budgets=None):
+        """Temporarily switch mode / budgets (e.g. mode="raise" inside a test)."""
+        saved = (self.mode, self.budgets)
+        if mode is not None:
+            self.mode = mode
+        if budgets is not None:
+            self.budgets = dict(self.budgets, **budgets)
+        try:
+            yield self
+        finally:
+            self.mode, self.budgets = saved
+
+    # ---------- wiring ----------
+    def init_app(self, app, engines=()):
+        for engine in engines:
+            if not event.contains(engine, "before_cursor_execute", self._on_sql):
+                event.listen(engine, "before_cursor_execute", self._on_sql)
+        instrumentation.add_query_listener(self._on_supabase)
+
+        @app.before_request
+        def _start_query_recording():
+            if self.enabled:
+                g._query_shapes = []
+
+        @app.after_request
+        def _check_query_budget(response):
+            shapes = getattr(g, "_query_shapes", None)
+            if shapes is None or not self.enabled:
+                return response
+            endpoint = request.endpoint or "unmatched"
+            if response.is_streamed:
+                # body 还没生成，这里的 shapes 不全：等流发完（close）再按完整列表查一次
+                response.call_on_close(lambda: self.check(endpoint, shapes))
+                return response
+            response.headers["X-Query-Count"] = str(len(shapes))
+            self.check(endpoint, shapes)
+            return response
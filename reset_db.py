@@ -1,23 +1,19 @@
-from main import app, db, Album, AlbumCover, Photo, sync_all_to_db
+from main import app, db, Album, Photo, sync_all_to_db
 
 def main():
     with app.app_context():
         db.drop_all()
         db.create_all()
 
-        result = sync_all_to_db()
+        # 表刚清空，checkpoint 里的水位已经失效 → 全量扫描
+        result = sync_all_to_db(full=True)
         print(result)
 
         # 打印表结构
-        for model in [Album, AlbumCover, Photo]:
+        for model in [Album, Photo]:
             print(f"\n=== {model.__tablename__} ===")
             for col in model.__table__.columns:
                 print(f"{col.name} - {col.type}")
 
 if __name__ == "__main__":
     main()
-
-
-
-
-
@@ -0,0 +1,57 @@
+# responsive.py —— <img> 的 srcset / sizes：Cloudinary 用 URL 变换，其他走 /img/<id>?w=
+"""
+Responsive image attributes.
+
+`img_attrs` renders `src`, `srcset`, `sizes`, `width` and `height` for one
+image, so the browser picks the smallest candidate that covers the slot at
+the device's pixel ratio. Candidate URLs come from a `variant(width)`
+callable: Cloudinary delivery URLs get an inline transformation, other
+photos are served through the resizing proxy (`/img/<id>?w=`).
+"""
+from markupsafe import Markup, escape
+
+from image_proxy import VARIANT_WIDTHS
+
+CLOUDINARY_HOST = "res.cloudinary.com"
+THUMB_WIDTHS = (160, 320, 480)
+GRID_WIDTHS = (160, 320, 480, 640, 800)
+
+
+def is_cloudinary(url):
+    return bool(url) and CLOUDINARY_HOST in url and "/upload/" in url
+
+
+def cloudinary_variant(url, width, box=None):
+    """Delivery URL scaled to `width`; with box=(w, h) it is cropped (c_fill) to that aspect."""
+    if box:
+        height = max(1, round(width * box[1] / box[0]))
+        transform = f"w_{width},h_{height},c_fill"
+    else:
+        transform = f"w_{width},c_limit"
+    head, tail = url.split("/upload/", 1)
+    return f"{head}/upload/{transform},f_auto,q_auto/{tail}"
+
+
+def pick_widths(widths, source_width=None):
+    """Sorted candidate widths, dropping upscales of a source of known width (one is always kept)."""
+    widths = sorted({int(w) for w in widths if w})
+    if source_width:
+        widths = [w for w in widths if w <= source_width] or widths[:1]
+    return widths
+
+
+def img_attrs(variant, widths, sizes, width=None, height=None):
+    """
+    variant(w) -> url. `width`/`height` are written out so the browser
+    reserves the slot (aspect ratio) before the image arrives.
+    """
+    widths = widths or list(VARIANT_WIDTHS[:1])
+    srcset = ", ".join(f"{variant(w)} {w}w" for w in widths)
+    parts = [
+        f'src="{escape(variant(widths[len(widths) // 2]))}"',
+        f'srcset="{escape(srcset)}"',
+        f'sizes="{escape(sizes)}"',
+    ]
+    if width and height:
+        parts.append(f'width="{int(width)}" height="{int(height)}"')
+    return Markup(" ".join(parts))
@@ -0,0 +1,146 @@
+# resumable_upload.py —— 断点续传（tus 风格：create → PATCH 分片 → finalize）
+"""
+Server-side state for resumable chunked uploads.
+
+Each upload is two files in UPLOAD_TMP_DIR: `<id>.json` (declared length and
+the form fields given at create time) and `<id>.part` (bytes received so far).
+The current offset is simply the size of the .part file, so a client that lost
+its connection asks for the offset and continues from there.
+"""
+import os
+import json
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY_BUFSIZE = 64 * 1024
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class OffsetMismatch(Exception):
+    def __init__(self, expected):
+        super().__init__(f"offset mismatch, server has {expected} bytes")
+        self.expected = expected
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSessionStore:
+    def __init__(self, root, max_length, ttl_seconds=24 * 3600):
+        self.root = root
+        self.max_length = int(max_length)
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(root, exist_ok=True)
+
+    # ---------- paths ----------
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def _check_id(self, upload_id):
+        # ids are uuid hex; refuse anything that could escape root
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadNotFound(upload_id)
+
+    # ---------- api ----------
+    def create(self, length, fields):
+        length = int(length)
+        if length <= 0:
+            raise ValueError("length must be positive")
+        if length > self.max_length:
+            raise UploadTooLarge(f"{length} > {self.max_length}")
+        upload_id = uuid.uuid4().hex
+        meta = {"length": length, "fields": fields, "created": time.time()}
+        with open(self._part_path(upload_id), "wb"):
+            pass
+        with open(self._meta_path(upload_id), "w") as fh:
+            json.dump(meta, fh)
+        return upload_id
+
+    def info(self, upload_id):
+        """Return {"length", "offset", "fields"} for an upload."""
+        self._check_id(upload_id)
+        try:
+            with open(self._meta_path(upload_id)) as fh:
+                meta = json.load(fh)
+            offset = os.path.getsize(self._part_path(upload_id))
+        except (OSError, ValueError):
+            raise UploadNotFound(upload_id)
+        meta["offset"] = offset
+        return meta
+
+    def append(self, upload_id, offset, stream, content_length=None):
+        """
+        Append a chunk read from `stream` at `offset`. Returns the new offset.
+        The chunk is rejected unless offset equals the bytes already stored.
+        """
+        meta = self.info(upload_id)
+        part = self._part_path(upload_id)
+        with open(part, "ab") as fh:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                current = os.path.getsize(part)
+                if offset != current:
+                    raise OffsetMismatch(current)
+                remaining = meta["length"] - current
+                if content_length is not None and content_length > remaining:
+                    raise UploadTooLarge(f"chunk of {content_length} exceeds remaining {remaining}")
+                written = 0
+                while True:
+                    buf = stream.read(min(COPY_BUFSIZE, remaining - written + 1))
+                    if not buf:
+                        break
+                    written += len(buf)
+                    if written > remaining:
+                        fh.truncate(current)
+                        raise UploadTooLarge("chunk exceeds declared length")
+                    fh.write(buf)
+                fh.flush()
+                return current + written
+            finally:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def assembled_path(self, upload_id):
+        """Path of the complete file; raises OffsetMismatch if bytes are missing."""
+        meta = self.info(upload_id)
+        if meta["offset"] != meta["length"]:
+            raise OffsetMismatch(meta["offset"])
+        return self._part_path(upload_id)
+
+    def discard(self, upload_id):
+        self._check_id(upload_id)
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def purge_expired(self):
+        """Remove uploads older than ttl_seconds. Returns the number removed."""
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-5]
+            try:
+                # .part mtime moves with every chunk, so active uploads survive
+                if os.path.getmtime(self._part_path(upload_id)) < cutoff:
+                    self.discard(upload_id)
+                    removed += 1
+            except (OSError, UploadNotFound):
+                continue
+        return removed
@@ -0,0 +1,137 @@
+/* =========================
+   断点续传上传（配合 main.py 里的 /uploads 接口）
+   create → PATCH 分片 → finalize；断线后从服务器的 Upload-Offset 继续
+========================= */
+(function (global) {
+  const STORAGE_PREFIX = "xialens-upload:";
+  const MAX_CHUNK_RETRIES = 5;
+  // 503 = 服务器限流（admission），不算失败：按 Retry-After 等，连续忙这么久才放弃
+  const MAX_BUSY_WAIT_MS = 10 * 60 * 1000;
+
+  function fileKey(file, fields) {
+    return STORAGE_PREFIX + [fields.target, fields.album, file.name, file.size, file.lastModified].join("|");
+  }
+
+  function sleep(ms) { return new Promise(r => setTimeout(r, ms)); }
+
+  // Retry-After 可以是秒数或 HTTP 日期；加一点随机抖动，别让几个标签页同时重试
+  function retryAfterMs(res) {
+    const value = res.headers.get("Retry-After");
+    let ms = 1000;
+    if (value && /^\d+$/.test(value.trim())) ms = parseInt(value, 10) * 1000;
+    else if (value && !isNaN(Date.parse(value))) ms = Math.max(0, Date.parse(value) - Date.now());
+    return Math.max(ms, 500) + Math.floor(Math.random() * 500);
+  }
+
+  function busyWaiter() {
+    let waited = 0;
+    return async function (res) {
+      const ms = retryAfterMs(res);
+      waited += ms;
+      if (waited > MAX_BUSY_WAIT_MS) {
+        const err = new Error("server busy, please retry later");
+        err.busy = true;
+        throw err;
+      }
+      await sleep(ms);
+    };
+  }
+
+  async function finalizeUpload(uploadId) {
+    const waitBusy = busyWaiter();
+    while (true) {
+      const res = await fetch(`/uploads/${uploadId}/finalize`, { method: "POST" });
+      if (res.status === 503) { await waitBusy(res); continue; }
+      const data = await res.json();
+      if (!res.ok || data.success === false) throw new Error(data.error || `finalize failed (status ${res.status})`);
+      return data;
+    }
+  }
+
+  async function createUpload(file, fields) {
+    const res = await fetch("/uploads", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(Object.assign({}, fields, {
+        filename: file.name,
+        mimetype: file.type || "application/octet-stream",
+        length: file.size
+      }))
+    });
+    const data = await res.json();
+    if (!res.ok || !data.success) throw new Error(data.error || `create failed (status ${res.status})`);
+    return data;
+  }
+
+  async function currentOffset(uploadId) {
+    const res = await fetch(`/uploads/${uploadId}`, { method: "HEAD", cache: "no-store" });
+    if (res.status === 404) return null;
+    if (!res.ok) throw new Error(`offset query failed (status ${res.status})`);
+    return parseInt(res.headers.get("Upload-Offset") || "0", 10);
+  }
+
+  /**
+   * Upload one File resumably.
+   * fields: { target: "public"|"private", album, new_album?, drive_folder_id?, is_private? }
+   * onProgress(sentBytes, totalBytes)
+   * Resolves with the finalize JSON ({success, url, album}).
+   */
+  async function resumableUpload(file, fields, onProgress) {
+    const key = fileKey(file, fields);
+    let uploadId = localStorage.getItem(key);
+    let offset = null;
+    let chunkSize = 1024 * 1024;
+
+    if (uploadId) {
+      try { offset = await currentOffset(uploadId); } catch (e) { offset = null; }
+    }
+    if (offset === null) {
+      const created = await createUpload(file, fields);
+      uploadId = created.upload_id;
+      chunkSize = created.chunk_size || chunkSize;
+      offset = 0;
+      localStorage.setItem(key, uploadId);
+    }
+
+    let failures = 0;
+    let waitBusy = busyWaiter();
+    while (offset < file.size) {
+      const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+      try {
+        const res = await fetch(`/uploads/${uploadId}`, {
+          method: "PATCH",
+          headers: { "Upload-Offset": String(offset), "Content-Type": "application/offset+octet-stream" },
+          body: chunk
+        });
+        if (res.status === 204 || res.status === 409) {
+          // 409：服务器已有的字节数和我们不一致，按服务器为准继续
+          offset = parseInt(res.headers.get("Upload-Offset") || String(offset), 10);
+          failures = 0;
+          waitBusy = busyWaiter();
+        } else if (res.status === 503) {
+          await waitBusy(res);  // 这一块没被接收，offset 不变，原样重发
+          continue;
+        } else if (res.status === 404) {
+          localStorage.removeItem(key);
+          return resumableUpload(file, fields, onProgress);
+        } else {
+          throw new Error(`chunk failed (status ${res.status})`);
+        }
+      } catch (err) {
+        if (err.busy) throw err;
+        failures += 1;
+        if (failures > MAX_CHUNK_RETRIES) throw err;
+        await sleep(500 * failures);
+        const serverOffset = await currentOffset(uploadId).catch(() => offset);
+        if (serverOffset !== null) offset = serverOffset;
+      }
+      if (onProgress) onProgress(offset, file.size);
+    }
+
+    const data = await finalizeUpload(uploadId);
+    localStorage.removeItem(key);
+    return data;
+  }
+
+  global.resumableUpload = resumableUpload;
+})(window);
@@ -0,0 +1,330 @@
+# storage.py —— 照片文件存储接口：本地目录 / Supabase Storage / 内存，外加本地磁盘读缓存
+"""
+Object storage behind one small interface.
+
+Keys are bucket-relative paths ("<album>/<file>", "private/<album>/<file>"),
+the same keys `storage_sync.storage_key` derives from stored photo urls.
+Every backend implements:
+
+    put(key, data, content_type=None) -> public url
+    get(key) -> bytes                      (KeyError if missing)
+    delete(keys, on_progress=None) -> number removed
+    move(src, dst) / copy(src, dst)        (server-side, no bytes through the app)
+    list(prefix) -> [key, ...]             (files directly under prefix/)
+    exists(key) -> bool                    (asks the backend itself, never a cache)
+    remove_prefix(prefix)                  (drop the folder itself, if the backend has one)
+    url(key) -> public url
+    key_for_url(url) -> key or None
+
+`CachedStorage` wraps a (remote) backend with a size-bounded read-through
+disk cache, so hot originals are read from local disk after the first fetch.
+"""
+import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from image_proxy import DiskLRUCache, SingleFlight, fill
+from storage_sync import storage_key
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class LocalStorage:
+    """Files under `root` (static/uploads), served by Flask's /static route."""
+    name = "local"
+
+    def __init__(self, root, url_for_key):
+        self.root = os.path.realpath(root)
+        self._url_for_key = url_for_key  # key -> public url（需要 request / app context 时由调用方处理）
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.realpath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise KeyError(key)
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return self.url(key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def delete(self, keys, on_progress=None):
+        removed = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+                removed += 1
+            except (OSError, KeyError):
+                pass
+            if on_progress:
+                on_progress(removed)
+        return removed
+
+    def move(self, src, dst):
+        dst_path = self._path(dst)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            os.replace(self._path(src), dst_path)
+        except FileNotFoundError:
+            raise KeyError(src)
+
+    def copy(self, src, dst):
+        dst_path = self._path(dst)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            shutil.copyfile(self._path(src), dst_path)
+        except FileNotFoundError:
+            raise KeyError(src)
+
+    def list(self, prefix):
+        try:
+            directory = self._path(prefix)
+            names = sorted(os.listdir(directory))
+        except (OSError, KeyError):
+            return []
+        return [f"{prefix}/{n}" for n in names if os.path.isfile(os.path.join(directory, n))]
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self._path(key))
+        except KeyError:
+            return False
+
+    def remove_prefix(self, prefix):
+        """Delete the folder itself (files + empty subfolders) after its objects."""
+        try:
+            shutil.rmtree(self._path(prefix), ignore_errors=True)
+        except KeyError:
+            pass
+
+    def url(self, key):
+        return self._url_for_key(key)
+
+    def key_for_url(self, url):
+        found = storage_key(url, "")
+        return found[1] if found and found[0] == self.name else None
+
+
+class SupabaseStorage:
+    """One Supabase Storage bucket (service-role client)."""
+    name = "supabase"
+
+    def __init__(self, client, bucket, base_url, list_page=1000, remove_batch=500, remove_workers=4):
+        self.client = client
+        self.bucket_name = bucket
+        self.base_url = base_url.rstrip("/")
+        self.list_page = list_page
+        self.remove_batch = remove_batch
+        self.remove_workers = remove_workers
+
+    @property
+    def bucket(self):
+        return self.client.storage.from_(self.bucket_name)
+
+    def put(self, key, data, content_type=None):
+        self.bucket.upload(key, data, file_options={
+            "content-type": content_type or "application/octet-stream",
+            "upsert": "true",
+        })
+        return self.url(key)
+
+    def get(self, key):
+        data = self.bucket.download(key)
+        if data is None:
+            raise KeyError(key)
+        return data
+
+    def delete(self, keys, on_progress=None):
+        """Batches of `remove_batch`, `remove_workers` requests in flight."""
+        bucket = self.bucket
+
+        def _remove(batch):
+            bucket.remove(batch)
+            return len(batch)
+
+        removed = 0
+        with ThreadPoolExecutor(max_workers=self.remove_workers) as pool:
+            for n in pool.map(_remove, _chunks(list(keys), self.remove_batch)):
+                removed += n
+                if on_progress:
+                    on_progress(removed)
+        return removed
+
+    def move(self, src, dst):
+        self.bucket.move(src, dst)
+
+    def copy(self, src, dst):
+        self.bucket.copy(src, dst)
+
+    def list(self, prefix):
+        """list() returns one page per call; folders (no id) are skipped."""
+        bucket = self.bucket
+        keys, offset = [], 0
+        while True:
+            page = bucket.list(prefix, {
+                "limit": self.list_page,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            }) or []
+            keys.extend(f"{prefix}/{f['name']}" for f in page if f.get("name") and f.get("id") is not None)
+            if len(page) < self.list_page:
+                return keys
+            offset += self.list_page
+
+    def exists(self, key):
+        """list() of the key's folder filtered by `search` (a name prefix match), then an exact match."""
+        prefix, _, name = key.rpartition("/")
+        bucket = self.bucket
+        offset = 0
+        while True:
+            page = bucket.list(prefix, {
+                "limit": self.list_page,
+                "offset": offset,
+                "search": name,
+                "sortBy": {"column": "name", "order": "asc"},
+            }) or []
+            if any(f.get("name") == name and f.get("id") is not None for f in page):
+                return True
+            if len(page) < self.list_page:
+                return False
+            offset += self.list_page
+
+    def remove_prefix(self, prefix):
+        pass  # Supabase 没有真正的文件夹，对象删完就没了
+
+    def url(self, key):
+        return f"{self.base_url}/storage/v1/object/public/{self.bucket_name}/{quote(key, safe='')}"
+
+    def key_for_url(self, url):
+        found = storage_key(url, self.bucket_name)
+        return found[1] if found and found[0] == self.name else None
+
+
+class MemoryStorage:
+    """Process-local dict; for tests and throwaway dev instances."""
+    name = "memory"
+
+    def __init__(self, base_url="memory://"):
+        self.base_url = base_url
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, data, content_type=None):
+        with self._lock:
+            self.objects[key] = bytes(data)
+        return self.url(key)
+
+    def get(self, key):
+        with self._lock:
+            return self.objects[key]
+
+    def delete(self, keys, on_progress=None):
+        removed = 0
+        with self._lock:
+            for key in keys:
+                if self.objects.pop(key, None) is not None:
+                    removed += 1
+                if on_progress:
+                    on_progress(removed)
+        return removed
+
+    def move(self, src, dst):
+        with self._lock:
+            self.objects[dst] = self.objects.pop(src)
+
+    def copy(self, src, dst):
+        with self._lock:
+            self.objects[dst] = self.objects[src]
+
+    def list(self, prefix):
+        with self._lock:
+            return sorted(k for k in self.objects if k.rsplit("/", 1)[0] == prefix)
+
+    def exists(self, key):
+        with self._lock:
+            return key in self.objects
+
+    def remove_prefix(self, prefix):
+        pass
+
+    def url(self, key):
+        return f"{self.base_url}{key}"
+
+    def key_for_url(self, url):
+        return url[len(self.base_url):] if (url or "").startswith(self.base_url) else None
+
+
+class CachedStorage:
+    """
+    Read-through disk cache in front of a backend. Writes go to the backend
+    and warm the cache (a fresh upload is usually viewed right away);
+    deletes drop the cached copy. Concurrent misses for one key are
+    collapsed into a single backend read.
+    """
+
+    def __init__(self, backend, cache_dir, max_bytes):
+        self.backend = backend
+        self.name = backend.name
+        self.cache = DiskLRUCache(cache_dir, max_bytes)
+        self.flight = SingleFlight(os.path.join(cache_dir, ".locks"))
+
+    def _cache_key(self, key):
+        return "obj-" + hashlib.sha256(f"{self.name}:{key}".encode("utf-8")).hexdigest()
+
+    def put(self, key, data, content_type=None):
+        url = self.backend.put(key, data, content_type)
+        self.cache.put(self._cache_key(key), data)
+        return url
+
+    def get(self, key):
+        return fill(self.cache, self.flight, self._cache_key(key), lambda: self.backend.get(key))
+
+    def delete(self, keys, on_progress=None):
+        keys = list(keys)
+        removed = self.backend.delete(keys, on_progress)
+        for key in keys:
+            self.cache.delete(self._cache_key(key))
+        return removed
+
+    def move(self, src, dst):
+        self.backend.move(src, dst)
+        self.cache.delete(self._cache_key(src))
+
+    def copy(self, src, dst):
+        self.backend.copy(src, dst)
+
+    def list(self, prefix):
+        return self.backend.list(prefix)
+
+    def exists(self, key):
+        return self.backend.exists(key)
+
+    def remove_prefix(self, prefix):
+        self.backend.remove_prefix(prefix)
+
+    def url(self, key):
+        return self.backend.url(key)
+
+    def key_for_url(self, url):
+        return self.backend.key_for_url(url)
+
+    def stats(self):
+        return dict(self.cache.stats(), backend=self.name)
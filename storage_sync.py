@@ -0,0 +1,188 @@
+# storage_sync.py —— Storage（Supabase bucket / static/uploads）→ photo 表的增量对账
+"""
+Listing side of the storage ↔ DB reconciler (the DB side lives in main.py).
+
+Both walkers are generators of (prefix, files) so the caller can write rows
+and advance the checkpoint one prefix at a time:
+
+- walk_supabase: paginated `bucket.list()` per folder, folders walked
+  concurrently. Pages are sorted by name (unique, so offset paging is
+  stable and no folder entry is missed); an incremental run lists the whole
+  folder but only hands on objects newer than its watermark.
+- walk_local: os.scandir per directory, directories walked concurrently. A
+  directory whose mtime is not newer than its watermark has had no entries
+  added, so its files are not stat'ed at all.
+
+SyncCheckpoint keeps the newest timestamp seen per (source, prefix) in a JSON
+file, so an interrupted run resumes cheaply and re-runs only look at new
+objects.
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse, unquote
+
+SUPABASE_PAGE_SIZE = 1000
+
+
+def _join(prefix, name):
+    return f"{prefix}/{name}" if prefix else name
+
+
+# --------------------------
+# Checkpoint
+# --------------------------
+class SyncCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {}
+        try:
+            with open(path) as fh:
+                self.data = json.load(fh)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, source, prefix):
+        return self.data.get(source, {}).get(prefix)
+
+    def advance(self, source, prefix, value):
+        if value is None:
+            return
+        with self._lock:
+            marks = self.data.setdefault(source, {})
+            if marks.get(prefix) is None or value > marks[prefix]:
+                marks[prefix] = value
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as fh:
+                json.dump(self.data, fh, separators=(",", ":"), sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def reset(self):
+        with self._lock:
+            self.data = {}
+
+
+# --------------------------
+# URL → storage key
+# --------------------------
+def storage_key(url, bucket):
+    """
+    ("supabase", "<album>/<file>") or ("local", "<album>/<file>") for a photo
+    url, None for anything else (Cloudinary, Drive, ...). Works for absolute
+    and relative urls and for both encodings of the Supabase path.
+    """
+    path = unquote(urlparse(url or "").path)
+    marker = f"/storage/v1/object/public/{bucket}/"
+    if marker in path:
+        return "supabase", path.split(marker, 1)[1]
+    if "/static/uploads/" in path:
+        return "local", path.split("/static/uploads/", 1)[1]
+    return None
+
+
+# --------------------------
+# Supabase bucket walk
+# --------------------------
+def list_supabase_prefix(bucket, prefix, since=None, page_size=SUPABASE_PAGE_SIZE):
+    """
+    One folder of the bucket → (files newer than `since`, subfolders).
+    Folder entries have no id/updated_at. The listing is sorted by name:
+    under updated_at order neither the position of folders nor the order of
+    equal timestamps across offset pages is defined.
+    """
+    files, folders = [], []
+    offset = 0
+    while True:
+        page = bucket.list(prefix, {
+            "limit": page_size,
+            "offset": offset,
+            "sortBy": {"column": "name", "order": "asc"},
+        }) or []
+        for entry in page:
+            name = entry.get("name")
+            if not name or name == ".emptyFolderPlaceholder":
+                continue
+            if entry.get("id") is None:
+                folders.append(_join(prefix, name))
+                continue
+            updated = entry.get("updated_at") or entry.get("created_at") or ""
+            if since and updated and updated <= since:
+                continue
+            files.append({
+                "key": _join(prefix, name),
+                "updated": updated,
+                "size": (entry.get("metadata") or {}).get("size"),
+            })
+        if len(page) < page_size:
+            return files, folders
+        offset += page_size
+
+
+def walk_supabase(bucket, checkpoint=None, workers=8, page_size=SUPABASE_PAGE_SIZE):
+    """Yield (prefix, files) for every folder in the bucket, folders listed concurrently."""
+    def since(prefix):
+        return checkpoint.get("supabase", prefix) if checkpoint else None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-supabase") as pool:
+        pending = {pool.submit(list_supabase_prefix, bucket, "", since(""), page_size): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                prefix = pending.pop(future)
+                files, folders = future.result()
+                for sub in folders:
+                    pending[pool.submit(list_supabase_prefix, bucket, sub, since(sub), page_size)] = sub
+                yield prefix, files
+
+
+# --------------------------
+# Local static/uploads walk
+# --------------------------
+def list_local_prefix(root, prefix, since=None):
+    directory = os.path.join(root, prefix) if prefix else root
+    files, folders = [], []
+    try:
+        unchanged = since is not None and os.stat(directory).st_mtime <= since
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(_join(prefix, entry.name))
+                    continue
+                if unchanged or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat()
+                if since is not None and st.st_mtime <= since:
+                    continue
+                files.append({"key": _join(prefix, entry.name), "updated": st.st_mtime, "size": st.st_size})
+    except FileNotFoundError:
+        pass
+    return files, folders
+
+
+def walk_local(root, checkpoint=None, workers=8):
+    """Yield (prefix, files) for every directory under root, directories scanned concurrently."""
+    def since(prefix):
+        return checkpoint.get("local", prefix) if checkpoint else None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-local") as pool:
+        pending = {pool.submit(list_local_prefix, root, "", since("")): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                prefix = pending.pop(future)
+                files, folders = future.result()
+                for sub in folders:
+                    pending[pool.submit(list_local_prefix, root, sub, since(sub))] = sub
+                yield prefix, files
+
+
+def newest(files):
+    return max((f["updated"] for f in files if f.get("updated")), default=None)
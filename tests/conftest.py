@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main.py 在 import 时就读配置、建引擎：先把环境变量指到临时目录 + SQLite 回退
+_TMP = tempfile.mkdtemp(prefix="xialens-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'app.db')}"
+for _name in ("IMG_CACHE_DIR", "STORAGE_CACHE_DIR", "SPRITE_DIR", "METRICS_DIR", "PROFILE_DIR", "LOCAL_UPLOAD_DIR"):
+    os.environ[_name] = os.path.join(_TMP, _name.lower())
+for _name in ("SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY", "QUERY_RECORDER"):
+    os.environ.pop(_name, None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    main.app.testing = True  # after_request / close 里抛的 QueryBudgetExceeded 直接冒到测试里
+    with main.app.app_context():
+        main.db.create_all()
+        for i in range(8):
+            story = main.Story(text=f"story {i}")
+            main.db.session.add(story)
+            main.db.session.flush()
+            for j in range(2):
+                main.db.session.add(main.StoryImage(image_url=f"/static/uploads/story-{i}-{j}.jpg", story_id=story.id))
+        for album in ("alpha", "beta", "gamma"):
+            main.db.session.add(main.Album(name=album))
+            for j in range(6):
+                main.db.session.add(main.Photo(album=album, url=f"/static/uploads/{album}/{j}.jpg"))
+            main.db.session.add(main.Photo(album=album, url=f"/static/uploads/{album}/p.jpg", is_private=True))
+        main.db.session.commit()
+    return main.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(client):
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+    return client
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("name", ["My Trip", "My_Trip"])
+def test_delete_spaced_album_removes_files_and_rows(admin, name):
+    folder = os.path.join(main.LOCAL_UPLOAD_DIR, "My_Trip")
+    os.makedirs(folder, exist_ok=True)
+    with main.app.app_context():
+        for i in range(3):
+            with open(os.path.join(folder, f"{i}.jpg"), "wb") as fh:
+                fh.write(b"x")
+            # store_album_photo：文件夹用 safe 名，本地行存原名
+            main.db.session.add(main.Photo(album="My Trip", url=f"/static/uploads/My_Trip/{i}.jpg"))
+        main.db.session.commit()
+
+    resp = admin.post(f"/delete_album/{name}")
+    assert resp.status_code == 302
+
+    assert not os.path.exists(folder)
+    with main.app.app_context():
+        assert main.Photo.query.filter_by(album="My Trip").count() == 0
+        assert main.Photo.query.filter_by(album="alpha").count() > 0
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+
+import main
+from api_pagination import (InvalidQuery, decode_cursor, dumps_compact, encode_cursor, paginate,
+                            parse_fields, parse_limit)
+
+
+def test_cursor_round_trip():
+    for value in (0, 12345, "Café 2024", [17, 4]):
+        token = encode_cursor(value)
+        assert "=" not in token and "/" not in token and "+" not in token
+        assert decode_cursor(token) == value
+    assert decode_cursor(None) is None and decode_cursor("") is None
+    assert decode_cursor(encode_cursor(5), int) == 5
+
+
+@pytest.mark.parametrize("token,kind", [("!!!", None), ("bm90IGpzb24", None), (encode_cursor("5"), int)])
+def test_bad_cursors(token, kind):
+    with pytest.raises(InvalidQuery):
+        decode_cursor(token, kind)
+
+
+def test_limit_and_fields():
+    assert parse_limit(None) == 50 and parse_limit("0") == 1 and parse_limit("9999") == 200
+    with pytest.raises(InvalidQuery):
+        parse_limit("ten")
+    allowed = ("id", "album", "url")
+    assert parse_fields("", allowed, "id") == ["id", "album", "url"]
+    assert parse_fields("url,album,url,", allowed, "id") == ["id", "url", "album"]
+    with pytest.raises(InvalidQuery):
+        parse_fields("password", allowed, "id")
+
+
+def test_paginate_and_compact_json():
+    rows = [{"id": i} for i in (9, 8, 7)]
+    assert paginate(rows, 2, "id") == (rows[:2], encode_cursor(8))
+    assert paginate(rows, 3, "id") == (rows, None)
+    assert dumps_compact({"at": datetime(2026, 1, 2, 3, 4), "name": "夏"}) == '{"at":"2026-01-02T03:04:00","name":"夏"}'
+
+
+def _walk(client, url):
+    items, cursor = [], None
+    for _ in range(50):
+        resp = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert resp.status_code == 200
+        body = resp.get_json()
+        items.extend(body["items"])
+        cursor = body["next"]
+        if cursor is None:
+            return items
+    raise AssertionError("pagination did not end")
+
+
+def test_api_walks_every_row_once(app, client):
+    with app.app_context():
+        public = sorted((i for (i,) in main.db.session.query(main.Photo.id)
+                         .filter_by(album="alpha", is_private=False)), reverse=True)
+        albums = sorted(n for (n,) in main.db.session.query(main.Album.name))
+    photos = _walk(client, "/api/albums/alpha/photos?limit=4&fields=url")
+    assert [p["id"] for p in photos] == public
+    assert set(photos[0]) == {"id", "url"}
+    assert [a["name"] for a in _walk(client, "/api/albums?limit=1&fields=name")] == albums
+
+    assert client.get(f"/api/albums/alpha/photos?cursor={encode_cursor('x')}").status_code == 400
+    assert client.get("/api/albums/alpha/photos?fields=password").status_code == 400
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import main
+from api_pagination import decode_cursor, encode_cursor
+from change_feed import PRUNED, collapse, cursor_expired, feed_cursor, valid_cursor
+
+
+def _row(id, entity_id, op="upsert", entity="photo", txid=0):
+    return {"id": id, "entity": entity, "entity_id": entity_id, "op": op, "txid": txid}
+
+
+def test_collapse_keeps_latest_change_in_feed_order():
+    rows = [_row(1, 7), _row(2, 8), _row(3, 7, "delete"), _row(4, 7, entity="story")]
+    assert [(r["entity"], r["entity_id"], r["op"]) for r in collapse(rows)] == [
+        ("photo", 8, "upsert"), ("photo", 7, "delete"), ("story", 7, "upsert")]
+
+
+def test_collapse_orders_by_txid_before_id():
+    # Postgres：事务号小的先提交，即使它的 id 更大
+    rows = [_row(5, 1, txid=10), _row(9, 2, txid=9)]
+    assert [r["id"] for r in collapse(rows)] == [9, 5]
+
+
+def test_feed_cursor_and_validation():
+    assert feed_cursor({"id": 4}) == [0, 4]
+    assert feed_cursor({"id": 4, "txid": None}) == [0, 4]
+    assert feed_cursor({"id": 4, "txid": 12}) == [12, 4]
+    assert valid_cursor([0, 4])
+    for bad in (4, [4], [0, -1], [0, "4"], [True, 4], None):
+        assert not valid_cursor(bad)
+
+
+def test_cursor_expired_compares_txid_then_id():
+    assert not cursor_expired(None, [0, 0])
+    assert not cursor_expired([10, 50], [10, 50])
+    assert not cursor_expired([10, 50], [11, 1])   # 更晚的事务，id 小也不过期
+    assert cursor_expired([10, 50], [10, 49])
+    assert cursor_expired([10, 50], [9, 900])      # 更早的事务，id 大也过期
+
+
+def test_prune_keeps_marker_and_expires_older_cursors(app, client):
+    with app.app_context():
+        ChangeLog = main.ChangeLog
+        for j in range(4):
+            main.db.session.add(main.Photo(album="feed", url=f"/static/uploads/feed/{j}.jpg"))
+        main.db.session.commit()
+        ids = [i for (i,) in main.db.session.query(ChangeLog.id).order_by(ChangeLog.id)]
+        keep_from = ids[-2]
+        ChangeLog.query.filter(ChangeLog.id < keep_from).update(
+            {"created_at": datetime(2020, 1, 1)}, synchronize_session=False)
+        main.db.session.commit()
+        marker = ids[-3]
+
+        removed = main.prune_change_log(datetime(2021, 1, 1))
+        assert removed == len(ids) - 3
+        assert [i for (i,) in main.db.session.query(ChangeLog.id).order_by(ChangeLog.id)] == ids[-3:]
+        assert main.db.session.get(ChangeLog, marker).op == PRUNED
+        assert main.change_log_bounds() == ([0, marker], [0, ids[-1]])
+
+        # 再跑一次什么都不删
+        assert main.prune_change_log(datetime(2021, 1, 1)) == 0
+
+    try:
+        assert client.get(f"/api/changes?since={encode_cursor([0, marker - 1])}").status_code == 410
+        resp = client.get(f"/api/changes?since={encode_cursor([0, marker])}")
+        assert resp.status_code == 200
+        body = resp.get_json()
+        assert [c["seq"] for c in body["changes"]] == ids[-2:]
+        assert decode_cursor(body["next"]) == [0, ids[-1]]
+        # 旧版本的纯 id 游标不再特殊处理
+        assert client.get(f"/api/changes?since={encode_cursor(marker)}").status_code == 400
+    finally:
+        with app.app_context():
+            # 其它测试用 [0, 0] 游标：去掉清理标记
+            ChangeLog.query.filter(ChangeLog.id == marker).update({"op": "upsert"}, synchronize_session=False)
+            main.Photo.query.filter_by(album="feed").delete(synchronize_session=False)
+            main.db.session.commit()
@@ -0,0 +1,112 @@
+import gzip
+import os
+import zlib
+
+from compression import CompressionMiddleware, negotiate, precompress
+
+
+def test_negotiate():
+    both = ("br", "gzip")
+    assert negotiate("gzip, deflate, br", both) == "br"
+    assert negotiate("br;q=0.5, gzip", both) == "gzip"
+    assert negotiate("gzip;q=0, br;q=0", both) is None
+    assert negotiate("*", both) == "br"
+    assert negotiate("*;q=0.1, gzip;q=0", both) == "br"
+    assert negotiate("br", ("gzip",)) is None
+    assert negotiate("GZIP;q=bogus, gzip", ("gzip",)) == "gzip"
+    assert negotiate("", both) is None and negotiate(None, both) is None
+
+
+class App:
+    """WSGI app that returns `chunks` (optionally lazily, like a generator) and records close()."""
+
+    def __init__(self, chunks, content_type="text/html; charset=utf-8", length=True, lazy=False, extra=()):
+        self.chunks, self.content_type, self.length, self.lazy, self.extra = chunks, content_type, length, lazy, extra
+        self.closed = False
+        self.produced = 0
+
+    def __call__(self, environ, start_response):
+        headers = [("Content-Type", self.content_type), *self.extra]
+        if self.length:
+            headers.append(("Content-Length", str(sum(map(len, self.chunks)))))
+        app = self
+
+        class Body:
+            def __iter__(self):
+                if app.lazy:
+                    start_response("200 OK", headers)
+                for chunk in app.chunks:
+                    app.produced += 1
+                    yield chunk
+
+            def close(self):
+                app.closed = True
+
+        if not self.lazy:
+            start_response("200 OK", headers)
+        return Body()
+
+
+def _call(app, accept="gzip", method="GET"):
+    seen = {}
+
+    def start_response(status, headers, exc_info=None):
+        seen["status"], seen["headers"] = status, dict(headers)
+
+    body = CompressionMiddleware(app, min_size=100)(
+        {"HTTP_ACCEPT_ENCODING": accept, "REQUEST_METHOD": method}, start_response)
+    return seen, body
+
+
+def test_buffered_response_compressed():
+    html = b"<p>hello</p>" * 50
+    app = App([html], extra=[("ETag", '"abc"'), ("Vary", "Cookie")])
+    seen, body = _call(app)
+    data = b"".join(body)
+    assert gzip.decompress(data) == html
+    headers = seen["headers"]
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Content-Length"] == str(len(data))
+    assert headers["Vary"] == "Cookie, Accept-Encoding"
+    assert headers["ETag"] == 'W/"abc"'
+    assert app.closed
+
+
+def test_small_or_binary_or_head_untouched():
+    for app, method in ((App([b"tiny"]), "GET"), (App([b"x" * 500], content_type="image/jpeg"), "GET"),
+                        (App([b"x" * 500]), "HEAD")):
+        seen, body = _call(app, method=method)
+        assert "Content-Encoding" not in seen["headers"]
+        assert b"".join(body) == app.chunks[0]
+    seen, body = _call(App([b"x" * 500]), accept="identity")
+    assert "Content-Encoding" not in seen["headers"]
+
+    # 流式响应整个都不到 min_size：原样发
+    seen, body = _call(App([b"a" * 10, b"b" * 10], length=False))
+    assert b"".join(body) == b"a" * 10 + b"b" * 10 and "Content-Encoding" not in seen["headers"]
+
+
+def test_streamed_chunks_flushed_one_by_one():
+    chunks = [b"<html>" + b"x" * 200] + [f"<li>{i}</li>".encode() * 3 for i in range(5)]
+    app = App(chunks, length=False, lazy=True)
+    seen, body = _call(app)
+    body = iter(body)
+    inflate = zlib.decompressobj(31)
+    out = inflate.decompress(next(body))
+    assert out == chunks[0] and app.produced == 1  # 第一块发出去时后面的还没生成
+    for i, chunk in enumerate(chunks[1:], 2):
+        assert inflate.decompress(next(body)) == chunk and app.produced == i
+    rest = b"".join(body)
+    assert inflate.decompress(rest) + inflate.flush() == b"" and inflate.eof
+    assert seen["headers"]["Content-Encoding"] == "gzip" and "Content-Length" not in seen["headers"]
+    assert app.closed
+
+
+def test_precompress_writes_once(tmp_path):
+    path = tmp_path / "app.css"
+    path.write_bytes(b"body { color: red }\n" * 20)
+    assert precompress(str(path), encodings=("gzip",)) == [str(path) + ".gz"]
+    assert gzip.decompress((tmp_path / "app.css.gz").read_bytes()) == path.read_bytes()
+    assert precompress(str(path), encodings=("gzip",)) == []
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert precompress(str(path), encodings=("gzip",)) == [str(path) + ".gz"]
@@ -0,0 +1,68 @@
+import io
+import os
+
+from PIL import Image
+
+import main
+
+
+def _jpeg():
+    out = io.BytesIO()
+    Image.new("RGB", (40, 30), (200, 10, 10)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def _sign(admin, **fields):
+    resp = admin.post("/sign_upload", json=dict({"kind": "photo", "filename": "a.jpg", "album": "direct"}, **fields))
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def _count(url):
+    with main.app.app_context():
+        return main.Photo.query.filter_by(url=url).count()
+
+
+def test_completion_is_idempotent(admin):
+    signed = _sign(admin)
+    assert admin.put(signed["upload_url"], data=_jpeg()).status_code == 200
+    first = admin.post("/upload_complete", json={"completion_token": signed["completion_token"]})
+    again = admin.post("/upload_complete", json={"completion_token": signed["completion_token"]})
+    assert first.status_code == again.status_code == 200
+    url = first.get_json()["url"]
+    assert _count(url) == 1
+    with main.app.app_context():
+        photo = main.Photo.query.filter_by(url=url).one()
+        assert (photo.width, photo.height, photo.mime_type) == (40, 30, "image/jpeg")
+
+
+def test_completion_before_upload_is_rejected(admin):
+    signed = _sign(admin)
+    resp = admin.post("/upload_complete", json={"completion_token": signed["completion_token"]})
+    assert resp.status_code == 409
+
+
+def test_private_photos_go_under_private_prefix(admin):
+    signed = _sign(admin, is_private="true")
+    assert admin.put(signed["upload_url"], data=_jpeg()).status_code == 200
+    url = admin.post("/upload_complete", json={"completion_token": signed["completion_token"]}).get_json()["url"]
+    assert "/static/uploads/private/direct/" in url
+    assert os.listdir(os.path.join(main.LOCAL_UPLOAD_DIR, "private", "direct"))
+
+
+def test_story_url_built_from_signed_fields(admin, monkeypatch):
+    monkeypatch.setattr(main.cloudinary.utils, "verify_api_response_signature", lambda *a: True)
+    cfg = main.cloudinary.config()
+    for name, value in (("cloud_name", "demo"), ("api_key", "k"), ("api_secret", "s")):
+        monkeypatch.setattr(cfg, name, value, raising=False)
+    resp = admin.post("/sign_upload", json={"kind": "story", "filename": "a.jpg", "story_id": 1})
+    signed = resp.get_json()
+    public_id = "story/" + signed["fields"]["public_id"]
+    body = {"completion_token": signed["completion_token"], "public_id": public_id, "version": "123",
+            "signature": "x", "secure_url": "https://evil.example/x.jpg"}
+    first = admin.post("/upload_complete", json=body).get_json()
+    admin.post("/upload_complete", json=body)
+    assert "evil.example" not in first["url"]
+    assert f"/v123/{public_id}" in first["url"]
+    with main.app.app_context():
+        assert main.StoryImage.query.filter_by(image_url=first["url"]).count() == 1
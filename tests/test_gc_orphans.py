@@ -0,0 +1,44 @@
+import os
+from datetime import datetime, timedelta
+
+import main
+from gc_orphans import older_than
+
+
+def _photo(url, age_hours):
+    photo = main.Photo(album="gc", url=url, created_at=datetime.utcnow() - timedelta(hours=age_hours))
+    main.db.session.add(photo)
+    main.db.session.commit()
+    return photo.id
+
+
+def _exists(photo_id):
+    return main.db.session.get(main.Photo, photo_id) is not None
+
+
+def test_older_than_treats_naive_as_utc():
+    now = datetime.now().timestamp()
+    assert older_than(datetime.utcnow() - timedelta(hours=2), now - 3600)
+    assert not older_than(datetime.utcnow(), now - 3600)
+    assert older_than("2000-01-01T00:00:00", now)
+    assert not older_than(None, now)
+
+
+def test_dangling_rows_confirmed_before_delete(app, monkeypatch):
+    os.makedirs(os.path.join(main.LOCAL_UPLOAD_DIR, "gc"), exist_ok=True)
+    with open(os.path.join(main.LOCAL_UPLOAD_DIR, "gc", "live.jpg"), "wb") as fh:
+        fh.write(b"x")
+    with app.app_context():
+        gone = _photo("/static/uploads/gc/gone.jpg", 48)
+        young = _photo("/static/uploads/gc/young.jpg", 1)
+        live = _photo("/static/uploads/gc/live.jpg", 48)
+        # 列表扫描漏掉了 live.jpg（并发上传让 offset 分页错位）：删之前的直接检查要把它救回来
+        monkeypatch.setattr(main, "walk_local", lambda *a, **kw: iter([("", [])]))
+        report = main.gc_orphans(dry_run=False, min_age_hours=24)
+        assert not _exists(gone)
+        assert _exists(young)
+        assert _exists(live)
+        assert report["deleted"]["photo_rows"] == 1
+        assert report["photo_rows_not_confirmed"] == 1
+        main.Photo.query.filter_by(album="gc").delete()
+        main.db.session.commit()
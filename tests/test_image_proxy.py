@@ -0,0 +1,76 @@
+import hashlib
+import os
+import threading
+import time
+
+import main
+from image_proxy import DiskLRUCache, SingleFlight
+
+
+def _disk_bytes(root):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != ".locks"]
+        total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in filenames)
+    return total
+
+
+def test_bound_holds_across_workers(tmp_path):
+    # 两个实例 = 两个 worker，各自的内存索引只看得到自己写的文件
+    workers = [DiskLRUCache(str(tmp_path), 10_000) for _ in range(2)]
+    for i in range(40):
+        workers[i % 2].put(f"{i:064x}", b"x" * 1000)
+    assert _disk_bytes(str(tmp_path)) <= 10_000
+    assert workers[0].get(f"{39:064x}") is not None  # 最新的留着
+
+
+def test_unrelated_keys_on_one_stripe_do_not_wait(tmp_path):
+    flight = SingleFlight(str(tmp_path), stripes=1)
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return "a"
+
+    t = threading.Thread(target=flight.do, args=("a", slow))
+    t.start()
+    started.wait()
+    begin = time.monotonic()
+    assert flight.do("b", lambda: "b") == "b"
+    assert time.monotonic() - begin < 0.3
+    t.join()
+    assert [n for n in os.listdir(tmp_path) if n.endswith(".inflight")] == []
+
+
+def test_same_key_waits_for_other_worker(tmp_path):
+    # 两个实例 = 两个 worker：进程内的合并不管用，只能靠 marker
+    first, second = SingleFlight(str(tmp_path)), SingleFlight(str(tmp_path))
+    done, order = threading.Event(), []
+
+    def leader():
+        time.sleep(0.3)
+        order.append("leader")
+        done.set()
+
+    t = threading.Thread(target=first.do, args=("k", leader))
+    t.start()
+    time.sleep(0.05)
+    second.do("k", lambda: order.append("follower"))
+    t.join()
+    assert order == ["leader", "follower"]
+
+
+def test_marker_of_dead_worker_is_taken_over(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    marker = os.path.join(str(tmp_path), hashlib.sha1(b"k").hexdigest() + ".inflight")
+    with open(marker, "w") as fh:
+        fh.write("999999999")
+    begin = time.monotonic()
+    assert flight.do("k", lambda: 1) == 1
+    assert time.monotonic() - begin < 0.3
+
+
+def test_only_remote_sources_are_cached():
+    assert not main._cache_proxy_source("http://localhost/static/uploads/alpha/0.jpg")
+    assert main._cache_proxy_source("https://res.cloudinary.com/demo/image/upload/v1/story/a.jpg")
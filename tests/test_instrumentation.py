@@ -0,0 +1,23 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import instrumentation
+
+
+def test_failed_statement_pops_its_start_time():
+    engine = create_engine("sqlite://")
+    instrumentation.instrument_engine(engine)
+    seen = []
+    instrumentation.add_listener(lambda category, seconds, error: seen.append((category, error)))
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    conn.execute(text("select * from missing_table"))
+            conn.execute(text("select 2"))
+            assert conn.info.get("_xl_query_start") == []
+    finally:
+        instrumentation._listeners.pop()
+    assert seen == [("db", False), ("db", True), ("db", True), ("db", True), ("db", False)]
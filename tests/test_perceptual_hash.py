@@ -0,0 +1,102 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from perceptual_hash import HashIndex, NearDuplicateIndex, dhash_bytes, from_hex, hamming, to_hex
+
+BACKENDS = [pytest.param(False, id="bktree"), pytest.param(True, id="numpy")]
+
+
+def _photo(size, quality=90, seed=1):
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (400, 300), (240, 240, 230))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rnd.randrange(360), rnd.randrange(260)
+        draw.ellipse((x, y, x + rnd.randrange(20, 120), y + rnd.randrange(20, 120)),
+                     fill=tuple(rnd.randrange(256) for _ in range(3)))
+    buf = io.BytesIO()
+    img.resize(size).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _near(value, bits, rnd):
+    for bit in rnd.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def _hashes(n=400, seed=7):
+    """Random hashes plus a few planted near duplicates."""
+    rnd = random.Random(seed)
+    items = [(i, rnd.getrandbits(64)) for i in range(n)]
+    for i in range(n, n + 40):
+        items.append((i, _near(items[rnd.randrange(n)][1], rnd.randrange(9), rnd)))
+    return items
+
+
+def _brute_pairs(items, threshold):
+    return {(a, b, hamming(ha, hb)) for (a, ha) in items for (b, hb) in items
+            if a < b and hamming(ha, hb) <= threshold}
+
+
+def test_dhash_survives_resize_and_recompression():
+    original = dhash_bytes(_photo((400, 300)))
+    assert hamming(original, dhash_bytes(_photo((200, 150), quality=40))) <= 4
+    assert hamming(original, dhash_bytes(_photo((400, 300), seed=2))) > 10
+    assert dhash_bytes(b"<html>not an image</html>") is None
+
+
+def test_hex_round_trip():
+    assert to_hex(5) == "0000000000000005"
+    assert from_hex(to_hex(2 ** 64 - 1)) == 2 ** 64 - 1
+    assert from_hex("") is None and from_hex("zz") is None
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_index_pairs_and_query_match_brute_force(use_numpy):
+    items = _hashes()
+    index = HashIndex(items + [(999, None)], use_numpy=use_numpy)
+    assert len(index) == len(items)
+    for threshold in (0, 3, 7):
+        assert set(index.pairs(threshold)) == _brute_pairs(items, threshold)
+    value = items[3][1]
+    assert sorted(index.query(value, 7)) == sorted((i, hamming(value, h)) for i, h in items
+                                                   if hamming(value, h) <= 7)
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_clusters_largest_first(use_numpy):
+    far = 0xFFFF << 48
+    items = [(1, 0), (2, 1), (3, 3), (4, far), (5, far + 1), (6, 2 ** 40 - 1)]
+    assert HashIndex(items, use_numpy=use_numpy).clusters(2) == [[1, 2, 3], [4, 5]]
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_incremental_updates_match_rebuild(use_numpy):
+    items = _hashes(seed=3)
+    rnd = random.Random(11)
+    index = NearDuplicateIndex(max_distance=7, rebuild_ratio=1.0, use_numpy=use_numpy)
+    index.rebuild(items[:300])
+    current = dict(items[:300])
+    for step in range(60):
+        if step % 3 == 0:  # 删掉
+            item_id = rnd.choice(sorted(current))
+            current.pop(item_id)
+            change = (item_id, None)
+        elif step % 3 == 1:  # 新增（从没进过快照的）
+            item_id, value = items[300 + step]
+            current[item_id] = value
+            change = (item_id, value)
+        else:  # 哈希变了：改成某张现有照片的近似
+            item_id = rnd.choice(sorted(current))
+            current[item_id] = _near(current[rnd.choice(sorted(current))], 2, rnd)
+            change = (item_id, current[item_id])
+        index.update([change])
+
+    fresh = NearDuplicateIndex(max_distance=7, use_numpy=use_numpy)
+    fresh.rebuild(list(current.items()))
+    assert index.edges == fresh.edges
+    assert index.clusters(4) == fresh.clusters(4)
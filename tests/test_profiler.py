@@ -0,0 +1,28 @@
+import os
+
+import main
+
+
+def test_streamed_page_profiled_after_body(admin):
+    resp = admin.get("/album/alpha?__profile=store")
+    assert resp.is_streamed
+    name = resp.headers["X-Profile-Id"]
+    path = os.path.join(main.PROFILE_DIR, name)
+    assert not os.path.exists(path)  # profiler 还在跑，等 body 发完
+    resp.get_data()
+    resp.close()
+    assert os.path.isfile(path)
+    assert main.profile_store.path(name) == path
+
+
+def test_streamed_page_return_mode_buffers_body(admin):
+    resp = admin.get("/story_list?__profile=return")
+    assert resp.headers["X-Profile-Status"] == "200"
+    assert resp.mimetype == "text/plain"
+    assert "<html" not in resp.get_data(as_text=True).lower()  # 页面被缓冲跑完，返回的是 profile
+    assert resp.headers["Content-Disposition"].endswith('.folded"')
+
+
+def test_buffered_page_profile_id(admin):
+    resp = admin.get("/album?__profile=store")
+    assert main.profile_store.path(resp.headers["X-Profile-Id"])
@@ -0,0 +1,71 @@
+import pytest
+
+import main
+from query_recorder import QueryBudgetExceeded
+
+# 每个有预算的页面 / API 都在这里请求一次；新加预算时把路径也加进来
+PAGES = {
+    "albums": "/album",
+    "view_album": "/album/alpha",
+    "story_list": "/story_list",
+    "private_space": "/private_space",
+    "api_albums": "/api/albums",
+    "api_album_photos": "/api/albums/alpha/photos",
+    "api_photos": "/api/photos",
+    "api_stories": "/api/stories",
+    "api_changes": "/api/changes?since=WzAsMF0",  # [0, 0]
+}
+
+
+def fetch(client, path):
+    """GET path and consume the whole body, so streamed pages run their queries and close callbacks."""
+    resp = client.get(path)
+    resp.get_data()
+    resp.close()
+    return resp
+
+
+def test_every_budget_has_a_page():
+    assert set(PAGES) == set(main.QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize("endpoint", sorted(PAGES))
+def test_page_within_budget(admin, endpoint):
+    with main.query_recorder.override(mode="raise"):
+        resp = fetch(admin, PAGES[endpoint])
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize("endpoint", ["albums", "api_albums"])
+def test_buffered_page_over_budget_raises(admin, endpoint):
+    with main.query_recorder.override(mode="raise", budgets={endpoint: 0}):
+        with pytest.raises(QueryBudgetExceeded):
+            fetch(admin, PAGES[endpoint])
+
+
+@pytest.mark.parametrize("endpoint", ["view_album", "story_list"])
+def test_streamed_page_checked_once_after_body(admin, endpoint, monkeypatch):
+    checked = []
+    monkeypatch.setattr(main.query_recorder, "check", lambda ep, shapes: checked.append((ep, len(shapes))))
+    with main.query_recorder.override(mode="warn"):
+        resp = admin.get(PAGES[endpoint])
+        assert resp.is_streamed
+        assert checked == []  # after_request 不查，body 还没生成
+        resp.get_data()
+        resp.close()
+    assert len(checked) == 1
+    assert checked[0][0] == endpoint
+    assert checked[0][1] >= 1  # 流里的查询也算进去了
+
+
+def test_streamed_page_over_budget_raises_on_close(admin):
+    with main.query_recorder.override(mode="raise", budgets={"view_album": 0}):
+        with pytest.raises(QueryBudgetExceeded):
+            fetch(admin, PAGES["view_album"])
+
+
+def test_repeated_query_is_reported_as_n_plus_one():
+    shapes = ["sql: SELECT * FROM story_image WHERE story_id = ?"] * main.query_recorder.repeat_threshold
+    with main.query_recorder.override(mode="raise", budgets={"story_list": 100}):
+        with pytest.raises(QueryBudgetExceeded, match="N\\+1"):
+            main.query_recorder.check("story_list", shapes)
@@ -0,0 +1,21 @@
+import main
+
+
+def _fail():
+    raise RuntimeError('column photo.width does not exist')
+
+
+def test_forced_values(monkeypatch):
+    monkeypatch.setenv("XL_FLAG", "1")
+    assert main.supabase_schema_flag("XL_FLAG", _fail)
+    monkeypatch.setenv("XL_FLAG", "0")
+    assert not main.supabase_schema_flag("XL_FLAG", lambda: None)
+
+
+def test_auto_probes_supabase_once(monkeypatch):
+    monkeypatch.delenv("XL_FLAG", raising=False)
+    assert not main.supabase_schema_flag("XL_FLAG", lambda: None)  # 本地模式：没有 Supabase
+    monkeypatch.setattr(main, "use_supabase", True)
+    monkeypatch.setattr(main, "supabase", object())
+    assert main.supabase_schema_flag("XL_FLAG", lambda: None)
+    assert not main.supabase_schema_flag("XL_FLAG", _fail)  # 还没跑 SQL：关掉，不 500
@@ -0,0 +1,41 @@
+from storage_sync import SyncCheckpoint, list_supabase_prefix, walk_supabase
+
+
+class FakeBucket:
+    """bucket.list() like Supabase Storage: folders are entries without id / updated_at."""
+
+    def __init__(self, keys):
+        self.keys = keys  # key -> updated_at
+
+    def list(self, prefix, options):
+        entries = {}
+        for key, updated in self.keys.items():
+            parent, _, name = key.rpartition("/")
+            if parent == prefix:
+                entries[name] = {"name": name, "id": key, "updated_at": updated}
+            elif parent.startswith(prefix + "/" if prefix else ""):
+                folder = parent[len(prefix) + 1 if prefix else 0:].split("/", 1)[0]
+                entries.setdefault(folder, {"name": folder, "id": None, "updated_at": None})
+        assert options["sortBy"] == {"column": "name", "order": "asc"}
+        rows = [entries[n] for n in sorted(entries)]
+        return rows[options["offset"]:options["offset"] + options["limit"]]
+
+
+def test_folders_between_old_files_are_listed():
+    # 文件名排在文件夹前后都有；旧文件夹里全是早于水位线的文件
+    keys = {f"a{i:02d}.jpg": "2026-01-01T00:00:00" for i in range(7)}
+    keys.update({"m/x.jpg": "2026-01-01T00:00:00", "private/m/y.jpg": "2026-03-01T00:00:00",
+                 "z1.jpg": "2026-03-01T00:00:00", "z2.jpg": "2026-01-01T00:00:00"})
+    files, folders = list_supabase_prefix(FakeBucket(keys), "", since="2026-02-01T00:00:00", page_size=3)
+    assert [f["key"] for f in files] == ["z1.jpg"]
+    assert folders == ["m", "private"]
+
+
+def test_walk_supabase_resumes_from_checkpoint(tmp_path):
+    keys = {"alpha/1.jpg": "2026-01-01T00:00:00", "alpha/2.jpg": "2026-03-01T00:00:00",
+            "private/beta/3.jpg": "2026-01-01T00:00:00"}
+    checkpoint = SyncCheckpoint(str(tmp_path / "sync.json"))
+    checkpoint.advance("supabase", "alpha", "2026-02-01T00:00:00")
+    found = dict(walk_supabase(FakeBucket(keys), checkpoint, workers=2, page_size=2))
+    assert {p: [f["key"] for f in files] for p, files in found.items()} == {
+        "": [], "alpha": ["alpha/2.jpg"], "private": [], "private/beta": ["private/beta/3.jpg"]}
@@ -0,0 +1,46 @@
+import io
+
+from PIL import Image
+
+import main
+from admission import DecodeGate
+
+
+def _jpeg():
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), (10, 120, 200)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def test_decode_slots_exhausted_is_503_not_a_dropped_image(admin, monkeypatch):
+    gate = DecodeGate(1, timeout=0.01, retry_after=7)
+    monkeypatch.setattr(main, "decode_gate", gate)
+    uploaded = []
+    monkeypatch.setattr(main, "upload_to_cloudinary", lambda data: uploaded.append(data) or "https://x/story.jpg")
+    with main.app.app_context():
+        before = main.Story.query.count()
+    gate._sem.acquire()  # 名额被别的请求占满
+    try:
+        resp = admin.post("/upload_story", data={
+            "story_text": "busy",
+            "story_images": [(io.BytesIO(_jpeg()), "a.jpg"), (io.BytesIO(_jpeg()), "b.jpg")],
+        }, content_type="multipart/form-data")
+    finally:
+        gate._sem.release()
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "7"
+    assert uploaded == []
+    with main.app.app_context():
+        assert main.Story.query.count() == before
+
+
+def test_pool_timings_reach_server_timing(admin, monkeypatch):
+    monkeypatch.setattr(main.cloudinary.uploader, "upload", lambda *a, **kw: {"secure_url": "https://x/story.jpg"})
+    resp = admin.post("/upload_story", data={
+        "story_text": "timed",
+        "story_images": [(io.BytesIO(_jpeg()), "a.jpg"), (io.BytesIO(_jpeg()), "b.jpg")],
+    }, content_type="multipart/form-data")
+    assert resp.status_code == 302
+    timing = resp.headers["Server-Timing"]
+    assert 'pillow;desc="2x"' in timing
+    assert 'cloudinary;desc="2x"' in timing
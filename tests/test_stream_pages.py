@@ -0,0 +1,48 @@
+import re
+from types import SimpleNamespace
+
+import main
+
+
+class FakeQuery:
+    """Just enough of a PostgREST builder for supabase_pages: order / or_ / limit / execute."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.pred = lambda r: True
+        self.n = None
+
+    def order(self, column, desc=False):
+        return self
+
+    def or_(self, expr):
+        m = re.fullmatch(r'(\w+)\.lt\."([^"]+)",and\(\1\.eq\."\2",id\.lt\.(\d+)\)', expr)
+        if m:
+            col, value, last = m.group(1), m.group(2), int(m.group(3))
+            self.pred = lambda r: r[col] is not None and (r[col] < value or (r[col] == value and r["id"] < last))
+            return self
+        m = re.fullmatch(r"and\((\w+)\.is\.null,id\.lt\.(\d+)\),\1\.not\.is\.null", expr)
+        col, last = m.group(1), int(m.group(2))
+        self.pred = lambda r: (r[col] is None and r["id"] < last) or r[col] is not None
+        return self
+
+    def limit(self, n):
+        self.n = n
+        return self
+
+    def execute(self):
+        # Postgres: DESC 时 NULL 排最前
+        rows = sorted((r for r in self.rows if self.pred(r)),
+                      key=lambda r: (r["created_at"] is None, r["created_at"] or "", r["id"]), reverse=True)
+        return SimpleNamespace(data=[dict(r) for r in rows[:self.n]])
+
+
+def test_keyset_pages_with_ties_and_concurrent_inserts():
+    table = [{"id": i, "created_at": None if i % 7 == 0 else f"2026-01-0{1 + i % 3}T00:00:00"} for i in range(1, 41)]
+    seen = []
+    for row in main.supabase_pages(lambda: FakeQuery(table), page_size=4):
+        seen.append(row["id"])
+        if len(seen) == 10:
+            # 边发边上传：新行排在游标前面，不会让后面的页错位
+            table.append({"id": 100, "created_at": "2026-02-01T00:00:00"})
+    assert sorted(seen) == list(range(1, 41))
@@ -0,0 +1,86 @@
+import io
+import struct
+import zipfile
+import zlib
+
+import pytest
+from PIL import Image
+
+from upload_guard import RejectedUpload, UploadPolicy, sniff
+
+
+def _image(fmt, size=(20, 10)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buf, fmt)
+    return buf.getvalue()
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def _png_header(width, height):
+    """A few dozen bytes of PNG whose header claims width x height pixels."""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + _chunk(b"IHDR", ihdr) + _chunk(b"IDAT", zlib.compress(b"")) + _chunk(b"IEND", b"")
+
+
+def _rejected(fn, *args):
+    with pytest.raises(RejectedUpload) as e:
+        fn(*args)
+    return e.value
+
+
+def test_magic_bytes_refuse_html_and_zip():
+    zipped = io.BytesIO()
+    with zipfile.ZipFile(zipped, "w") as zf:
+        zf.writestr("a.jpg", _image("JPEG"))
+    policy = UploadPolicy()
+    for data in (b"<!doctype html><script>alert(1)</script>", zipped.getvalue()):
+        assert sniff(data[:32]) is None
+        e = _rejected(policy.inspect_bytes, data)
+        assert (e.status, e.reason) == (415, "not an image")
+
+
+def test_accepts_allowed_formats_with_header_info():
+    policy = UploadPolicy()
+    for fmt in ("JPEG", "PNG", "WEBP", "GIF"):
+        info = policy.inspect_bytes(_image(fmt))
+        assert info == {"format": fmt, "mime_type": f"image/{fmt.lower()}", "width": 20, "height": 10}
+
+
+def test_format_allowlist():
+    policy = UploadPolicy(allowed_formats=("png",))
+    assert policy.mime_types == ("image/png",)
+    assert _rejected(policy.inspect_bytes, _image("JPEG")).reason == "image format JPEG not allowed"
+    # formats=：白名单外的解码插件不会被尝试（BMP 没有魔数检查，直接交给 Pillow）
+    assert _rejected(policy.check_header, io.BytesIO(_image("BMP"))).reason == "not a readable image"
+    assert UploadPolicy(allowed_formats=("BMP",)).check_header(io.BytesIO(_image("BMP")))["format"] == "BMP"
+
+
+def test_decompression_bomb_is_413():
+    e = _rejected(UploadPolicy(max_pixels=0).inspect_bytes, _png_header(30000, 30000))
+    assert e.status == 413 and e.reason.startswith("image too large")
+
+
+def test_pixel_limit_is_413():
+    e = _rejected(UploadPolicy(max_pixels=100).inspect_bytes, _image("PNG"))
+    assert (e.status, e.reason) == (413, "image too large (20x10 > 100 pixels)")
+    assert UploadPolicy(max_pixels=200).inspect_bytes(_image("PNG"))["width"] == 20
+
+
+def test_byte_limits():
+    assert _rejected(UploadPolicy().inspect_bytes, b"").status == 400
+    assert _rejected(UploadPolicy(max_bytes=100).inspect_bytes, _image("PNG", (200, 200))).status == 413
+
+
+def test_stream_position_restored():
+    data = _image("JPEG")
+    policy = UploadPolicy()
+    stream = io.BytesIO(data)
+    assert policy.inspect_stream(stream)["format"] == "JPEG"
+    assert stream.tell() == 0 and stream.read() == data
+
+    bad = io.BytesIO(b"<html>" * 10)
+    _rejected(policy.inspect_stream, bad)
+    assert bad.tell() == 0
@@ -0,0 +1,54 @@
+import io
+import threading
+import zipfile
+
+from zip_stream import entry_name, iter_zip
+
+
+def test_entry_names_unique_and_safe():
+    seen = set()
+    names = [entry_name(u, seen) for u in (
+        "https://x/storage/a/IMG%201.jpg", "/static/uploads/b/img 1.JPG", "/static/uploads/b/img 1.JPG",
+        "https://x/..\\evil.png", "https://x/", None)]
+    assert names == ["IMG 1.jpg", "img 1_1.JPG", "img 1_2.JPG", "_evil.png", "photo", "photo_1"]
+
+
+def test_archive_round_trip(tmp_path):
+    on_disk = tmp_path / "c.txt"
+    on_disk.write_bytes(b"text " * 1000)
+    sources = {"a.jpg": b"\xff\xd8" + b"j" * 200_000, "b.png": b"p" * 10, "c.txt": str(on_disk)}
+
+    def fetch(source):
+        if source == "gone":
+            raise KeyError("gone")
+        return sources[source]
+
+    entries = [("a.jpg", "a.jpg"), ("missing.jpg", "gone"), ("b.png", "b.png"), ("c.txt", "c.txt")]
+    chunks = list(iter_zip(entries, fetch, prefetch=2))
+    assert len(chunks) > 2  # 边压边发，不是一整块
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+        assert zf.namelist() == ["a.jpg", "b.png", "c.txt", "MISSING.txt"]
+        assert zf.read("a.jpg") == sources["a.jpg"] and zf.read("c.txt") == on_disk.read_bytes()
+        assert zf.getinfo("a.jpg").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("c.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read("MISSING.txt").decode().startswith("missing.jpg: ")
+
+
+def test_prefetch_window_bounded_and_stops_on_close():
+    fetched = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def fetch(source):
+        with lock:
+            fetched.append(source)
+        if source > 0:
+            release.wait(5)
+        return b"x" * 100
+
+    stream = iter_zip(((f"{i}.bin", i) for i in range(50)), fetch, prefetch=3)
+    assert next(stream)  # 第 0 个已经开始写了
+    assert len(fetched) <= 4  # 只看前 prefetch 个（+ 刚补进窗口的 1 个）
+    stream.close()  # 客户端断开：剩下的不再取
+    release.set()
+    assert len(fetched) <= 4
@@ -0,0 +1,121 @@
+# upload_guard.py —— 上传前置校验：魔数嗅探 + Pillow 只读文件头（格式白名单 / 像素上限 / 字节上限）
+"""
+Cheap validation of uploaded images before they are read or decoded.
+
+Checks run from cheapest to most expensive and stop at the first failure:
+
+1. size: the file's length (seek to the end of the spooled upload, or the
+   declared length) against `max_bytes`;
+2. magic bytes: the first SNIFF_BYTES must look like an allowed format, so
+   HTML, zips, executables etc. are refused without touching Pillow;
+3. header: `Image.open` parses only the header (JPEG markers up to SOF, PNG
+   IHDR, ...), never the pixel data; the format must be allowed and
+   width * height must stay under `max_pixels`, which stops decompression
+   bombs (a few KB of PNG that decode to gigabytes).
+
+Every check raises `RejectedUpload` with an HTTP status (413 / 415); the
+file position is restored so callers can read the stream afterwards.
+"""
+import io
+import os
+
+from PIL import Image, UnidentifiedImageError
+
+SNIFF_BYTES = 32
+
+# Pillow 的格式名 → 对外的格式名（MPO = 手机拍的多图 JPEG）
+FORMAT_ALIASES = {"MPO": "JPEG"}
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+class RejectedUpload(Exception):
+    def __init__(self, reason, status=415, filename=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.filename = filename
+
+
+def sniff(head):
+    """Format name from the first bytes of a file, or None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"avif"):
+        return "AVIF" if head[8:12] == b"avif" else "HEIF"
+    return None
+
+
+class UploadPolicy:
+    def __init__(self, allowed_formats=("JPEG", "PNG", "WEBP", "GIF"), max_bytes=64 * 1024 * 1024,
+                 max_pixels=80_000_000):
+        self.allowed = tuple(f.upper() for f in allowed_formats)
+        self.max_bytes = int(max_bytes)
+        self.max_pixels = int(max_pixels)
+
+    @property
+    def mime_types(self):
+        return tuple(MIME_TYPES[f] for f in self.allowed if f in MIME_TYPES)
+
+    def _plugins(self):
+        Image.init()  # 注册全部插件（MPO 等默认不加载）
+        return [f for f in (*self.allowed, *FORMAT_ALIASES) if f in Image.OPEN]
+
+    def check_size(self, nbytes):
+        if nbytes <= 0:
+            raise RejectedUpload("empty file", 400)
+        if self.max_bytes and nbytes > self.max_bytes:
+            raise RejectedUpload(f"file too large ({nbytes} > {self.max_bytes} bytes)", 413)
+
+    def check_head(self, head):
+        kind = sniff(head)
+        if kind is None:
+            raise RejectedUpload("not an image")
+        if kind not in self.allowed:
+            raise RejectedUpload(f"image format {kind} not allowed")
+        return kind
+
+    def check_header(self, fp):
+        """Parse the image header only; returns {format, mime_type, width, height}."""
+        try:
+            # formats=：只让白名单里的解码插件尝试，别的插件的解析代码根本不会跑
+            with Image.open(fp, formats=self._plugins()) as img:
+                fmt = FORMAT_ALIASES.get(img.format, img.format)
+                width, height = img.size
+        except Image.DecompressionBombError as e:
+            raise RejectedUpload(f"image too large: {e}", 413)
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            raise RejectedUpload("not a readable image")
+        if fmt not in self.allowed:
+            raise RejectedUpload(f"image format {fmt} not allowed")
+        if self.max_pixels and width * height > self.max_pixels:
+            raise RejectedUpload(f"image too large ({width}x{height} > {self.max_pixels} pixels)", 413)
+        return {"format": fmt, "mime_type": MIME_TYPES.get(fmt), "width": width, "height": height}
+
+    def inspect_stream(self, stream):
+        """Validate a seekable file object (werkzeug FileStorage.stream); position restored."""
+        start = stream.tell()
+        try:
+            stream.seek(0, os.SEEK_END)
+            self.check_size(stream.tell() - start)
+            stream.seek(start)
+            self.check_head(stream.read(SNIFF_BYTES))
+            stream.seek(start)
+            info = self.check_header(stream)
+        finally:
+            stream.seek(start)
+        return info
+
+    def inspect_bytes(self, data):
+        self.check_size(len(data))
+        self.check_head(data[:SNIFF_BYTES])
+        return self.check_header(io.BytesIO(data))
+
+    def inspect_path(self, path):
+        with open(path, "rb") as fh:
+            return self.inspect_stream(fh)
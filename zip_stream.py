@@ -0,0 +1,130 @@
+# zip_stream.py —— 边取边压的 ZIP 流（相册打包下载）
+"""
+Build a ZIP archive on the fly as a generator of byte chunks.
+
+zipfile writes to an unseekable sink (sizes/CRC go into data descriptors), so
+nothing is buffered beyond the current chunk. Sources are fetched by a small
+thread pool with a bounded look-ahead window: memory stays at roughly
+`prefetch` photos whatever the album size, and the first entry is streamed
+while later ones are still downloading.
+"""
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote
+
+# already-compressed formats: deflate only burns CPU
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif", ".mp4", ".mov", ".zip"}
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Write-only, unseekable file object; the generator drains it after each write."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def entry_name(url, seen, fallback="photo"):
+    """File name inside the archive, taken from the url and made unique."""
+    name = os.path.basename(unquote(urlparse(url or "").path)) or fallback
+    name = name.replace("\\", "_").lstrip(".") or fallback
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate.lower() in seen:
+        candidate = f"{base}_{n}{ext}"
+        n += 1
+    seen.add(candidate.lower())
+    return candidate
+
+
+def _compress_type(arcname):
+    ext = os.path.splitext(arcname)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries, fetch, prefetch=4):
+    """
+    entries: iterable of (arcname, source); fetch(source) returns bytes or a
+    local file path and runs on worker threads. Failed sources are skipped and
+    listed in MISSING.txt at the end of the archive. Yields ZIP bytes.
+    """
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", allowZip64=True)
+    pool = ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="zip-prefetch")
+    window = deque()
+    pending = iter(entries)
+    failures = []
+
+    def submit_next():
+        for arcname, source in pending:
+            window.append((arcname, pool.submit(fetch, source)))
+            return
+
+    try:
+        for _ in range(max(1, prefetch)):
+            submit_next()
+
+        while window:
+            arcname, future = window.popleft()
+            submit_next()
+            try:
+                payload = future.result()
+            except Exception as e:
+                failures.append(f"{arcname}: {e}")
+                continue
+
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = _compress_type(arcname)
+            if isinstance(payload, (bytes, bytearray)):
+                info.file_size = len(payload)
+                with zf.open(info, "w") as dst:
+                    for i in range(0, len(payload), CHUNK_SIZE):
+                        dst.write(payload[i:i + CHUNK_SIZE])
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+            else:
+                info.file_size = os.path.getsize(payload)
+                with open(payload, "rb") as src, zf.open(info, "w") as dst:
+                    while True:
+                        block = src.read(CHUNK_SIZE)
+                        if not block:
+                            break
+                        dst.write(block)
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+            payload = None
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+        if failures:
+            zf.writestr("MISSING.txt", "\n".join(failures) + "\n")
+        zf.close()
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    finally:
+        # client went away mid-download: don't keep fetching the rest
+        pool.shutdown(wait=False, cancel_futures=True)